@@ -0,0 +1,427 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# Detect faces or persons in a folder of images and write training-ready crops.
+#
+# Detection and cropping are separate steps: detections are cached per image (keyed by path, size, mtime and the
+# detector settings), so the crop settings can be changed and re-run without detecting again. The DNN detector
+# runs N images (or N tiles of large images) per forward pass; images are decoded on a thread pool ahead of the
+# network, and on CPU-only hosts the folder can be split over several processes, each with its own network.
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+CACHE_FILENAME = "detections.json"
+
+
+class HaarFaceDetector:
+    """Frontal face detector using OpenCV's Haar cascade. Detects one image at a time."""
+
+    label = "face"
+
+    def __init__(self, scale_factor=1.1, min_neighbors=5, cascade="haarcascade_frontalface_default.xml"):
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.cascade = cascade
+        self.classifier = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, cascade))
+
+    def detect(self, images) -> list:
+        results = []
+        for image in images:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+            faces = self.classifier.detectMultiScale(gray, scaleFactor=self.scale_factor, minNeighbors=self.min_neighbors)
+            results.append([[int(x), int(y), int(w), int(h), 1.0] for x, y, w, h in faces])
+        return results
+
+
+class DnnDetector:
+    """
+    YOLO-style object detector run with OpenCV's DNN module (Darknet .cfg/.weights or ONNX).
+
+    The network output rows are expected as (center x, center y, width, height, objectness, class scores...),
+    either relative to the input (Darknet) or in input pixels (e.g. YOLOv5 ONNX exports). Images are resized, not
+    letterboxed, to input_size x input_size; batch_size images or tiles go through each forward pass.
+    With tile_size > 0 images larger than a tile are also cut into overlapping tiles, so small persons in large
+    images are found; detections of all tiles and the whole image are merged by non-maximum suppression.
+    """
+
+    label = "person"
+
+    def __init__(
+        self,
+        model_path,
+        config_path=None,
+        class_id=0,
+        confidence=0.5,
+        nms_threshold=0.4,
+        input_size=416,
+        batch_size=8,
+        tile_size=0,
+        tile_overlap=0.2,
+        cuda=False,
+    ):
+        self.model_path = model_path
+        self.config_path = config_path
+        self.class_id = class_id
+        self.confidence = confidence
+        self.nms_threshold = nms_threshold
+        self.input_size = input_size
+        self.batch_size = max(1, batch_size)
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.net = cv2.dnn.readNet(model_path, config_path) if config_path else cv2.dnn.readNet(model_path)
+        if cuda:
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
+        else:
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_DEFAULT)
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        # resolved once, not per image
+        self.output_layers = self.net.getUnconnectedOutLayersNames()
+
+    def tiles(self, image) -> list:
+        # (x, y, width, height) regions of an image that are run through the network
+        height, width = image.shape[:2]
+        regions = [(0, 0, width, height)]
+        if self.tile_size <= 0 or max(width, height) <= self.tile_size:
+            return regions
+        stride = max(1, int(self.tile_size * (1.0 - self.tile_overlap)))
+        for y in range(0, max(height - self.tile_size, 0) + stride, stride):
+            for x in range(0, max(width - self.tile_size, 0) + stride, stride):
+                x0, y0 = min(x, max(width - self.tile_size, 0)), min(y, max(height - self.tile_size, 0))
+                regions.append((x0, y0, min(self.tile_size, width), min(self.tile_size, height)))
+        return list(dict.fromkeys(regions))
+
+    def forward(self, crops) -> list:
+        # one output array of shape (rows, 5 + classes) per crop
+        blob = cv2.dnn.blobFromImages(crops, 1 / 255.0, (self.input_size, self.input_size), swapRB=True, crop=False)
+        self.net.setInput(blob)
+        outputs = self.net.forward(self.output_layers)
+        per_crop = [[] for _ in crops]
+        for output in outputs:
+            output = np.asarray(output)
+            if output.ndim == 2:
+                output = output.reshape(len(crops), -1, output.shape[-1])
+            for i in range(len(crops)):
+                per_crop[i].append(output[i].reshape(-1, output.shape[-1]))
+        return [np.concatenate(rows) for rows in per_crop]
+
+    def detect(self, images) -> list:
+        jobs = []  # (image index, region)
+        for index, image in enumerate(images):
+            jobs.extend((index, region) for region in self.tiles(image))
+
+        boxes = [[] for _ in images]
+        scores = [[] for _ in images]
+        for start in range(0, len(jobs), self.batch_size):
+            batch = jobs[start:start + self.batch_size]
+            crops = [images[index][y:y + h, x:x + w] for index, (x, y, w, h) in batch]
+            for (index, (x, y, w, h)), rows in zip(batch, self.forward(crops)):
+                class_scores = rows[:, 5:]
+                if class_scores.shape[1] <= self.class_id:
+                    continue
+                confidence = class_scores[:, self.class_id]
+                keep = (confidence > self.confidence) & (class_scores.argmax(axis=1) == self.class_id)
+                rows, confidence = rows[keep], confidence[keep]
+                if len(rows) == 0:
+                    continue
+                geometry = rows[:, :4].astype(np.float64)
+                if geometry.max() > 1.5:  # coordinates in network input pixels
+                    geometry /= self.input_size
+                center_x, center_y = geometry[:, 0] * w + x, geometry[:, 1] * h + y
+                box_w, box_h = geometry[:, 2] * w, geometry[:, 3] * h
+                boxes[index].extend(np.stack([center_x - box_w / 2, center_y - box_h / 2, box_w, box_h], axis=1).tolist())
+                scores[index].extend(confidence.tolist())
+
+        results = []
+        for image, image_boxes, image_scores in zip(images, boxes, scores):
+            keep = cv2.dnn.NMSBoxes(image_boxes, image_scores, self.confidence, self.nms_threshold) if image_boxes else []
+            height, width = image.shape[:2]
+            detections = []
+            for i in np.asarray(keep).reshape(-1):
+                bx, by, bw, bh = image_boxes[i]
+                x0, y0 = max(int(bx), 0), max(int(by), 0)
+                x1, y1 = min(int(bx + bw), width), min(int(by + bh), height)
+                if x1 > x0 and y1 > y0:
+                    detections.append([x0, y0, x1 - x0, y1 - y0, float(image_scores[i])])
+            results.append(detections)
+        return results
+
+
+def make_detector(spec: dict):
+    spec = dict(spec)
+    kind = spec.pop("detector")
+    return HaarFaceDetector(**spec) if kind == "haar" else DnnDetector(**spec)
+
+
+class DetectionCache:
+    """Detections per image, stored as JSON next to the crops."""
+
+    def __init__(self, path, signature: dict):
+        self.path = path
+        self.key = hashlib.sha1(json.dumps(signature, sort_keys=True).encode()).hexdigest()[:16]
+        self.entries = {}
+        if path and os.path.isfile(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable detection cache {path}: {e}")
+
+    def _image_key(self, image_path):
+        stat = os.stat(image_path)
+        return f"{self.key}:{os.path.abspath(image_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def get(self, image_path):
+        return self.entries.get(self._image_key(image_path))
+
+    def put(self, image_path, shape, detections):
+        self.entries[self._image_key(image_path)] = {"shape": list(shape[:2]), "detections": detections}
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+
+def read_image(image_path):
+    return image_path, cv2.imread(image_path, cv2.IMREAD_COLOR)
+
+
+def iter_decoded(image_paths, decode_workers=4, prefetch=32):
+    """Yields (path, image) in order, decoding up to `prefetch` images ahead on a thread pool."""
+    with ThreadPoolExecutor(max_workers=max(1, decode_workers)) as pool:
+        pending = []
+        for image_path in image_paths:
+            pending.append(pool.submit(read_image, image_path))
+            if len(pending) >= prefetch:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+def detect_images(detector, image_paths, batch_size=8, decode_workers=4) -> dict:
+    """Returns {path: (image shape, detections)}; detections are [x, y, width, height, score] lists."""
+    results = {}
+    batch_paths, batch_images = [], []
+
+    def flush():
+        for image_path, image, detections in zip(batch_paths, batch_images, detector.detect(batch_images)):
+            results[image_path] = (image.shape[:2], detections)
+        batch_paths.clear()
+        batch_images.clear()
+
+    for image_path, image in iter_decoded(image_paths, decode_workers, prefetch=max(32, 2 * batch_size)):
+        if image is None:
+            print(f"Error processing {image_path}: could not read image")
+            results[image_path] = ((0, 0), [])  # cached as well, until the file changes
+            continue
+        batch_paths.append(image_path)
+        batch_images.append(image)
+        if len(batch_images) >= batch_size:
+            flush()
+    if batch_images:
+        flush()
+    return results
+
+
+_worker_detector = None
+
+
+def _init_worker(spec):
+    global _worker_detector
+    cv2.setNumThreads(1)  # one network per process, avoid oversubscribing the cores
+    _worker_detector = make_detector(spec)
+
+
+def _detect_chunk(image_paths, batch_size, decode_workers):
+    return detect_images(_worker_detector, image_paths, batch_size, decode_workers)
+
+
+def make_buckets(resolution, step=64, max_ratio=2.0):
+    """(width, height) buckets with about resolution^2 pixels, sides multiples of step."""
+    buckets = set()
+    area = resolution * resolution
+    width = step
+    while width <= resolution * max_ratio:
+        height = min(int(area // width) // step * step, int(resolution * max_ratio) // step * step)
+        if height >= step and max(width, height) / min(width, height) <= max_ratio:
+            buckets.add((width, height))
+            buckets.add((height, width))
+        width += step
+    return sorted(buckets)
+
+
+def crop_region(box, image_shape, target_ratio, margin=0.0):
+    """
+    Grows a detection box by margin (fraction of its size) to the target width / height ratio and moves it inside
+    the image. Returns integer (x0, y0, x1, y1); if the image is too small the region is shrunk to fit.
+    """
+    height, width = image_shape[:2]
+    x, y, w, h = box[:4]
+    center_x, center_y = x + w / 2, y + h / 2
+    w, h = w * (1 + margin), h * (1 + margin)
+    if w / h < target_ratio:
+        w = h * target_ratio
+    else:
+        h = w / target_ratio
+    scale = min(1.0, width / w, height / h)
+    w, h = w * scale, h * scale
+    x0 = min(max(center_x - w / 2, 0), width - w)
+    y0 = min(max(center_y - h / 2, 0), height - h)
+    return int(round(x0)), int(round(y0)), int(round(x0 + w)), int(round(y0 + h))
+
+
+def crop_detections(image, image_path, detections, output_folder, label, mode="square", resolution=512, margin=0.0, min_size=0, buckets=None):
+    """Writes one crop per detection, resized to resolution x resolution (square) or to the nearest bucket."""
+    written = 0
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    for detection in detections:
+        x, y, w, h = detection[:4]
+        if min(w, h) < min_size:
+            continue
+        if mode == "bucket":
+            ratio = w * (1 + margin) / (h * (1 + margin))
+            out_w, out_h = min(buckets, key=lambda b: abs(np.log(b[0] / b[1]) - np.log(ratio)))
+        else:
+            out_w, out_h = resolution, resolution
+        x0, y0, x1, y1 = crop_region(detection, image.shape, out_w / out_h, margin)
+        crop = image[y0:y1, x0:x1]
+        interpolation = cv2.INTER_AREA if crop.shape[1] > out_w else cv2.INTER_CUBIC
+        resized = cv2.resize(crop, (out_w, out_h), interpolation=interpolation)
+        output_filename = f"{stem}_{label}_{x}_{y}.jpg"
+        cv2.imwrite(os.path.join(output_folder, output_filename), resized)
+        written += 1
+    return written
+
+
+def run(args, detector_spec: dict, label: str):
+    os.makedirs(args.output_folder, exist_ok=True)
+    image_paths = sorted(
+        os.path.join(args.input_folder, filename)
+        for filename in os.listdir(args.input_folder)
+        if filename.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    start = time.perf_counter()
+
+    # the detector settings key the cache; batch size and CUDA do not change the result
+    signature_spec = {k: v for k, v in detector_spec.items() if k not in ("batch_size", "cuda")}
+    signature_spec["model_path"] = os.path.basename(signature_spec.get("model_path") or "")
+    signature_spec["config_path"] = os.path.basename(signature_spec.get("config_path") or "")
+    cache = DetectionCache(None if args.no_cache else os.path.join(args.output_folder, CACHE_FILENAME), signature_spec)
+    results = {}
+    missing = []
+    for image_path in image_paths:
+        entry = None if args.redetect else cache.get(image_path)
+        if entry is None:
+            missing.append(image_path)
+        else:
+            results[image_path] = (entry["shape"], entry["detections"])
+
+    if missing:
+        print(f"Detecting in {len(missing)} images ({len(results)} cached)...")
+        if args.processes > 1:
+            chunk = max(args.batch_size, len(missing) // (args.processes * 4) or 1)
+            with ProcessPoolExecutor(max_workers=args.processes, initializer=_init_worker, initargs=(detector_spec,)) as pool:
+                futures = [
+                    pool.submit(_detect_chunk, missing[i:i + chunk], args.batch_size, args.decode_workers)
+                    for i in range(0, len(missing), chunk)
+                ]
+                for future in futures:
+                    results.update(future.result())
+        else:
+            results.update(detect_images(make_detector(detector_spec), missing, args.batch_size, args.decode_workers))
+        for image_path in missing:
+            if image_path in results:
+                cache.put(image_path, *results[image_path])
+        cache.save()
+    detect_time = time.perf_counter() - start
+
+    buckets = make_buckets(args.resolution) if args.mode == "bucket" else None
+    crops = 0
+    with_detections = [image_path for image_path in image_paths if image_path in results and results[image_path][1]]
+    for image_path, image in iter_decoded(with_detections, args.decode_workers):
+        if image is None:
+            continue
+        crops += crop_detections(
+            image, image_path, results[image_path][1], args.output_folder, label,
+            args.mode, args.resolution, args.margin, args.min_size, buckets,
+        )
+    elapsed = time.perf_counter() - start
+    print(
+        f"{crops} crops from {len(with_detections)} of {len(image_paths)} images in {elapsed:.1f}s "
+        f"(detection {detect_time:.1f}s, {len(missing) / max(detect_time, 1e-9):.1f} images/s)"
+    )
+
+
+def add_common_arguments(parser, input_folder, output_folder, mode, resolution):
+    parser.add_argument("--input_folder", type=str, default=input_folder, help=f"folder with the images (default: {input_folder})")
+    parser.add_argument("--output_folder", type=str, default=output_folder, help=f"folder the crops are written to (default: {output_folder})")
+    parser.add_argument("--mode", choices=["square", "bucket"], default=mode, help="square: resolution x resolution crops; bucket: crops sized to the nearest aspect ratio bucket of about resolution^2 pixels")
+    parser.add_argument("--resolution", type=int, default=resolution, help="output resolution in pixels")
+    parser.add_argument("--margin", type=float, default=0.0, help="grow each detection by this fraction of its size before cropping")
+    parser.add_argument("--min_size", type=int, default=0, help="ignore detections smaller than this many pixels")
+    parser.add_argument("--batch_size", type=int, default=8, help="images (or tiles) per forward pass")
+    parser.add_argument("--decode_workers", type=int, default=4, help="threads decoding images ahead of the detector")
+    parser.add_argument("--processes", type=int, default=1, help="split detection over this many processes, each with its own model (CPU-only hosts)")
+    parser.add_argument("--no_cache", action="store_true", help=f"do not read or write {CACHE_FILENAME} in the output folder")
+    parser.add_argument("--redetect", action="store_true", help="ignore cached detections")
+
+
+def add_dnn_arguments(parser, model_path=None, config_path=None):
+    parser.add_argument("--model", type=str, default=model_path, required=model_path is None, help="Darknet .weights or ONNX model")
+    parser.add_argument("--config", type=str, default=config_path, help="Darknet .cfg file, not used for ONNX models")
+    parser.add_argument("--class_id", type=int, default=0, help="class to crop (0 is person for COCO models)")
+    parser.add_argument("--confidence", type=float, default=0.5, help="minimum class confidence")
+    parser.add_argument("--nms_threshold", type=float, default=0.4, help="overlap above which duplicate detections are merged")
+    parser.add_argument("--input_size", type=int, default=416, help="network input size")
+    parser.add_argument("--tile_size", type=int, default=0, help="also detect on overlapping tiles of this size in larger images (0: off)")
+    parser.add_argument("--tile_overlap", type=float, default=0.2, help="overlap between tiles")
+    parser.add_argument("--cuda", action="store_true", help="run the network with OpenCV's CUDA backend")
+
+
+def dnn_spec(args) -> dict:
+    return {
+        "detector": "dnn",
+        "model_path": args.model,
+        "config_path": args.config,
+        "class_id": args.class_id,
+        "confidence": args.confidence,
+        "nms_threshold": args.nms_threshold,
+        "input_size": args.input_size,
+        "batch_size": args.batch_size,
+        "tile_size": args.tile_size,
+        "tile_overlap": args.tile_overlap,
+        "cuda": args.cuda,
+    }
+
+
+def haar_spec(args) -> dict:
+    return {"detector": "haar", "scale_factor": args.scale_factor, "min_neighbors": args.min_neighbors}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect faces or persons and write training-ready crops")
+    parser.add_argument("detector", choices=["haar", "dnn"], help="haar: frontal faces; dnn: YOLO model through OpenCV DNN")
+    add_common_arguments(parser, "crop_input_folder", "crop_output_folder", "square", 512)
+    add_dnn_arguments(parser, model_path="yolov3.weights", config_path="yolov3.cfg")
+    parser.add_argument("--scale_factor", type=float, default=1.1, help="Haar cascade scale factor")
+    parser.add_argument("--min_neighbors", type=int, default=5, help="Haar cascade min neighbors")
+    args = parser.parse_args()
+
+    if args.detector == "haar":
+        run(args, haar_spec(args), HaarFaceDetector.label)
+    else:
+        run(args, dnn_spec(args), DnnDetector.label)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,42 @@
+import argparse
 import os
-from collections import Counter
+import sys
 
-def get_top_terms(folder_path):
-    all_terms = []
+# the tag statistics are shared with the GUI's manual captioning quick tags
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from kohya_gui.tag_statistics import TagIndex
 
-    for (root,dirs,files) in os.walk('folder_path', topdown=True):
-        print(folder_path)
-        for file in files:
-            print(file)
-            if file.endswith('.txt'):
-                file_path = os.path.join(root, file)
-                with open(file_path, 'r') as file:
-                    terms = file.read().strip().split(',')
-                    all_terms.extend(terms)
 
-    term_counts = Counter(all_terms)
-    top_terms = term_counts.most_common(10)
+def get_top_terms(folder_path, n=10, caption_ext=".txt"):
+    # only caption files that changed since the last run are read again
+    return TagIndex(folder_path, caption_ext).refresh().most_common(n)
 
-    return top_terms
 
-folder_path = 'E:\git_projx\kohya_ss\aa_train_test_utils\Test\image\50_test'
+def main():
+    parser = argparse.ArgumentParser(description="Report the most frequent tags of the caption files in a folder tree.")
+    parser.add_argument("folder_path", nargs="?", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "Test", "image", "50_test"),
+                        help="folder with the caption files, searched recursively (default: Test/image/50_test)")
+    parser.add_argument("--caption_ext", type=str, default=".txt", help="caption file extension")
+    parser.add_argument("--top", type=int, default=10, help="number of tags to report")
+    parser.add_argument("--cooccurring", type=int, default=0, help="also list this many tags most often found together with each reported tag")
+    args = parser.parse_args()
 
-if not os.path.isabs(folder_path):
-    folder_path = os.path.abspath(folder_path)
+    folder_path = os.path.abspath(args.folder_path)
+    if not os.path.isdir(folder_path):
+        print(f"Folder {folder_path} does not exist")
+        return
 
-print("started")
-top_terms = get_top_terms(folder_path)
+    print("started")
+    index = TagIndex(folder_path, args.caption_ext).refresh()
+    top_terms = index.most_common(args.top)
 
-print('Top 10 terms with highest frequency:')
-for term, count in top_terms:
-    print(f'Term: {term.strip()}, Count: {count}')
+    print(f"Top {args.top} terms with highest frequency:")
+    for term, count in top_terms:
+        print(f"Term: {term}, Count: {count}")
+        if args.cooccurring:
+            together = ", ".join(f"{tag} ({captions})" for tag, captions in index.cooccurring(term, args.cooccurring))
+            print(f"    often with: {together}")
+
+
+if __name__ == "__main__":
+    main()
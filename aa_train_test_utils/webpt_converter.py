@@ -1,28 +1,52 @@
-from PIL import Image
+import argparse
 import os
+import sys
 
+# the shared transcoding pool lives next to the other image tools
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+from image_transcode import IMAGE_EXTENSIONS, output_path, transcode_images
 
-def convert_to_jpg(image_path):
-    image = Image.open(image_path)
-    new_image_path = os.path.splitext(image_path)[0] + ".jpg"
-    image.convert("RGB").save(new_image_path, "JPEG")
-    image.close()
-    os.remove(image_path)
 
-
-def convert_images_to_jpg(directory):
+def find_non_jpg_images(directory):
     for root, dirs, files in os.walk(directory):
-        for file in files:
+        for file in sorted(files):
             file_path = os.path.join(root, file)
             if file.lower().endswith((".jpg", ".jpeg")):
-                print(f"Skipping {file_path} (already a JPG)")
                 continue
-            try:
-                convert_to_jpg(file_path)
-                print(f"Converted {file_path} to JPG")
-            except Exception as e:
-                print(f"Error converting {file_path}: {e}")
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                yield file_path
+
+
+def convert_images_to_jpg(directory, delete_originals=True, workers=None, max_in_flight=None, verbose=True):
+    return transcode_images(
+        ((file_path, output_path(file_path, "jpg")) for file_path in find_non_jpg_images(directory)),
+        save_kwargs={"format": "JPEG"},
+        mode="RGB",
+        delete_originals=delete_originals,
+        workers=workers,
+        max_in_flight=max_in_flight,
+        verbose=verbose,
+    )
+
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert every image below a folder to JPG, replacing the originals.")
+    parser.add_argument("directory", nargs="?", default="webp_input",
+                        help="the directory containing the images to be converted (default: webp_input)")
+    parser.add_argument("--keep_originals", action="store_true",
+                        help="keep the original files after conversion")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: number of CPU cores)")
+    parser.add_argument("--max_in_flight", type=int, default=None,
+                        help="maximum number of images queued or being converted at once (default: 4 per worker)")
+    parser.add_argument("--quiet", action="store_true",
+                        help="only print errors and the final summary")
+    args = parser.parse_args()
 
-# Usage example
-convert_images_to_jpg("webp_input")
+    convert_images_to_jpg(
+        args.directory,
+        delete_originals=not args.keep_originals,
+        workers=args.workers,
+        max_in_flight=args.max_in_flight,
+        verbose=not args.quiet,
+    )
@@ -1,23 +1,17 @@
 import gradio as gr
-import subprocess
+from .caption_pipeline import CaptionPipeline
 from .common_gui import (
     get_folder_path,
-    add_pre_postfix,
-    find_replace,
     scriptdir,
     list_dirs,
-    setup_environment,
 )
 import os
-import sys
 
 from .custom_logging import setup_logging
 
 # Set up logging
 log = setup_logging()
 
-PYTHON = sys.executable
-
 
 def caption_images(
     caption_text: str,
@@ -28,6 +22,9 @@ def caption_images(
     postfix: str,
     find_text: str,
     replace_text: str,
+    remove_tags: str = "",
+    dedup_tags: bool = False,
+    dry_run: bool = False,
 ):
     """
     Captions images in a given directory with a given caption text.
@@ -41,6 +38,9 @@ def caption_images(
         postfix (str): Text to be added after the caption text.
         find_text (str): Text to be replaced in the caption files.
         replace_text (str): Text to replace the found text in the caption files.
+        remove_tags (str): Comma separated tags to remove from the caption files.
+        dedup_tags (bool): Whether to remove duplicate tags from the caption files.
+        dry_run (bool): Only log the changes as a diff, without writing any file.
 
     Returns:
         None
@@ -59,62 +59,32 @@ def caption_images(
         )
         return
 
+    if not os.path.isdir(images_dir):
+        log.error(f"The provided path '{images_dir}' is not a valid folder.")
+        return
+
     # Log the captioning process
     if caption_text:
         log.info(f"Captioning files in {images_dir} with {caption_text}...")
 
-        # Build the command to run caption.py
-        run_cmd = [
-            rf"{PYTHON}",
-            rf"{scriptdir}/tools/caption.py",
-            "--caption_text",
-            caption_text,
-        ]
-
-        # Add optional flags to the command
-        if overwrite:
-            run_cmd.append("--overwrite")
-        if caption_ext:
-            run_cmd.append("--caption_file_ext")
-            run_cmd.append(caption_ext)
-
-        run_cmd.append(rf"{images_dir}")
-
-        # Reconstruct the safe command string for display
-        command_to_run = " ".join(run_cmd)
-        log.info(f"Executing command: {command_to_run}")
-
-        # Set the environment variable for the Python path
-        env = setup_environment()
+    # Show a message if modification is not possible without overwrite option enabled
+    if not overwrite and (prefix or postfix or find_text or remove_tags or dedup_tags):
+        log.info(
+            'Could not modify caption files with requested change because the "Overwrite existing captions in folder" option is not selected.'
+        )
 
-        # Run the command in the sd-scripts folder context
-        subprocess.run(run_cmd, env=env, shell=False)
-
-    # Check if overwrite option is enabled
-    if overwrite:
-        # Add prefix and postfix to caption files or find and replace text in caption files
-        if prefix or postfix or find_text:
-            # Add prefix and/or postfix to caption files
-            add_pre_postfix(
-                folder=images_dir,
-                caption_file_ext=caption_ext,
-                prefix=prefix,
-                postfix=postfix,
-            )
-            # Replace specified text in caption files if find and replace text is provided
-            if find_text:
-                find_replace(
-                    folder_path=images_dir,
-                    caption_file_ext=caption_ext,
-                    search_text=find_text,
-                    replace_text=replace_text,
-                )
-    else:
-        # Show a message if modification is not possible without overwrite option enabled
-        if prefix or postfix:
-            log.info(
-                'Could not modify caption files with requested change because the "Overwrite existing captions in folder" option is not selected.'
-            )
+    # Create, prefix/postfix, find/replace and clean up every caption file in a single pass
+    CaptionPipeline(
+        caption_ext=caption_ext,
+        caption_text=caption_text,
+        overwrite=overwrite,
+        prefix=prefix,
+        postfix=postfix,
+        find_text=find_text,
+        replace_text=replace_text,
+        remove_tags=remove_tags,
+        dedup_tags=dedup_tags,
+    ).run(images_dir, dry_run=dry_run)
 
     # Log the end of the captioning process
     log.info("Captioning done.")
@@ -246,6 +216,26 @@ def gradio_basic_caption_gui_tab(headless=False, default_images_dir=None):
                 interactive=True,
                 lines=2,
             )
+        # Row for tag cleanup options
+        with gr.Row():
+            # Textbox for tags to remove
+            remove_tags = gr.Textbox(
+                label="Tags to remove",
+                placeholder='(Optional) Comma separated, e.g., "1girl, solo"',
+                interactive=True,
+            )
+            # Checkbox to remove duplicate tags
+            dedup_tags = gr.Checkbox(
+                label="Remove duplicate tags",
+                interactive=True,
+                value=False,
+            )
+            # Checkbox to only preview the changes
+            dry_run = gr.Checkbox(
+                label="Dry run (log changes as a diff, write nothing)",
+                interactive=True,
+                value=False,
+            )
             # Button to caption images
             caption_button = gr.Button("Caption images")
             # Event handler for button click
@@ -260,6 +250,9 @@ def gradio_basic_caption_gui_tab(headless=False, default_images_dir=None):
                     postfix,
                     find_text,
                     replace_text,
+                    remove_tags,
+                    dedup_tags,
+                    dry_run,
                 ],
                 show_progress=False,
             )
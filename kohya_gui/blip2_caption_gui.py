@@ -1,9 +1,7 @@
-from PIL import Image
-from transformers import Blip2Processor, Blip2ForConditionalGeneration
-import torch
 import gradio as gr
 import os
 
+from .blip2_caption_service import get_blip2_caption_service
 from .common_gui import get_folder_path, scriptdir, list_dirs
 from .custom_logging import setup_logging
 
@@ -11,31 +9,6 @@ from .custom_logging import setup_logging
 log = setup_logging()
 
 
-def load_model():
-    # Set the device to GPU if available, otherwise use CPU
-    if hasattr(torch, 'cuda') and torch.cuda.is_available():
-        device = 'cuda'
-    elif hasattr(torch, 'mps') and torch.mps.is_available():
-        device = 'mps'
-    else:
-        device = 'cpu'
-
-
-    # Initialize the BLIP2 processor
-    processor = Blip2Processor.from_pretrained("Salesforce/blip2-opt-2.7b")
-    log.debug('Processor initialized: %s', processor)
-
-    # Initialize the BLIP2 model
-    model = Blip2ForConditionalGeneration.from_pretrained(
-        "Salesforce/blip2-opt-2.7b", torch_dtype=torch.float16
-    )
-
-    # Move the model to the specified device
-    model.to(device)
-
-    return processor, model, device
-
-
 def get_images_in_directory(directory_path):
     """
     Returns a list of image file paths found in the provided directory path.
@@ -67,10 +40,8 @@ def get_images_in_directory(directory_path):
 
 def generate_caption(
     file_list,
-    processor,
-    model,
-    device,
     caption_file_ext=".txt",
+    batch_size=1,
     num_beams=5,
     repetition_penalty=1.5,
     length_penalty=1.2,
@@ -81,57 +52,49 @@ def generate_caption(
     top_p=0.0,
 ):
     """
-    Fetches and processes each image in file_list, generates captions based on the image, and writes the generated captions to a file.
+    Captions the images in file_list with the resident BLIP2 worker and writes the generated captions to files.
 
     Parameters:
     - file_list: A list of file paths pointing to the images to be captioned.
-    - processor: The preprocessor for the BLIP2 model.
-    - model: The BLIP2 model to be used for generating captions.
-    - device: The device on which the computation is performed.
-    - extension: The extension for the output text files.
+    - caption_file_ext: The extension for the output text files.
+    - batch_size: Number of images captioned per generate call.
     - num_beams: Number of beams for beam search. Default: 5.
     - repetition_penalty: Penalty for repeating tokens. Default: 1.5.
     - length_penalty: Penalty for sentence length. Default: 1.2.
     - max_new_tokens: Maximum number of new tokens to generate. Default: 40.
     - min_new_tokens: Minimum number of new tokens to generate. Default: 20.
     """
-    for file_path in file_list:
-        image = Image.open(file_path)
-
-        inputs = processor(images=image, return_tensors="pt").to(device, torch.float16)
-
-        if top_p == 0.0:
-            generated_ids = model.generate(
-                **inputs,
-                num_beams=num_beams,
-                repetition_penalty=repetition_penalty,
-                length_penalty=length_penalty,
-                max_new_tokens=max_new_tokens,
-                min_new_tokens=min_new_tokens,
-            )
-        else:
-            generated_ids = model.generate(
-                **inputs,
-                do_sample=do_sample,
-                top_p=top_p,
-                max_new_tokens=max_new_tokens,
-                min_new_tokens=min_new_tokens,
-                temperature=temperature,
-            )
-
-        generated_text = processor.batch_decode(
-            generated_ids, skip_special_tokens=True
-        )[0].strip()
-
-        # Construct the output file path by replacing the original file extension with the specified extension
-        output_file_path = os.path.splitext(file_path)[0] + caption_file_ext
+    if top_p == 0.0:
+        generate_kwargs = dict(
+            num_beams=num_beams,
+            repetition_penalty=repetition_penalty,
+            length_penalty=length_penalty,
+            max_new_tokens=max_new_tokens,
+            min_new_tokens=min_new_tokens,
+        )
+    else:
+        generate_kwargs = dict(
+            do_sample=do_sample,
+            top_p=top_p,
+            max_new_tokens=max_new_tokens,
+            min_new_tokens=min_new_tokens,
+            temperature=temperature,
+        )
 
-        # Write the generated text to the output file
-        with open(output_file_path, "w", encoding="utf-8") as output_file:
-            output_file.write(generated_text)
+    def progress(done, total):
+        log.info(f"{done}/{total} captions generated")
 
-        # Log the image file path with a message about the fact that the caption was generated
-        log.info(f"{file_path} caption was generated")
+    stats = get_blip2_caption_service().caption(
+        file_list,
+        generate_kwargs,
+        caption_file_ext=caption_file_ext,
+        batch_size=batch_size,
+        num_workers=min(4, os.cpu_count() or 1),
+        progress=progress,
+    )
+    log.info(
+        f"{stats['captioned']} captions generated in {stats['elapsed']:.1f}s, {stats['failed']} images could not be read"
+    )
 
 
 def caption_images_beam_search(
@@ -142,6 +105,7 @@ def caption_images_beam_search(
     min_new_tokens,
     max_new_tokens,
     caption_file_ext,
+    batch_size=1,
 ):
     """
     Captions all images in the specified directory using the provided prompt.
@@ -155,13 +119,10 @@ def caption_images_beam_search(
         log.error(f"Directory {directory_path} does not exist.")
         return
 
-    processor, model, device = load_model()
     image_files = get_images_in_directory(directory_path)
     generate_caption(
         file_list=image_files,
-        processor=processor,
-        model=model,
-        device=device,
+        batch_size=int(batch_size),
         num_beams=int(num_beams),
         repetition_penalty=float(repetition_penalty),
         length_penalty=length_penalty,
@@ -179,6 +140,7 @@ def caption_images_nucleus(
     min_new_tokens,
     max_new_tokens,
     caption_file_ext,
+    batch_size=1,
 ):
     """
     Captions all images in the specified directory using the provided prompt.
@@ -192,13 +154,10 @@ def caption_images_nucleus(
         log.error(f"Directory {directory_path} does not exist.")
         return
 
-    processor, model, device = load_model()
     image_files = get_images_in_directory(directory_path)
     generate_caption(
         file_list=image_files,
-        processor=processor,
-        model=model,
-        device=device,
+        batch_size=int(batch_size),
         do_sample=do_sample,
         temperature=temperature,
         top_p=top_p,
@@ -208,6 +167,11 @@ def caption_images_nucleus(
     )
 
 
+def unload_model():
+    get_blip2_caption_service().shutdown()
+    log.info("BLIP2 model unloaded")
+
+
 def gradio_blip2_caption_gui_tab(headless=False, directory_path=None):
     from .common_gui import create_refresh_button
 
@@ -276,6 +240,16 @@ def gradio_blip2_caption_gui_tab(headless=False, directory_path=None):
                 value=".txt",
                 interactive=True,
             )
+            batch_size = gr.Number(
+                value=4,
+                label="Batch size",
+                interactive=True,
+                step=1,
+                minimum=1,
+                maximum=64,
+            )
+            unload_button = gr.Button("Unload model", elem_classes=["tool"])
+            unload_button.click(unload_model, show_progress=False)
 
         with gr.Row():
             with gr.Tab("Beam search"):
@@ -322,6 +296,7 @@ def gradio_blip2_caption_gui_tab(headless=False, directory_path=None):
                         min_new_tokens,
                         max_new_tokens,
                         caption_file_ext,
+                        batch_size,
                     ],
                 )
             with gr.Tab("Nucleus sampling"):
@@ -360,5 +335,6 @@ def gradio_blip2_caption_gui_tab(headless=False, directory_path=None):
                         min_new_tokens,
                         max_new_tokens,
                         caption_file_ext,
+                        batch_size,
                     ],
                 )
@@ -0,0 +1,268 @@
+import atexit
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from PIL import Image
+
+from .custom_logging import setup_logging
+
+# Set up logging
+log = setup_logging()
+
+DEFAULT_MODEL_ID = "Salesforce/blip2-opt-2.7b"
+DTYPES = {"float16": torch.float16, "bfloat16": torch.bfloat16, "float32": torch.float32}
+
+
+def get_device() -> str:
+    # Set the device to GPU if available, otherwise use CPU
+    if hasattr(torch, "cuda") and torch.cuda.is_available():
+        return "cuda"
+    elif hasattr(torch, "mps") and torch.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def load_blip2(model_id: str, dtype: torch.dtype, device: str):
+    """
+    Default model loader of the service: returns (processor, model) for a BLIP2 checkpoint on the Hub.
+
+    Any other loader passed to `Blip2CaptionService` must be a picklable top-level function with the same
+    signature. The returned processor has to support `processor(images=..., return_tensors="pt")` and
+    `processor.batch_decode(...)`, the model `model.generate(pixel_values=..., **generate_kwargs)`.
+    """
+    from transformers import Blip2Processor, Blip2ForConditionalGeneration
+
+    processor = Blip2Processor.from_pretrained(model_id)
+    log.debug("Processor initialized: %s", processor)
+    model = Blip2ForConditionalGeneration.from_pretrained(model_id, torch_dtype=dtype)
+    model.to(device)
+    model.eval()
+    return processor, model
+
+
+class ImageCaptionDataset(torch.utils.data.Dataset):
+    """
+    Decodes and preprocesses images in DataLoader workers. Unreadable images yield None and are skipped.
+    """
+
+    def __init__(self, file_list, processor):
+        self.file_list = list(file_list)
+        self.processor = processor
+
+    def __len__(self):
+        return len(self.file_list)
+
+    def __getitem__(self, index):
+        file_path = self.file_list[index]
+        try:
+            with Image.open(file_path) as image:
+                image = image.convert("RGB")
+            pixel_values = self.processor(images=image, return_tensors="pt")["pixel_values"][0]
+        except Exception as e:
+            return file_path, None, str(e)
+        return file_path, pixel_values, None
+
+
+def _collate(items):
+    paths = [path for path, pixel_values, _ in items if pixel_values is not None]
+    errors = [(path, error) for path, pixel_values, error in items if pixel_values is None]
+    pixel_values = torch.stack([pv for _, pv, _ in items if pv is not None]) if paths else None
+    return paths, pixel_values, errors
+
+
+def _write_caption(output_file_path: str, text: str):
+    with open(output_file_path, "w", encoding="utf-8") as output_file:
+        output_file.write(text)
+
+
+def caption_files(processor, model, device, dtype, job: dict, progress=None) -> dict:
+    """
+    Captions job["files"] in batches and writes the captions next to the images.
+
+    Images are decoded and preprocessed by `job["num_workers"]` DataLoader workers ahead of the GPU, and
+    caption files are written by a small thread pool so that generation never waits on disk.
+    """
+    file_list = job["files"]
+    batch_size = max(1, int(job.get("batch_size", 1)))
+    num_workers = max(0, int(job.get("num_workers", 0)))
+    loader = torch.utils.data.DataLoader(
+        ImageCaptionDataset(file_list, processor),
+        batch_size=batch_size,
+        num_workers=num_workers,
+        collate_fn=_collate,
+        pin_memory=device == "cuda",
+        prefetch_factor=2 if num_workers > 0 else None,
+        persistent_workers=False,
+    )
+
+    start = time.perf_counter()
+    done = 0
+    failed = 0
+    with ThreadPoolExecutor(max_workers=4) as writer:
+        pending = []
+        for paths, pixel_values, errors in loader:
+            for path, error in errors:
+                log.error(f"Could not read {path}: {error}")
+            failed += len(errors)
+            if paths:
+                pixel_values = pixel_values.to(device, dtype, non_blocking=True)
+                with torch.inference_mode():
+                    generated_ids = model.generate(pixel_values=pixel_values, **job["generate_kwargs"])
+                generated_texts = processor.batch_decode(generated_ids, skip_special_tokens=True)
+                for file_path, generated_text in zip(paths, generated_texts):
+                    # Construct the output file path by replacing the original file extension with the specified extension
+                    output_file_path = os.path.splitext(file_path)[0] + job["caption_file_ext"]
+                    pending.append(writer.submit(_write_caption, output_file_path, generated_text.strip()))
+            done += len(paths) + len(errors)
+            if progress is not None:
+                progress(done, len(file_list))
+        for future in pending:
+            future.result()
+
+    elapsed = time.perf_counter() - start
+    return {"captioned": done - failed, "failed": failed, "elapsed": elapsed}
+
+
+def _service_main(request_queue, response_queue, loader, max_models):
+    models = OrderedDict()  # (model_id, dtype name, device) -> (processor, model), least recently used first
+    device = get_device()
+    parent = multiprocessing.parent_process()
+    while True:
+        try:
+            request = request_queue.get(timeout=5.0)
+        except queue.Empty:
+            if parent is not None and not parent.is_alive():
+                break  # the GUI is gone without shutting the service down
+            continue
+        if request is None:
+            break
+        job_id, job = request
+        try:
+            dtype_name = job["dtype"]
+            if device == "cpu" and dtype_name == "float16":
+                dtype_name = "float32"  # half precision generation is not supported on CPU
+            key = (job["model_id"], dtype_name, device)
+            if key in models:
+                models.move_to_end(key)
+            else:
+                while len(models) >= max_models:
+                    models.popitem(last=False)
+                    if device == "cuda":
+                        torch.cuda.empty_cache()
+                response_queue.put((job_id, "status", f"Loading {job['model_id']} ({dtype_name}) on {device}..."))
+                models[key] = loader(job["model_id"], DTYPES[dtype_name], device)
+            processor, model = models[key]
+            stats = caption_files(
+                processor, model, device, DTYPES[dtype_name], job,
+                progress=lambda done, total: response_queue.put((job_id, "progress", (done, total))),
+            )
+            response_queue.put((job_id, "done", stats))
+        except Exception:
+            response_queue.put((job_id, "error", traceback.format_exc()))
+
+
+class Blip2CaptionService:
+    """
+    Resident BLIP2 captioning worker.
+
+    The model lives in a separate, long-lived process with a small cache keyed by (model id, dtype), so only
+    the first job pays for loading it. Jobs are processed one at a time; `caption` blocks until its job is done.
+    `shutdown` ends the process and frees the memory it holds.
+    """
+
+    def __init__(self, loader=load_blip2, max_models: int = 1):
+        self.loader = loader
+        self.max_models = max_models
+        self._lock = threading.Lock()
+        self._process = None
+        self._job_counter = 0
+
+    def is_alive(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+    def start(self):
+        if self.is_alive():
+            return
+        context = multiprocessing.get_context("spawn")
+        self._request_queue = context.Queue()
+        self._response_queue = context.Queue()
+        self._process = context.Process(
+            target=_service_main,
+            args=(self._request_queue, self._response_queue, self.loader, self.max_models),
+            daemon=False,  # the worker runs its own DataLoader worker processes
+        )
+        self._process.start()
+
+    def caption(
+        self,
+        file_list,
+        generate_kwargs: dict,
+        caption_file_ext: str = ".txt",
+        model_id: str = DEFAULT_MODEL_ID,
+        dtype: str = "float16",
+        batch_size: int = 1,
+        num_workers: int = 2,
+        progress=None,
+    ) -> dict:
+        job = {
+            "files": list(file_list),
+            "generate_kwargs": generate_kwargs,
+            "caption_file_ext": caption_file_ext,
+            "model_id": model_id,
+            "dtype": dtype,
+            "batch_size": batch_size,
+            "num_workers": num_workers,
+        }
+        with self._lock:
+            self.start()
+            self._job_counter += 1
+            job_id = self._job_counter
+            self._request_queue.put((job_id, job))
+            while True:
+                try:
+                    response_id, kind, payload = self._response_queue.get(timeout=1.0)
+                except queue.Empty:
+                    if not self.is_alive():
+                        self._process = None
+                        raise RuntimeError("BLIP2 captioning worker exited unexpectedly")
+                    continue
+                if response_id != job_id:
+                    continue  # left over from an interrupted caller
+                if kind == "status":
+                    log.info(payload)
+                elif kind == "progress":
+                    if progress is not None:
+                        progress(*payload)
+                elif kind == "done":
+                    return payload
+                else:
+                    raise RuntimeError(f"BLIP2 captioning failed:\n{payload}")
+
+    def shutdown(self, timeout: float = 10.0):
+        with self._lock:
+            if not self.is_alive():
+                self._process = None
+                return
+            self._request_queue.put(None)
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process = None
+
+
+_service = None
+
+
+def get_blip2_caption_service() -> Blip2CaptionService:
+    global _service
+    if _service is None:
+        _service = Blip2CaptionService()
+        atexit.register(_service.shutdown)
+    return _service
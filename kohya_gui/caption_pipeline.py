@@ -0,0 +1,219 @@
+import difflib
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from .custom_logging import setup_logging
+
+# Set up logging
+log = setup_logging()
+
+CAPTION_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def split_tags(text: str, tag_separator: str = ",") -> list:
+    # the separator is stripped so ", " and " | " also split captions written without the spaces
+    separator = tag_separator.strip() or ","
+    return [tag.strip() for tag in text.split(separator) if tag.strip()]
+
+
+class CaptionPipeline:
+    """
+    Applies all caption edits to each caption file in a single read/transform/write pass.
+
+    The steps run in this order, each one optional:
+        1. create: write `caption_text` for images without a caption (or for all images with `overwrite`)
+        2. prefix/postfix: same text layout as `add_pre_postfix`
+        3. find/replace: plain substring replacement, as `find_replace`
+        4. tag edits: put `first_tags` first, drop `remove_tags` (as tools/cleanup_captions.py) and duplicates;
+           captions are split and joined with `tag_separator`, the `first_tags` / `remove_tags` lists are
+           comma-separated
+
+    Steps 2-4 modify existing captions and therefore only run with `overwrite`, matching the previous
+    add_pre_postfix/find_replace chain. Files are only rewritten if their content changes, and every write
+    goes to a temporary file that is then renamed over the caption, so an interrupted run never leaves a
+    truncated caption behind.
+    """
+
+    def __init__(
+        self,
+        caption_ext: str,
+        caption_text: str = "",
+        overwrite: bool = False,
+        prefix: str = "",
+        postfix: str = "",
+        find_text: str = "",
+        replace_text: str = "",
+        first_tags: str = "",
+        remove_tags: str = "",
+        dedup_tags: bool = False,
+        tag_separator: str = ", ",
+        recursive: bool = False,
+        image_extensions: tuple = CAPTION_IMAGE_EXTENSIONS,
+    ):
+        self.caption_ext = caption_ext
+        self.caption_text = caption_text
+        self.overwrite = overwrite
+        self.prefix = prefix
+        self.postfix = postfix
+        self.find_text = find_text
+        self.replace_text = replace_text
+        self.first_tags = split_tags(first_tags)
+        self.remove_tags = set(split_tags(remove_tags))
+        self.dedup_tags = dedup_tags
+        self.tag_separator = tag_separator or ", "
+        self.recursive = recursive
+        self.image_extensions = image_extensions
+
+    def transform(self, content: Optional[str]) -> Optional[str]:
+        """
+        Returns the new caption for an image whose current caption is `content` (None if it has none).
+        Returns None if the image should stay without a caption.
+        """
+        if self.caption_text and (content is None or self.overwrite):
+            content = self.caption_text
+        if not self.overwrite:
+            return content
+
+        if self.prefix or self.postfix:
+            if content is None:
+                separator = " " if self.prefix and self.postfix else ""
+                content = f"{self.prefix}{separator}{self.postfix}"
+            else:
+                prefix_separator = " " if self.prefix else ""
+                postfix_separator = " " if self.postfix else ""
+                content = f"{self.prefix}{prefix_separator}{content.rstrip()}{postfix_separator}{self.postfix}"
+
+        if content is None:
+            return None
+
+        if self.find_text:
+            content = content.replace(self.find_text, self.replace_text)
+
+        if self.first_tags or self.remove_tags or self.dedup_tags:
+            tags = self.first_tags + split_tags(content, self.tag_separator)
+            if self.remove_tags:
+                tags = [tag for tag in tags if tag not in self.remove_tags]
+            if self.dedup_tags or self.first_tags:
+                tags = list(dict.fromkeys(tags))
+            content = self.tag_separator.join(tags)
+
+        return content
+
+    def image_files(self, folder: str) -> list:
+        if self.recursive:
+            image_files = []
+            for root, dirs, files in os.walk(folder):
+                image_files.extend(
+                    os.path.join(root, file)
+                    for file in files
+                    if file.lower().endswith(self.image_extensions)
+                )
+        else:
+            image_files = [
+                os.path.join(folder, file)
+                for file in os.listdir(folder)
+                if file.lower().endswith(self.image_extensions)
+            ]
+        return sorted(image_files)
+
+    def process_file(self, image_path: str, dry_run: bool = False) -> tuple:
+        """
+        Processes the caption of one image. Returns (caption path, status, diff) with status being one
+        of "created", "modified", "unchanged" or "error:<message>".
+        """
+        caption_path = os.path.splitext(image_path)[0] + self.caption_ext
+        try:
+            content = None
+            if os.path.exists(caption_path):
+                with open(caption_path, "r", errors="ignore", encoding="utf-8") as f:
+                    content = f.read()
+
+            new_content = self.transform(content)
+            if new_content is None or new_content == content:
+                return caption_path, "unchanged", ""
+
+            status = "created" if content is None else "modified"
+            diff = ""
+            if dry_run:
+                diff = "\n".join(
+                    difflib.unified_diff(
+                        (content or "").splitlines(),
+                        new_content.splitlines(),
+                        fromfile=caption_path if content is not None else "/dev/null",
+                        tofile=caption_path,
+                        lineterm="",
+                    )
+                )
+            else:
+                write_caption_atomic(caption_path, new_content)
+            return caption_path, status, diff
+        except Exception as e:
+            return caption_path, f"error:{e}", ""
+
+    def run(self, folder: str, dry_run: bool = False, max_workers: int = None) -> dict:
+        """
+        Runs the pipeline over all images in folder on a thread pool and logs a summary.
+
+        Returns a dict with the per-status counts, the elapsed time and, for dry runs, the list of diffs.
+        """
+        start = time.perf_counter()
+        image_files = self.image_files(folder)
+        max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+
+        stats = {"created": 0, "modified": 0, "unchanged": 0, "errors": 0, "diffs": []}
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for caption_path, status, diff in pool.map(
+                lambda path: self.process_file(path, dry_run), image_files
+            ):
+                if status.startswith("error:"):
+                    stats["errors"] += 1
+                    log.error(f"Error processing caption file {caption_path}: {status[6:]}")
+                    continue
+                stats[status] += 1
+                if diff:
+                    stats["diffs"].append(diff)
+
+        elapsed = time.perf_counter() - start
+        stats["files"] = len(image_files)
+        stats["elapsed"] = elapsed
+        files_per_second = len(image_files) / elapsed if elapsed > 0 else 0.0
+
+        if dry_run:
+            for diff in stats["diffs"]:
+                log.info(f"\n{diff.rstrip()}")
+        log.info(
+            f"{'[dry run] ' if dry_run else ''}Captions in {folder}: {stats['created']} created, "
+            f"{stats['modified']} modified, {stats['unchanged']} unchanged, {stats['errors']} errors "
+            f"({len(image_files)} files in {elapsed:.2f}s, {files_per_second:.0f} files/s)"
+        )
+        return stats
+
+
+def _default_file_mode() -> int:
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+DEFAULT_FILE_MODE = _default_file_mode()
+
+
+def write_caption_atomic(caption_path: str, content: str) -> None:
+    folder = os.path.dirname(caption_path) or "."
+    try:
+        mode = os.stat(caption_path).st_mode & 0o777
+    except OSError:
+        mode = DEFAULT_FILE_MODE
+    fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=folder)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.chmod(tmp_path, mode)  # mkstemp creates the file as 0600
+        os.replace(tmp_path, caption_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
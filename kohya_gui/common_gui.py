@@ -6,6 +6,8 @@ from easygui import msgbox, ynbox
 from typing import Optional
 from .custom_logging import setup_logging
 from .sd_modeltype import SDModelType
+from .safetensors_index import get_safetensors_index
+from .dataset_index import get_dataset_index
 
 import os
 import re
@@ -137,7 +139,9 @@ def check_if_model_exist(
     elif save_model_as in ["ckpt", "safetensors"]:
         ckpt_file = os.path.join(output_dir, output_name + "." + save_model_as)
         if os.path.isfile(ckpt_file):
-            msg = f"A model with the same file name {ckpt_file} already exists. Do you want to overwrite it?"
+            existing_index = get_safetensors_index(ckpt_file) if save_model_as == "safetensors" else None
+            existing_info = f" ({existing_index.describe()})" if existing_index is not None else ""
+            msg = f"A model with the same file name {ckpt_file}{existing_info} already exists. Do you want to overwrite it?"
             if not ynbox(msg, "Overwrite Existing Model?"):
                 log.info("Aborting training due to existing model with same name...")
                 return True
@@ -1038,6 +1042,9 @@ def set_pretrained_model_name_or_path_input(
     # Auto-detect model type if safetensors file path is given
     if pretrained_model_name_or_path.lower().endswith(".safetensors"):
         detect = SDModelType(pretrained_model_name_or_path)
+        model_index = get_safetensors_index(pretrained_model_name_or_path)
+        if model_index is not None:
+            log.info(f"Detected {detect.model_type.name} model: {model_index.describe()}")
         v2 = gr.Checkbox(value=detect.Is_SD2(), visible=True)
         sdxl = gr.Checkbox(value=detect.Is_SDXL(), visible=True)
         sd3 = gr.Checkbox(value=detect.Is_SD3(), visible=True)
@@ -1223,10 +1230,10 @@ def verify_image_folder_pattern(folder_path: str) -> bool:
     pattern = r"^\d+_\w+"
 
     # Get the list of sub-folders in the directory
+    dataset_index = get_dataset_index(folder_path)
     subfolders = [
         os.path.join(folder_path, subfolder)
-        for subfolder in os.listdir(folder_path)
-        if os.path.isdir(os.path.join(folder_path, subfolder))
+        for subfolder in (dataset_index.subdirectories() if dataset_index is not None else [])
     ]
 
     # Check the pattern of each sub-folder
@@ -1340,7 +1347,7 @@ def check_duplicate_filenames(
     """
     Checks for duplicate image filenames in a given folder path.
 
-    This function walks through the directory structure of the given folder path,
+    This function queries the dataset index of the given folder path (covering all sub-folders),
     and logs a warning if it finds files with the same name but different image extensions.
     This can lead to issues during training if not handled properly.
 
@@ -1357,38 +1364,24 @@ def check_duplicate_filenames(
         f"Checking for duplicate image filenames in training data directory {folder_path}..."
     )
 
-    # Walk through the directory structure
-    for root, dirs, files in os.walk(folder_path):
-        # Initialize a dictionary to store filenames and their paths
-        filenames = {}
-
-        # Process each file in the current directory
-        for file in files:
-            # Split the filename and extension
-            filename, extension = os.path.splitext(file)
-
-            # Check if the extension is in the list of image extensions
-            if extension.lower() in image_extension:
-                # Construct the full path to the file
-                full_path = os.path.join(root, file)
-
-                # Check if the filename is already in the dictionary
-                if filename in filenames:
-                    # If it is, compare the existing path with the current path
-                    existing_path = filenames[filename]
-                    if existing_path != full_path:
-                        # Log a warning if the paths are different
-                        log.warning(
-                            f"...same filename '{filename}' with different image extension found. This will cause training issues. Rename one of the file."
-                        )
-                        log.warning(f"  Existing file: {existing_path}")
-                        log.warning(f"  Current file: {full_path}")
-
-                        # Set the duplicate flag to True
-                        duplicate = True
-                else:
-                    # If not, add the filename and path to the dictionary
-                    filenames[filename] = full_path
+    dataset_index = get_dataset_index(folder_path)
+    if dataset_index is None:
+        log.error(f"...{folder_path} is not a valid folder")
+        return
+
+    # Files sharing a stem with different image extensions, grouped per directory by the dataset index
+    for rel_dir, filename, names in dataset_index.duplicate_stems(image_extension):
+        root = os.path.join(folder_path, rel_dir)
+        existing_path = os.path.join(root, names[0])
+        for name in names[1:]:
+            log.warning(
+                f"...same filename '{filename}' with different image extension found. This will cause training issues. Rename one of the file."
+            )
+            log.warning(f"  Existing file: {existing_path}")
+            log.warning(f"  Current file: {os.path.join(root, name)}")
+
+            # Set the duplicate flag to True
+            duplicate = True
 
     # If no duplicates were found, log a message indicating validation
     if not duplicate:
@@ -1,10 +1,10 @@
 import gradio as gr
-import subprocess
 import os
 import sys
 from .common_gui import get_folder_path, get_file_path, scriptdir, list_files, list_dirs, setup_environment
 
 from .custom_logging import setup_logging
+from .tool_daemon_client import run_tool
 
 # Set up logging
 log = setup_logging()
@@ -102,7 +102,7 @@ def convert_model(
     env = setup_environment()
 
     # Run the command
-    subprocess.run(run_cmd, env=env, shell=False)
+    run_tool(run_cmd, env=env)
 
 
 ###
@@ -1,8 +1,10 @@
 import os
 import re
+import toml
 import gradio as gr
 from easygui import msgbox, boolbox
 from .common_gui import get_folder_path, scriptdir, list_dirs, create_refresh_button
+from .dataset_index import get_dataset_index
 
 from .custom_logging import setup_logging
 
@@ -31,26 +33,21 @@ def dataset_balancing(concept_repeats, folder, insecure):
 
     pattern = re.compile(r"^\d+_.+$")
 
+    # Image counts come from the dataset index, so only folders changed since the last run are listed again
+    dataset_index = get_dataset_index(folder)
+
     # Iterate over the subdirectories in the selected folder
-    for subdir in os.listdir(folder):
+    for subdir in dataset_index.subdirectories():
         if pattern.match(subdir) or insecure:
             # Calculate the number of repeats for the current subdirectory
-            # Get a list of all the files in the folder
-            files = os.listdir(os.path.join(folder, subdir))
-
-            # Filter the list to include only image files
-            image_files = [
-                f
-                for f in files
-                if f.endswith((".jpg", ".jpeg", ".png", ".gif", ".webp"))
-            ]
-
             # Count the number of image files
-            images = len(image_files)
+            images = dataset_index.count_images(
+                subdir, (".jpg", ".jpeg", ".png", ".gif", ".webp")
+            )
 
             if images == 0:
                 log.info(
-                    f"No images of type .jpg, .jpeg, .png, .gif, .webp were found in {os.listdir(os.path.join(folder, subdir))}"
+                    f"No images of type .jpg, .jpeg, .png, .gif, .webp were found in {os.path.join(folder, subdir)}"
                 )
 
             # Check if the subdirectory name starts with a number inside braces,
@@ -97,6 +94,172 @@ def dataset_balancing(concept_repeats, folder, insecure):
 
 
 
+BALANCING_MODES = ["Write dataset config", "Rename folders"]
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+
+
+def concept_repeats_from_scan(concept_repeats, folder):
+    """
+    Computes the balanced repeats of every concept folder without touching the folders.
+
+    A `{multiplier}` prefix scales the repeats of a concept, an existing `N_` repeats prefix is ignored.
+
+    Args:
+        concept_repeats (int): Training steps per concept per epoch.
+        folder (str): The dataset folder containing the concept folders.
+
+    Returns:
+        list: (subfolder, concept name, number of images, repeats) for every subfolder containing images.
+    """
+    dataset_index = get_dataset_index(folder)
+    concepts = []
+    for subdir in dataset_index.subdirectories():
+        images = dataset_index.count_images(subdir, IMAGE_EXTENSIONS)
+        if images == 0:
+            log.info(f"Skipping folder {subdir} because it contains no images...")
+            continue
+
+        name = subdir
+        multiplier = 1.0
+        match = re.match(r"^\{(\d+\.?\d*)\}", name)
+        if match:
+            multiplier = float(match.group(1))
+            name = name[match.end() :]
+        match = re.match(r"^\d+_", name)
+        if match:
+            name = name[match.end() :]
+
+        repeats = max(1, round(concept_repeats / images * multiplier))
+        concepts.append((subdir, name, images, repeats))
+    return concepts
+
+
+def reg_subsets_from_scan(reg_data_dir):
+    """
+    Builds the `is_reg` subsets of a regularization folder, the way sd-scripts reads reg_data_dir: every
+    `<repeats>_<class tokens>` subfolder with images is one subset, other subfolders are skipped.
+
+    Args:
+        reg_data_dir (str): The regularization folder containing the `<repeats>_<name>` folders.
+
+    Returns:
+        list: Subset tables for the dataset config.
+    """
+    dataset_index = get_dataset_index(reg_data_dir)
+    if dataset_index is None:
+        return []
+    subsets = []
+    for subdir in dataset_index.subdirectories():
+        match = re.match(r"^(\d+)_(.+)$", subdir)
+        if not match:
+            log.warning(f"Skipping regularization folder {subdir} because it does not match <repeats>_<text>...")
+            continue
+        images = dataset_index.count_images(subdir, IMAGE_EXTENSIONS)
+        if images == 0:
+            log.info(f"Skipping regularization folder {subdir} because it contains no images...")
+            continue
+        subsets.append(
+            {
+                "image_dir": os.path.abspath(os.path.join(reg_data_dir, subdir)),
+                "num_repeats": int(match.group(1)),
+                "class_tokens": match.group(2),
+                "is_reg": True,
+            }
+        )
+    return subsets
+
+
+def default_dataset_config_path(folder, config_file=""):
+    """
+    Default location of the balanced dataset config: next to the training configuration file (or in the
+    configuration folder), else in the GUI's outputs folder. Never inside the dataset folder itself.
+    """
+    name = f"{os.path.basename(os.path.normpath(folder))}_balanced_dataset_config.toml"
+    if config_file:
+        if os.path.isdir(config_file):
+            return os.path.join(config_file, name)
+        stem = os.path.splitext(os.path.basename(config_file))[0]
+        return os.path.join(os.path.dirname(os.path.abspath(config_file)), f"{stem}_balanced_dataset_config.toml")
+    return os.path.join(scriptdir, "outputs", name)
+
+
+def dataset_balancing_config(concept_repeats, folder, dataset_config_path="", reg_data_dir="", config_file=""):
+    """
+    Balances the dataset by writing a dataset config toml with `num_repeats` per concept folder.
+
+    The folders are not renamed, so caches keyed on the image paths (latents, text encoder outputs) stay valid.
+    sd-scripts ignores reg_data_dir once a dataset config is used, so the regularization folders are written to
+    the config as `is_reg` subsets with their folder repeats.
+
+    Args:
+        concept_repeats (int): Training steps per concept per epoch.
+        folder (str): The dataset folder containing the concept folders.
+        dataset_config_path (str): Where to write the toml, defaults to default_dataset_config_path.
+        reg_data_dir (str): The regularization folder of the training run, if any.
+        config_file (str): The training configuration file (or folder), used for the default toml location.
+
+    Returns:
+        str: The path of the written dataset config, or None on error.
+    """
+    if not concept_repeats > 0:
+        msgbox("Please enter a valid integer for the total number of repeats.")
+        return None
+
+    if folder == "" or not os.path.isdir(folder):
+        msgbox("Please enter a valid folder for balancing.")
+        return None
+
+    concepts = concept_repeats_from_scan(int(concept_repeats), folder)
+    if not concepts:
+        msgbox(f"No concept folders with images of type {', '.join(IMAGE_EXTENSIONS)} were found in {folder}")
+        return None
+
+    subsets = []
+    for subdir, name, images, repeats in concepts:
+        log.info(f"Folder {subdir}: {images} images * {repeats} repeats = {images * repeats} steps")
+        subsets.append(
+            {
+                "image_dir": os.path.abspath(os.path.join(folder, subdir)),
+                "num_repeats": repeats,
+                "class_tokens": name,
+            }
+        )
+
+    if reg_data_dir:
+        reg_subsets = reg_subsets_from_scan(reg_data_dir)
+        if reg_subsets:
+            log.warning(
+                f"The regularization folder {reg_data_dir} is only used through the dataset config when it is selected: "
+                f"added {len(reg_subsets)} is_reg subsets"
+            )
+        else:
+            log.warning(
+                f"No <repeats>_<text> folders with images were found in the regularization folder {reg_data_dir}: "
+                "with this dataset config no regularization images are used"
+            )
+        subsets.extend(reg_subsets)
+
+    dataset_config_path = dataset_config_path or default_dataset_config_path(folder, config_file)
+    os.makedirs(os.path.dirname(os.path.abspath(dataset_config_path)), exist_ok=True)
+    with open(dataset_config_path, "w", encoding="utf-8") as f:
+        toml.dump({"datasets": [{"subsets": subsets}]}, f)
+
+    log.info(f"Dataset config with {len(subsets)} subsets saved to {dataset_config_path}")
+    return dataset_config_path
+
+
+def balance_dataset(mode, concept_repeats, folder, insecure, dataset_config_path, current_dataset_config, reg_data_dir="", config_file=""):
+    if mode == "Rename folders":
+        dataset_balancing(concept_repeats, folder, insecure)
+        return current_dataset_config
+
+    path = dataset_balancing_config(concept_repeats, folder, dataset_config_path, reg_data_dir, config_file)
+    if path is None:
+        return current_dataset_config
+    msgbox(f"Dataset balancing completed, dataset config saved to {path}")
+    return path
+
+
 def warning(insecure):
     if insecure:
         if boolbox(
@@ -108,16 +271,16 @@ def warning(insecure):
             return False
 
 
-def gradio_dataset_balancing_tab(headless=False):
+def gradio_dataset_balancing_tab(headless=False, dataset_config_input=None, reg_data_dir_input=None, config_file_input=None):
 
     current_dataset_dir = os.path.join(scriptdir, "data")
 
     with gr.Tab("Dreambooth/LoRA Dataset balancing"):
         gr.Markdown(
-            "This utility will ensure that each concept folder in the dataset folder is used equally during the training process of the dreambooth machine learning model, regardless of the number of images in each folder. It will do this by renaming the concept folders to indicate the number of times they should be repeated during training."
+            "This utility will ensure that each concept folder in the dataset folder is used equally during the training process of the dreambooth machine learning model, regardless of the number of images in each folder. It will do this by writing a dataset config file with the number of times each concept folder should be repeated during training, or by renaming the concept folders to indicate it."
         )
         gr.Markdown(
-            "WARNING! The use of this utility on the wrong folder can lead to unexpected folder renaming!!!"
+            "WARNING! Using the folder renaming mode on the wrong folder can lead to unexpected folder renaming!!!"
         )
         with gr.Group(), gr.Row():
 
@@ -163,19 +326,43 @@ def gradio_dataset_balancing_tab(headless=False):
                 show_progress=False,
             )
 
+        with gr.Row():
+            balancing_mode = gr.Radio(
+                choices=BALANCING_MODES,
+                value=BALANCING_MODES[0],
+                label="Balancing mode",
+                info="Writing a dataset config leaves the folders (and any cached latents) untouched",
+            )
+            dataset_config_path = gr.Textbox(
+                label="Dataset config file to write",
+                placeholder="(Optional) defaults to <config name>_balanced_dataset_config.toml next to the training config",
+                interactive=True,
+            )
+
         with gr.Accordion("Advanced options", open=False):
             insecure = gr.Checkbox(
                 value=False,
                 label="DANGER!!! -- Insecure folder renaming -- DANGER!!!",
             )
             insecure.change(warning, inputs=insecure, outputs=insecure)
+        # The written dataset config is selected as training dataset config when the tab is part of a training tab,
+        # which also provides the regularization folder and the training config location
+        dataset_config_output = dataset_config_input if dataset_config_input is not None else gr.Textbox(visible=False)
+        reg_data_dir = reg_data_dir_input if reg_data_dir_input is not None else gr.Textbox(visible=False)
+        config_file = config_file_input if config_file_input is not None else gr.Textbox(visible=False)
         balance_button = gr.Button("Balance dataset")
         balance_button.click(
-            dataset_balancing,
+            balance_dataset,
             inputs=[
+                balancing_mode,
                 total_repeats_number,
                 select_dataset_folder_input,
                 insecure,
+                dataset_config_path,
+                dataset_config_output,
+                reg_data_dir,
+                config_file,
             ],
+            outputs=dataset_config_output,
             show_progress=False,
         )
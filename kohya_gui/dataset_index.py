@@ -0,0 +1,345 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from .custom_logging import setup_logging
+
+# Set up logging
+log = setup_logging()
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif")
+# indexes live in the GUI's cache directory, one database per dataset folder (see index_db_path)
+INDEX_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "kohya_ss", "dataset_index")
+# name of the index databases earlier versions wrote into the dataset folders, skipped when listing
+INDEX_FILE_NAME = ".kohya_dataset_index.sqlite"
+SCHEMA_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    rel_dir TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER,
+    size INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+    rel_dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    stem TEXT NOT NULL,
+    ext TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    width INTEGER,
+    height INTEGER,
+    PRIMARY KEY (rel_dir, name)
+);
+CREATE INDEX IF NOT EXISTS files_by_stem ON files (rel_dir, stem);
+CREATE INDEX IF NOT EXISTS dirs_by_parent ON dirs (parent);
+"""
+
+
+def _join(rel_dir: str, name: str) -> str:
+    return name if not rel_dir else rel_dir + "/" + name
+
+
+def _probe_dimensions(path: str) -> tuple:
+    from PIL import Image  # only needed once dimensions are requested
+
+    try:
+        with Image.open(path) as image:
+            return image.size
+    except Exception:
+        return (None, None)
+
+
+def index_db_path(root: str) -> str:
+    """
+    Path of the index database of the dataset folder root, in INDEX_CACHE_DIR and keyed by the folder path.
+    """
+    digest = hashlib.sha1(os.path.abspath(root).encode("utf-8")).hexdigest()
+    return os.path.join(INDEX_CACHE_DIR, digest + ".sqlite")
+
+
+def connect_index_db(db_path: str) -> Tuple[sqlite3.Connection, str]:
+    """
+    Opens the SQLite database at db_path for reading and writing and returns (connection, path). If it cannot be
+    written (read-only file or directory), an in-memory database is returned instead, with the path ":memory:",
+    so the index only lasts for this session.
+    """
+    try:
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        try:
+            # opening (and even locking) a read-only database succeeds, only an actual write fails: try one and
+            # roll it back
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("CREATE TABLE _write_probe (x)")
+            conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            raise
+        return conn, db_path
+    except (OSError, sqlite3.Error) as e:
+        log.warning(f"Cannot write index {db_path} ({e}), using an in-memory index...")
+        return sqlite3.connect(":memory:", check_same_thread=False), ":memory:"
+
+
+class DatasetIndex:
+    """
+    Persistent file index of a dataset folder tree, stored as SQLite in the GUI's cache directory.
+
+    Every file is recorded with its size and mtime, images additionally with their dimensions (probed lazily).
+    `refresh` is incremental: a directory is only listed again when its own mtime or size changed, which is the
+    case whenever files are added, removed or renamed in it. Overwriting a file in place does not change its
+    directory, so `image_dimensions` re-stats the images it returns and probes again those that changed. Caption
+    presence is answered from the same table, as a caption is just a file with the image's stem and the caption
+    extension.
+    """
+
+    def __init__(self, root: str, db_path: Optional[str] = None):
+        self.root = os.path.abspath(root)
+        self._lock = threading.RLock()
+        self._conn, self.db_path = connect_index_db(db_path or index_db_path(self.root))
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self._conn.executescript("DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS dirs;")
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def _is_index_file(self, rel_dir: str, name: str) -> bool:
+        return not rel_dir and name.startswith(INDEX_FILE_NAME)
+
+    def refresh(self) -> "DatasetIndex":
+        """
+        Brings the index up to date with the folder tree and returns self.
+        """
+        with self._lock:
+            known_dirs = {
+                row[0]: (row[1], row[2]) for row in self._conn.execute("SELECT rel_dir, mtime_ns, size FROM dirs")
+            }
+            seen_dirs = set()
+            changed = 0
+            stack = [""]
+            while stack:
+                rel_dir = stack.pop()
+                abs_dir = os.path.join(self.root, rel_dir) if rel_dir else self.root
+                try:
+                    stat = os.stat(abs_dir)
+                except OSError:
+                    continue
+                seen_dirs.add(rel_dir)
+                # the size as well: a change within the same mtime tick (coarse filesystem clocks) still shows
+                signature = (stat.st_mtime_ns, stat.st_size)
+                if known_dirs.get(rel_dir) == signature:
+                    # unchanged listing, the subdirectories are known from the index
+                    stack.extend(
+                        row[0]
+                        for row in self._conn.execute(
+                            "SELECT rel_dir FROM dirs WHERE parent = ?", (rel_dir,)
+                        )
+                    )
+                    continue
+                changed += 1
+                stack.extend(self._rescan_dir(rel_dir, abs_dir, signature))
+
+            removed = [rel_dir for rel_dir in known_dirs if rel_dir not in seen_dirs]
+            for rel_dir in removed:
+                self._conn.execute("DELETE FROM dirs WHERE rel_dir = ?", (rel_dir,))
+                self._conn.execute("DELETE FROM files WHERE rel_dir = ?", (rel_dir,))
+            self._conn.commit()
+            if changed or removed:
+                log.debug(
+                    f"Dataset index {self.root}: rescanned {changed} folder(s), dropped {len(removed)}"
+                )
+        return self
+
+    def _rescan_dir(self, rel_dir: str, abs_dir: str, signature: tuple) -> list:
+        existing = {
+            row[0]: (row[1], row[2], row[3], row[4])
+            for row in self._conn.execute(
+                "SELECT name, size, mtime_ns, width, height FROM files WHERE rel_dir = ?",
+                (rel_dir,),
+            )
+        }
+        # dimensions of files that merely moved (e.g. a renamed repeats folder) are carried over
+        moved = None
+        subdirs = []
+        rows = []
+        names = set()
+        with os.scandir(abs_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        subdirs.append(_join(rel_dir, entry.name))
+                        continue
+                    if not entry.is_file() or self._is_index_file(rel_dir, entry.name):
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                names.add(entry.name)
+                old = existing.get(entry.name)
+                if old is not None and old[0] == stat.st_size and old[1] == stat.st_mtime_ns:
+                    continue
+                stem, ext = os.path.splitext(entry.name)
+                width = height = None
+                if old is None:
+                    if moved is None and ext.lower() in IMAGE_EXTENSIONS:
+                        moved = self._dimensions_by_signature()
+                    width, height = (moved or {}).get((entry.name, stat.st_size, stat.st_mtime_ns), (None, None))
+                rows.append(
+                    (rel_dir, entry.name, stem, ext.lower(), stat.st_size, stat.st_mtime_ns, width, height)
+                )
+
+        self._conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        gone = [(rel_dir, name) for name in existing if name not in names]
+        self._conn.executemany("DELETE FROM files WHERE rel_dir = ? AND name = ?", gone)
+        parent = os.path.dirname(rel_dir) if rel_dir else None
+        self._conn.execute(
+            "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)", (rel_dir, parent) + signature
+        )
+        return subdirs
+
+    def _dimensions_by_signature(self) -> dict:
+        return {
+            (row[0], row[1], row[2]): (row[3], row[4])
+            for row in self._conn.execute(
+                "SELECT name, size, mtime_ns, width, height FROM files WHERE width IS NOT NULL"
+            )
+        }
+
+    def subdirectories(self, rel_dir: str = "") -> list:
+        """
+        Returns the names of the immediate subdirectories of rel_dir ("" is the dataset root), sorted.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT rel_dir FROM dirs WHERE parent = ? ORDER BY rel_dir", (rel_dir,)
+            ).fetchall()
+        return [os.path.basename(row[0]) for row in rows]
+
+    def _ext_filter(self, extensions) -> tuple:
+        extensions = tuple(ext.lower() for ext in extensions)
+        return f"ext IN ({', '.join('?' * len(extensions))})", extensions
+
+    def image_files(self, rel_dir: str = "", extensions=IMAGE_EXTENSIONS, recursive: bool = False) -> list:
+        """
+        Returns image paths relative to rel_dir (plain file names unless recursive), sorted by path.
+        """
+        ext_sql, ext_args = self._ext_filter(extensions)
+        with self._lock:
+            if recursive:
+                rows = self._conn.execute(
+                    f"SELECT rel_dir, name FROM files WHERE {ext_sql} AND (? = '' OR rel_dir = ? OR rel_dir LIKE ? ESCAPE '\\') ORDER BY rel_dir, name",
+                    ext_args + (rel_dir, rel_dir, _like_prefix(rel_dir)),
+                ).fetchall()
+                return [os.path.relpath(_join(d, n), rel_dir or ".").replace(os.sep, "/") for d, n in rows]
+            rows = self._conn.execute(
+                f"SELECT name FROM files WHERE rel_dir = ? AND {ext_sql} ORDER BY name",
+                (rel_dir,) + ext_args,
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def count_images(self, rel_dir: str = "", extensions=IMAGE_EXTENSIONS) -> int:
+        ext_sql, ext_args = self._ext_filter(extensions)
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COUNT(*) FROM files WHERE rel_dir = ? AND {ext_sql}", (rel_dir,) + ext_args
+            ).fetchone()[0]
+
+    def images_with_captions(self, rel_dir: str, caption_ext: str, extensions=IMAGE_EXTENSIONS) -> list:
+        """
+        Returns (image name, has caption) for every image in rel_dir, sorted by name.
+        """
+        ext_sql, ext_args = self._ext_filter(extensions)
+        caption_ext = caption_ext if caption_ext.startswith(".") else "." + caption_ext
+        with self._lock:
+            rows = self._conn.execute(
+                f"""SELECT i.name, EXISTS(SELECT 1 FROM files c WHERE c.rel_dir = i.rel_dir AND c.stem = i.stem AND c.ext = ?)
+                    FROM files i WHERE i.rel_dir = ? AND i.{ext_sql} ORDER BY i.name""",
+                (caption_ext.lower(), rel_dir) + ext_args,
+            ).fetchall()
+        return [(name, bool(has_caption)) for name, has_caption in rows]
+
+    def duplicate_stems(self, extensions=IMAGE_EXTENSIONS) -> list:
+        """
+        Returns (rel_dir, stem, [names]) for every stem that exists with more than one image extension in a folder.
+        """
+        ext_sql, ext_args = self._ext_filter(extensions)
+        with self._lock:
+            rows = self._conn.execute(
+                f"""SELECT rel_dir, stem, GROUP_CONCAT(name, '/') FROM files WHERE {ext_sql}
+                    GROUP BY rel_dir, stem HAVING COUNT(*) > 1 ORDER BY rel_dir, stem""",
+                ext_args,
+            ).fetchall()
+        return [(rel_dir, stem, sorted(names.split("/"))) for rel_dir, stem, names in rows]
+
+    def image_dimensions(self, rel_dir: str = "", extensions=IMAGE_EXTENSIONS, max_workers: int = 16) -> dict:
+        """
+        Returns {image name: (width, height)} for rel_dir. Every image is stat'ed (in a thread pool) and only those
+        not measured yet or whose size or mtime changed since, e.g. re-encoded in place, are probed.
+        """
+        ext_sql, ext_args = self._ext_filter(extensions)
+        with self._lock:
+            known = self._conn.execute(
+                f"SELECT name, size, mtime_ns, width FROM files WHERE rel_dir = ? AND {ext_sql}",
+                (rel_dir,) + ext_args,
+            ).fetchall()
+        abs_dir = os.path.join(self.root, rel_dir)
+
+        def measure(row):
+            name, size, mtime_ns, width = row
+            path = os.path.join(abs_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None  # gone, dropped by the next refresh
+            if width is not None and (stat.st_size, stat.st_mtime_ns) == (size, mtime_ns):
+                return None
+            return (stat.st_size, stat.st_mtime_ns) + tuple(_probe_dimensions(path)) + (rel_dir, name)
+
+        if known:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                updates = [update for update in pool.map(measure, known) if update is not None]
+            if updates:
+                with self._lock:
+                    self._conn.executemany(
+                        "UPDATE files SET size = ?, mtime_ns = ?, width = ?, height = ? WHERE rel_dir = ? AND name = ?",
+                        updates,
+                    )
+                    self._conn.commit()
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT name, width, height FROM files WHERE rel_dir = ? AND {ext_sql} ORDER BY name",
+                (rel_dir,) + ext_args,
+            ).fetchall()
+        return {name: (width, height) for name, width, height in rows}
+
+
+def _like_prefix(rel_dir: str) -> str:
+    escaped = rel_dir.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "/%"
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_dataset_index(folder: str) -> Optional[DatasetIndex]:
+    """
+    Returns the refreshed index of a dataset folder, or None if the folder does not exist.
+
+    Index objects are shared per folder for the lifetime of the GUI process.
+    """
+    if not folder or not os.path.isdir(folder):
+        return None
+    key = os.path.abspath(folder)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = DatasetIndex(key)
+    return index.refresh()
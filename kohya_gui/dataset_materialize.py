@@ -0,0 +1,191 @@
+import errno
+import os
+import shutil
+import sys
+
+from .custom_logging import setup_logging
+from .dataset_index import IMAGE_EXTENSIONS
+
+# Set up logging
+log = setup_logging()
+
+MATERIALIZE_MODES = ["auto", "hardlink", "reflink", "symlink", "copy"]
+DEFAULT_MATERIALIZE_MODE = "auto"
+
+# Linux FICLONE ioctl: share the source extents copy-on-write (btrfs, xfs, bcachefs, ...)
+FICLONE = 0x40049409
+
+# errors meaning "this link type does not work here", after which the next method is tried
+_UNSUPPORTED_ERRNOS = {
+    errno.EXDEV,
+    errno.EPERM,
+    errno.EACCES,
+    errno.EINVAL,
+    errno.ENOTTY,
+    getattr(errno, "EOPNOTSUPP", errno.EINVAL),
+    getattr(errno, "ENOTSUP", errno.EINVAL),
+    errno.EMLINK,
+}
+
+
+def _reflink(src: str, dst: str) -> None:
+    if not sys.platform.startswith("linux"):
+        raise OSError(errno.EOPNOTSUPP, "reflinks are only supported on Linux")
+    import fcntl
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def _hardlink(src: str, dst: str) -> None:
+    os.link(src, dst)
+
+
+def _symlink(src: str, dst: str) -> None:
+    os.symlink(os.path.abspath(src), dst)
+
+
+def _copy(src: str, dst: str) -> None:
+    shutil.copy2(src, dst)
+
+
+_METHODS = {
+    "reflink": _reflink,
+    "hardlink": _hardlink,
+    "symlink": _symlink,
+    "copy": _copy,
+}
+
+# order in which methods are tried, copies are always the last resort
+_FALLBACKS = {
+    "auto": ["reflink", "hardlink", "copy"],
+    "reflink": ["reflink", "copy"],
+    "hardlink": ["hardlink", "copy"],
+    "symlink": ["symlink", "copy"],
+    "copy": ["copy"],
+}
+
+
+def _is_current(src_stat: os.stat_result, src: str, dst: str, mode: str) -> bool:
+    """
+    Returns True if dst already is an up to date materialization of src for the given mode.
+    """
+    try:
+        dst_lstat = os.lstat(dst)
+    except OSError:
+        return False
+    if os.path.islink(dst):
+        return mode == "symlink" and os.readlink(dst) == os.path.abspath(src)
+    if mode == "symlink":
+        return False
+    if dst_lstat.st_ino == src_stat.st_ino and dst_lstat.st_dev == src_stat.st_dev:
+        return mode in ("auto", "hardlink")  # hardlink to the source, replaced by a copy in copy mode
+    if mode == "hardlink":
+        return False  # a copy, relinking it frees the space
+    # copies and reflinks carry the source size and mtime (copystat); compare at 1 s resolution for FAT/SMB
+    return (
+        dst_lstat.st_size == src_stat.st_size
+        and int(dst_lstat.st_mtime) == int(src_stat.st_mtime)
+    )
+
+
+def materialize_folder(src_dir: str, dst_dir: str, mode: str = DEFAULT_MATERIALIZE_MODE) -> dict:
+    """
+    Incrementally mirrors src_dir into dst_dir using links instead of copies where possible.
+
+    Only files that are new or changed (by size and mtime, or link target) are (re)created, files that no
+    longer exist in src_dir are removed from dst_dir. Each link type falls back to the next one, and
+    finally to a plain copy, when the filesystem does not support it (e.g. hardlinks across devices).
+    Only images are linked: captions and other files are always copied, as they get edited in place and a
+    hard or symbolic link would carry those edits back to the source folder.
+
+    Args:
+        src_dir (str): The folder to mirror.
+        dst_dir (str): The destination folder, created if missing.
+        mode (str): One of MATERIALIZE_MODES. "auto" tries reflink, then hardlink, then copy.
+
+    Returns:
+        dict: Counts per method used, "unchanged" and "removed" file counts, "bytes_copied" and
+            "bytes_avoided" (bytes that did not have to be copied because they were linked or unchanged).
+    """
+    if mode not in _FALLBACKS:
+        raise ValueError(f"Unknown materialization mode {mode}, expected one of {MATERIALIZE_MODES}")
+
+    dst_dir = os.path.normpath(dst_dir)
+    methods = list(_FALLBACKS[mode])
+    stats = {method: 0 for method in _METHODS}
+    stats.update(unchanged=0, removed=0, bytes_copied=0, bytes_avoided=0)
+
+    expected = set()
+    for root, dirs, files in os.walk(src_dir):
+        rel_root = os.path.relpath(root, src_dir)
+        target_root = os.path.normpath(os.path.join(dst_dir, rel_root))
+        os.makedirs(target_root, exist_ok=True)
+        expected.add(target_root)
+        for file in files:
+            src = os.path.join(root, file)
+            dst = os.path.join(target_root, file)
+            expected.add(dst)
+            src_stat = os.stat(src)
+            linkable = os.path.splitext(file)[1].lower() in IMAGE_EXTENSIONS
+            file_mode = mode if linkable else "copy"
+
+            if _is_current(src_stat, src, dst, file_mode):
+                stats["unchanged"] += 1
+                stats["bytes_avoided"] += src_stat.st_size
+                continue
+            if os.path.lexists(dst):
+                os.remove(dst)
+
+            for method in list(methods) if linkable else ["copy"]:
+                try:
+                    _METHODS[method](src, dst)
+                except OSError as e:
+                    if method == "copy" or e.errno not in _UNSUPPORTED_ERRNOS:
+                        raise
+                    # not supported between these folders: stop trying it for the remaining files
+                    log.info(f"...{method} not possible for {dst_dir} ({e.strerror}), falling back")
+                    methods.remove(method)
+                    continue
+                stats[method] += 1
+                if method == "copy":
+                    stats["bytes_copied"] += src_stat.st_size
+                else:
+                    stats["bytes_avoided"] += src_stat.st_size
+                break
+
+    # remove what is no longer part of the source, deepest paths first
+    for root, dirs, files in os.walk(dst_dir, topdown=False):
+        for file in files:
+            path = os.path.join(root, file)
+            if path not in expected:
+                os.remove(path)
+                stats["removed"] += 1
+        for directory in dirs:
+            path = os.path.join(root, directory)
+            if path not in expected:
+                if os.path.islink(path):
+                    os.remove(path)
+                else:
+                    shutil.rmtree(path)
+    return stats
+
+
+_METHOD_LABELS = {"reflink": "reflinked", "hardlink": "hardlinked", "symlink": "symlinked", "copy": "copied"}
+
+
+def format_materialize_stats(stats: dict) -> str:
+    created = ", ".join(
+        f"{stats[method]} {label}" for method, label in _METHOD_LABELS.items() if stats[method]
+    )
+    return (
+        f"{created or 'nothing new'}, {stats['unchanged']} unchanged, {stats['removed']} removed; "
+        f"{stats['bytes_copied'] / 1024 ** 2:.1f} MiB copied, "
+        f"{stats['bytes_avoided'] / 1024 ** 2:.1f} MiB not copied"
+    )
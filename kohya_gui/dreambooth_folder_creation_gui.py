@@ -1,8 +1,13 @@
 import gradio as gr
 from .common_gui import get_folder_path, scriptdir, list_dirs, create_refresh_button
-import shutil
 import os
 from .class_gui_config import KohyaSSGUIConfig
+from .dataset_materialize import (
+    DEFAULT_MATERIALIZE_MODE,
+    MATERIALIZE_MODES,
+    format_materialize_stats,
+    materialize_folder,
+)
 
 from .custom_logging import setup_logging
 
@@ -30,6 +35,7 @@ def dreambooth_folder_preparation(
     util_regularization_images_repeat_input,
     util_class_prompt_input,
     util_training_dir_output,
+    materialize_mode=DEFAULT_MATERIALIZE_MODE,
 ):
 
     # Check if the input variables are empty
@@ -64,14 +70,10 @@ def dreambooth_folder_preparation(
             f"img/{int(util_training_images_repeat_input)}_{util_instance_prompt_input} {util_class_prompt_input}",
         )
 
-        # Remove folders if they exist
-        if os.path.exists(training_dir):
-            log.info(f"Removing existing directory {training_dir}...")
-            shutil.rmtree(training_dir)
-
-        # Copy the training images to their respective directories
-        log.info(f"Copy {util_training_images_dir_input} to {training_dir}...")
-        shutil.copytree(util_training_images_dir_input, training_dir)
+        # Sync the training images into their respective directories, only touching changed files
+        log.info(f"Sync {util_training_images_dir_input} to {training_dir} ({materialize_mode})...")
+        stats = materialize_folder(util_training_images_dir_input, training_dir, materialize_mode)
+        log.info(f"...{format_materialize_stats(stats)}")
 
     if not util_regularization_images_dir_input == "":
         # Create the regularization_dir path
@@ -83,16 +85,14 @@ def dreambooth_folder_preparation(
                 f"reg/{int(util_regularization_images_repeat_input)}_{util_class_prompt_input}",
             )
 
-            # Remove folders if they exist
-            if os.path.exists(regularization_dir):
-                log.info(f"Removing existing directory {regularization_dir}...")
-                shutil.rmtree(regularization_dir)
-
-            # Copy the regularisation images to their respective directories
+            # Sync the regularisation images into their respective directories
             log.info(
-                f"Copy {util_regularization_images_dir_input} to {regularization_dir}..."
+                f"Sync {util_regularization_images_dir_input} to {regularization_dir} ({materialize_mode})..."
+            )
+            stats = materialize_folder(
+                util_regularization_images_dir_input, regularization_dir, materialize_mode
             )
-            shutil.copytree(util_regularization_images_dir_input, regularization_dir)
+            log.info(f"...{format_materialize_stats(stats)}")
     else:
         log.info(
             "Regularization images directory is missing... not copying regularisation images..."
@@ -278,6 +278,14 @@ def gradio_dreambooth_folder_creation_tab(
                 outputs=util_training_dir_output,
                 show_progress=False,
             )
+        with gr.Row():
+            materialize_mode = gr.Dropdown(
+                label="Image placement",
+                choices=MATERIALIZE_MODES,
+                value=config.get(key="dataset_preparation.materialize_mode", default=DEFAULT_MATERIALIZE_MODE),
+                info="auto: reflink, else hardlink, else copy. Only images are linked, caption files are always copied so editing them never changes the source captions.",
+                interactive=True,
+            )
         button_prepare_training_data = gr.Button("Prepare training data")
         button_prepare_training_data.click(
             dreambooth_folder_preparation,
@@ -289,6 +297,7 @@ def gradio_dreambooth_folder_creation_tab(
                 util_regularization_images_repeat_input,
                 util_class_prompt_input,
                 util_training_dir_output,
+                materialize_mode,
             ],
             show_progress=False,
         )
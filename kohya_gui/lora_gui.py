@@ -47,6 +47,7 @@ from .dreambooth_folder_creation_gui import (
     gradio_dreambooth_folder_creation_tab,
 )
 from .dataset_balancing_gui import gradio_dataset_balancing_tab
+from .dataset_index import get_dataset_index
 
 from .custom_logging import setup_logging
 
@@ -1137,12 +1138,12 @@ def train_model(
             log.error("Train data dir is empty")
             return TRAIN_BUTTON_VISIBLE
 
-        # Get a list of all subfolders in train_data_dir
-        subfolders = [
-            f
-            for f in os.listdir(train_data_dir)
-            if os.path.isdir(os.path.join(train_data_dir, f))
-        ]
+        # Get a list of all subfolders in train_data_dir from the (incrementally updated) dataset index
+        dataset_index = get_dataset_index(train_data_dir)
+        if dataset_index is None:
+            log.error(f"Train data dir {train_data_dir} does not exist")
+            return TRAIN_BUTTON_VISIBLE
+        subfolders = dataset_index.subdirectories()
 
         total_steps = 0
 
@@ -1154,15 +1155,8 @@ def train_model(
                 log.info(f"Folder {folder}: {repeats} repeats found")
 
                 # Count the number of images in the folder
-                num_images = len(
-                    [
-                        f
-                        for f, lower_f in (
-                            (file, file.lower())
-                            for file in os.listdir(os.path.join(train_data_dir, folder))
-                        )
-                        if lower_f.endswith((".jpg", ".jpeg", ".png", ".webp"))
-                    ]
+                num_images = dataset_index.count_images(
+                    folder, (".jpg", ".jpeg", ".png", ".webp")
                 )
 
                 log.info(f"Folder {folder}: {num_images} images found")
@@ -1888,7 +1882,12 @@ def lora_tab(
                 config=config,
             )
 
-            gradio_dataset_balancing_tab(headless=headless)
+            gradio_dataset_balancing_tab(
+                headless=headless,
+                dataset_config_input=source_model.dataset_config,
+                reg_data_dir_input=folders.reg_data_dir,
+                config_file_input=configuration.config_file_name,
+            )
 
         with gr.Accordion("Parameters", open=False), gr.Column():
 
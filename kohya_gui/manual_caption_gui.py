@@ -1,9 +1,11 @@
 import gradio as gr
 from easygui import msgbox, boolbox
 from .common_gui import get_folder_path, scriptdir, list_dirs
+from .dataset_index import get_dataset_index
+from .tag_statistics import get_tag_index
+from .thumbnail_cache import get_thumbnail_cache
 from math import ceil
 import os
-import re
 
 from .custom_logging import setup_logging
 
@@ -15,6 +17,33 @@ IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
 auto_save = True
 
 
+# (images dir, caption ext) -> ((folder mtime, folder size), sorted [(image file, has caption)])
+_image_lists = {}
+
+
+def _list_images(images_dir, caption_ext):
+    """
+    Returns the sorted (image file, has caption) list of images_dir, kept in memory until files are added,
+    removed or renamed in the folder (which changes its mtime and usually its size)
+    """
+    key = (os.path.abspath(images_dir), caption_ext)
+    try:
+        stat = os.stat(images_dir)
+    except OSError:
+        return []
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _image_lists.get(key)
+    if cached is None or cached[0] != signature:
+        dataset_index = get_dataset_index(images_dir)
+        if dataset_index is None:
+            return []
+        image_files = dataset_index.images_with_captions(
+            "", caption_ext, IMAGE_EXTENSIONS
+        )
+        cached = _image_lists[key] = (signature, image_files)
+    return cached[1]
+
+
 def _get_caption_path(image_file, images_dir, caption_ext):
     """
     Returns the expected path of a caption file for a given image path
@@ -137,26 +166,18 @@ def import_tags_from_captions(
         ):
             return empty_return()
 
-    images_list = os.listdir(images_dir)
-    image_files = [f for f in images_list if f.lower().endswith(IMAGE_EXTENSIONS)]
-
-    # Use a set for lookup but store order with list
-    tags = []
-    tags_set = set()
-    for image_file in image_files:
-        caption_file_path = _get_caption_path(image_file, images_dir, caption_ext)
-        if os.path.exists(caption_file_path):
-            with open(caption_file_path, "r", encoding="utf-8") as f:
-                caption = f.read()
-                for tag in caption.split(","):
-                    tag = tag.strip()
-                    tag_key = tag.lower()
-                    if not tag_key in tags_set:
-                        # Ignore extra spaces
-                        total_words = len(re.findall(r"\s+", tag)) + 1
-                        if total_words <= ignore_load_tags_word_count:
-                            tags.append(tag)
-                            tags_set.add(tag_key)
+    image_files = _list_images(images_dir, caption_ext)
+    caption_paths = [
+        os.path.splitext(image_file)[0] + caption_ext
+        for image_file, has_caption in image_files
+        if has_caption
+    ]
+
+    # Only caption files changed since the last import are read again
+    tag_index = get_tag_index(images_dir, caption_ext, recursive=False)
+    if tag_index is None:
+        return empty_return()
+    tags = tag_index.ordered_tags(caption_paths, max_words=ignore_load_tags_word_count)
 
     return ", ".join(tags)
 
@@ -185,9 +206,9 @@ def load_images(images_dir, caption_ext, loaded_images_dir, page, max_page):
         return empty_return()
 
     # Load Images
-    images_list = os.listdir(images_dir)
-    total_images = len(
-        [True for f in images_list if f.lower().endswith(IMAGE_EXTENSIONS)]
+    dataset_index = get_dataset_index(images_dir)
+    total_images = (
+        dataset_index.count_images("", IMAGE_EXTENSIONS) if dataset_index is not None else 0
     )
     return [images_dir, 1, ceil(total_images / IMAGES_TO_SHOW)]
 
@@ -204,8 +225,7 @@ def update_images(
     """
 
     # Load Images
-    images_list = os.listdir(images_dir)
-    image_files = [f for f in images_list if f.lower().endswith(IMAGE_EXTENSIONS)]
+    image_files = _list_images(images_dir, caption_ext)
 
     # Quick tags
     quick_tags, quick_tags_set = _get_quick_tags(quick_tags_text or "")
@@ -225,11 +245,11 @@ def update_images(
         caption = ""
         tag_checkboxes = None
         if show_row:
-            image_file = image_files[image_index]
+            image_file, has_caption = image_files[image_index]
             image_path = os.path.join(images_dir, image_file)
 
-            caption_file_path = _get_caption_path(image_file, images_dir, caption_ext)
-            if os.path.exists(caption_file_path):
+            if has_caption:
+                caption_file_path = _get_caption_path(image_file, images_dir, caption_ext)
                 with open(caption_file_path, "r", encoding="utf-8") as f:
                     caption = f.read()
 
@@ -239,10 +259,19 @@ def update_images(
         captions.append(caption)
         tag_checkbox_groups.append(tag_checkboxes)
 
+    # Show downscaled thumbnails and prepare those of the neighbouring pages in the background
+    thumbnail_cache = get_thumbnail_cache()
+    thumbnail_paths = thumbnail_cache.get(image_paths)
+    for neighbour_start in (start_index + IMAGES_TO_SHOW, start_index - IMAGES_TO_SHOW):
+        thumbnail_cache.prefetch(
+            os.path.join(images_dir, image_file)
+            for image_file, _ in image_files[max(neighbour_start, 0) : max(neighbour_start + IMAGES_TO_SHOW, 0)]
+        )
+
     return (
         rows
         + image_paths
-        + image_paths
+        + thumbnail_paths
         + captions
         + tag_checkbox_groups
         + [gr.Row(visible=True), gr.Row(visible=True)]
@@ -1,6 +1,5 @@
 # Standard library imports
 import os
-import subprocess
 import sys
 import json
 
@@ -16,6 +15,7 @@ from .common_gui import (
     create_refresh_button, setup_environment
 )
 from .custom_logging import setup_logging
+from .tool_daemon_client import run_tool
 from .sd_modeltype import SDModelType
 
 # Set up logging
@@ -466,6 +466,6 @@ class GradioMergeLoRaTab:
         log.info(f"Executing command: {command_to_run}")
 
         # Run the command in the sd-scripts folder context
-        subprocess.run(run_cmd, env=env)
+        run_tool(run_cmd, env=env)
 
         log.info("Done merging...")
@@ -0,0 +1,130 @@
+import os
+import struct
+from bisect import bisect_left
+from functools import lru_cache
+from itertools import accumulate
+from typing import Optional
+
+from tools.safetensors_header import read_safetensors_header
+
+# Header-only index of a .safetensors file. Only the 8-byte length and the JSON header are read, the tensor
+# data is never touched, and parsed indexes are cached per (path, mtime, size) so repeated lookups on the same
+# (possibly network-mounted) file do not reopen it.
+
+class SafetensorsIndex:
+    """
+    Sorted tensor-name index over a safetensors header.
+
+    Prefix queries (`has_prefix`, `keys_with_prefix`, `prefix_totals`) are binary searches over the sorted key
+    list, `children` walks a trie of the dot-separated name components.
+    """
+
+    def __init__(self, path: str, header: dict):
+        self.path = path
+        self.metadata = header.pop("__metadata__", None) or {}
+        self.keys = sorted(header)
+        self.tensors = {}
+        for key in self.keys:
+            info = header[key]
+            shape = tuple(info["shape"])
+            begin, end = info["data_offsets"]
+            self.tensors[key] = (info["dtype"], shape, end - begin)
+
+        numels = [_numel(self.tensors[key][1]) for key in self.keys]
+        sizes = [self.tensors[key][2] for key in self.keys]
+        # prefix sums over the sorted keys give O(log n) totals for any name prefix
+        self._numel_prefix_sums = [0] + list(accumulate(numels))
+        self._nbytes_prefix_sums = [0] + list(accumulate(sizes))
+
+        self.dtype_totals = {}
+        for key in self.keys:
+            dtype, shape, nbytes = self.tensors[key]
+            count, numel, total_bytes = self.dtype_totals.get(dtype, (0, 0, 0))
+            self.dtype_totals[dtype] = (count + 1, numel + _numel(shape), total_bytes + nbytes)
+        self._trie = None
+
+    def __contains__(self, key: str) -> bool:
+        i = bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _prefix_range(self, prefix: str) -> tuple:
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + "\U0010ffff", lo=start)
+        return start, end
+
+    def has_prefix(self, prefix: str) -> bool:
+        i = bisect_left(self.keys, prefix)
+        return i < len(self.keys) and self.keys[i].startswith(prefix)
+
+    def keys_with_prefix(self, prefix: str) -> list:
+        start, end = self._prefix_range(prefix)
+        return self.keys[start:end]
+
+    def prefix_totals(self, prefix: str = "") -> tuple:
+        """
+        Returns (tensor count, parameter count, data bytes) of all tensors whose name starts with prefix.
+        """
+        start, end = self._prefix_range(prefix)
+        return (
+            end - start,
+            self._numel_prefix_sums[end] - self._numel_prefix_sums[start],
+            self._nbytes_prefix_sums[end] - self._nbytes_prefix_sums[start],
+        )
+
+    @property
+    def total_params(self) -> int:
+        return self._numel_prefix_sums[-1]
+
+    @property
+    def total_bytes(self) -> int:
+        return self._nbytes_prefix_sums[-1]
+
+    def children(self, prefix: str = "") -> list:
+        """
+        Returns the next name components below a dotted prefix, e.g. children("model.") -> ["diffusion_model"].
+        """
+        if self._trie is None:
+            self._trie = {}
+            for key in self.keys:
+                node = self._trie
+                for part in key.split("."):
+                    node = node.setdefault(part, {})
+        node = self._trie
+        for part in [p for p in prefix.split(".") if p]:
+            node = node.get(part)
+            if node is None:
+                return []
+        return sorted(node)
+
+    def describe(self) -> str:
+        dtypes = ", ".join(f"{dtype}: {count}" for dtype, (count, _, _) in sorted(self.dtype_totals.items()))
+        return f"{len(self.keys)} tensors, {self.total_params / 1e6:.1f}M parameters ({dtypes})"
+
+
+def _numel(shape: tuple) -> int:
+    numel = 1
+    for dim in shape:
+        numel *= dim
+    return numel
+
+
+@lru_cache(maxsize=32)
+def _load_index(path: str, mtime_ns: int, size: int) -> SafetensorsIndex:
+    # mtime_ns and size only take part in the cache key: a rewritten file gets a fresh entry
+    return SafetensorsIndex(path, read_safetensors_header(path))
+
+
+def get_safetensors_index(path: str) -> Optional[SafetensorsIndex]:
+    """
+    Returns the cached header index of a safetensors file, or None if it is missing or not a valid safetensors file.
+    """
+    if not os.path.isfile(path):
+        return None
+    try:
+        stat = os.stat(path)
+        return _load_index(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    except (OSError, ValueError, KeyError, TypeError, struct.error):
+        return None
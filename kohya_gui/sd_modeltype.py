@@ -1,5 +1,4 @@
-from os.path import isfile
-from safetensors import safe_open
+from .safetensors_index import get_safetensors_index
 import enum
 
 # methodology is based on https://github.com/AUTOMATIC1111/stable-diffusion-webui/blob/82a973c04367123ae98bd9abdf80d9eda9b910e2/modules/sd_models.py#L379-L403
@@ -18,34 +17,26 @@ class SDModelType:
     def __init__(self, safetensors_path):
         self.model_type = ModelType.UNKNOWN
 
-        if not isfile(safetensors_path):
+        # header-only and cached per (path, mtime, size), so re-detecting the same file never reopens it
+        st = get_safetensors_index(safetensors_path)
+        if st is None:
             return
 
-        try:
-            st = safe_open(filename=safetensors_path, framework="numpy", device="cpu")
-
-            # print(st.keys())
-
-            def hasKeyPrefix(pfx):
-                return any(k.startswith(pfx) for k in st.keys())
-
-            if "model.diffusion_model.x_embedder.proj.weight" in st.keys():
-                self.model_type = ModelType.SD3
-            elif (
-                "model.diffusion_model.double_blocks.0.img_attn.norm.key_norm.scale"
-                in st.keys()
-                or "double_blocks.0.img_attn.norm.key_norm.scale" in st.keys()
-            ):
-                # print("flux1 model detected...")
-                self.model_type = ModelType.FLUX1
-            elif hasKeyPrefix("conditioner."):
-                self.model_type = ModelType.SDXL
-            elif hasKeyPrefix("cond_stage_model.model."):
-                self.model_type = ModelType.SD2
-            elif hasKeyPrefix("model."):
-                self.model_type = ModelType.SD1
-        except:
-            pass
+        if "model.diffusion_model.x_embedder.proj.weight" in st:
+            self.model_type = ModelType.SD3
+        elif (
+            "model.diffusion_model.double_blocks.0.img_attn.norm.key_norm.scale"
+            in st
+            or "double_blocks.0.img_attn.norm.key_norm.scale" in st
+        ):
+            # print("flux1 model detected...")
+            self.model_type = ModelType.FLUX1
+        elif st.has_prefix("conditioner."):
+            self.model_type = ModelType.SDXL
+        elif st.has_prefix("cond_stage_model.model."):
+            self.model_type = ModelType.SD2
+        elif st.has_prefix("model."):
+            self.model_type = ModelType.SD1
         
         # print(f"Model type: {self.model_type}")
 
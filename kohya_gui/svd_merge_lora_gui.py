@@ -1,5 +1,4 @@
 import gradio as gr
-import subprocess
 import os
 import sys
 from .common_gui import (
@@ -11,6 +10,7 @@ from .common_gui import (
 )
 
 from .custom_logging import setup_logging
+from .tool_daemon_client import run_tool
 
 # Set up logging
 log = setup_logging()
@@ -98,7 +98,7 @@ def svd_merge_lora(
     env = setup_environment()
 
     # Run the command
-    subprocess.run(run_cmd, env=env)
+    run_tool(run_cmd, env=env)
 
 
 ###
@@ -0,0 +1,275 @@
+import os
+import re
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+from .custom_logging import setup_logging
+from .dataset_index import connect_index_db, index_db_path
+
+# Set up logging
+log = setup_logging()
+
+TAG_SCHEMA_VERSION = 2
+
+_META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tag_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER
+);
+"""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tag_names (
+    id INTEGER PRIMARY KEY,
+    tag TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS caption_tags (
+    rel_path TEXT NOT NULL,
+    separator TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    tag_ids BLOB,
+    PRIMARY KEY (rel_path, separator)
+);
+"""
+
+
+def _read_tags(path: str, tag_separator: str) -> list:
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return [tag for tag in (tag.strip() for tag in f.read().split(tag_separator)) if tag]
+
+
+def count_words(tag: str) -> int:
+    # Ignore extra spaces
+    return len(re.findall(r"\s+", tag)) + 1
+
+
+class TagIndex:
+    """
+    Tag statistics of the caption files of a folder, kept up to date incrementally.
+
+    Every distinct tag is interned to an integer id; each caption file is stored as the array of its tag ids,
+    together with the file size and mtime and the tag separator it was split with. `refresh` stats all caption
+    files but only reads the new or changed ones (in parallel), so re-analysis after editing a few captions is
+    cheap. The index is persisted in the folder's dataset index database (see dataset_index.index_db_path). Frequencies and co-occurrences are computed from the id arrays
+    with NumPy and SciPy sparse matrices.
+    """
+
+    def __init__(self, root: str, caption_ext: str = ".txt", recursive: bool = True, tag_separator: str = ",", db_path: Optional[str] = None):
+        self.root = os.path.abspath(root)
+        self.caption_ext = caption_ext if caption_ext.startswith(".") else "." + caption_ext
+        self.recursive = recursive
+        self.tag_separator = tag_separator
+        self._lock = threading.RLock()
+        self._conn, self.db_path = connect_index_db(db_path or index_db_path(self.root))
+        self._conn.executescript(_META_SCHEMA)
+        row = self._conn.execute("SELECT value FROM tag_meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != TAG_SCHEMA_VERSION:
+            self._conn.executescript("DROP TABLE IF EXISTS tag_names; DROP TABLE IF EXISTS caption_tags;")
+            self._conn.execute("INSERT OR REPLACE INTO tag_meta VALUES ('version', ?)", (TAG_SCHEMA_VERSION,))
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+        self.tags = [None] * (self._conn.execute("SELECT COALESCE(MAX(id), -1) + 1 FROM tag_names").fetchone()[0])
+        for tag_id, tag in self._conn.execute("SELECT id, tag FROM tag_names"):
+            self.tags[tag_id] = tag
+        self._tag_ids = {tag: tag_id for tag_id, tag in enumerate(self.tags) if tag is not None}
+        # rel_path -> (size, mtime_ns, np.ndarray of tag ids); all caption extensions and separators of the folder
+        # share the database, rows split with another separator are not used
+        self._captions = {}
+        for rel_path, size, mtime_ns, blob in self._conn.execute(
+            "SELECT rel_path, size, mtime_ns, tag_ids FROM caption_tags WHERE separator = ?", (self.tag_separator,)
+        ):
+            self._captions[rel_path] = (size, mtime_ns, np.frombuffer(blob, dtype=np.int32))
+        self._derived = {}
+
+    def _intern(self, tag_lists) -> None:
+        # ids are assigned by SQLite, so several indexes (or processes) sharing the database agree on them
+        new_tags = {tag for tags in tag_lists for tag in tags if tag not in self._tag_ids}
+        if not new_tags:
+            return
+        self._conn.executemany("INSERT OR IGNORE INTO tag_names (tag) VALUES (?)", ((tag,) for tag in new_tags))
+        for tag_id, tag in self._conn.execute("SELECT id, tag FROM tag_names WHERE id >= ?", (len(self.tags),)):
+            self.tags.extend([None] * (tag_id + 1 - len(self.tags)))
+            self.tags[tag_id] = tag
+            self._tag_ids[tag] = tag_id
+
+    def _scan(self) -> dict:
+        # rel_path -> (size, mtime_ns) of the caption files with this index' extension
+        found = {}
+        stack = [""]
+        while stack:
+            rel_dir = stack.pop()
+            try:
+                with os.scandir(os.path.join(self.root, rel_dir)) as entries:
+                    for entry in entries:
+                        rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                        try:
+                            if entry.is_dir():
+                                if self.recursive:
+                                    stack.append(rel_path)
+                            elif entry.name.endswith(self.caption_ext):
+                                stat = entry.stat()
+                                found[rel_path.replace(os.sep, "/")] = (stat.st_size, stat.st_mtime_ns)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return found
+
+    def _in_scope(self, rel_path: str) -> bool:
+        return rel_path.endswith(self.caption_ext) and (self.recursive or "/" not in rel_path)
+
+    def refresh(self, max_workers: int = 16) -> "TagIndex":
+        """
+        Brings the index up to date with the caption files and returns self.
+        """
+        with self._lock:
+            found = self._scan()
+            changed = [rel_path for rel_path, stat in found.items() if self._captions.get(rel_path, (None, None))[:2] != stat]
+            removed = [rel_path for rel_path in self._captions if self._in_scope(rel_path) and rel_path not in found]
+
+            if changed:
+                paths = [os.path.join(self.root, rel_path) for rel_path in changed]
+                with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                    contents = list(pool.map(lambda path: _read_tags(path, self.tag_separator), paths))
+                self._intern(contents)
+                rows = []
+                for rel_path, tags in zip(changed, contents):
+                    tag_ids = np.array([self._tag_ids[tag] for tag in tags], dtype=np.int32)
+                    size, mtime_ns = found[rel_path]
+                    self._captions[rel_path] = (size, mtime_ns, tag_ids)
+                    rows.append((rel_path, self.tag_separator, size, mtime_ns, array("i", tag_ids.tolist()).tobytes()))
+                self._conn.executemany("INSERT OR REPLACE INTO caption_tags VALUES (?, ?, ?, ?, ?)", rows)
+            for rel_path in removed:
+                del self._captions[rel_path]
+                self._conn.execute(
+                    "DELETE FROM caption_tags WHERE rel_path = ? AND separator = ?", (rel_path, self.tag_separator)
+                )
+            self._conn.commit()
+            if changed or removed:
+                self._derived = {}
+                log.debug(f"Tag index {self.root}: read {len(changed)} caption file(s), dropped {len(removed)}")
+        return self
+
+    def caption_paths(self) -> list:
+        """
+        Relative paths (with "/" separators) of the indexed caption files, sorted.
+        """
+        with self._lock:
+            return sorted(rel_path for rel_path in self._captions if self._in_scope(rel_path))
+
+    def caption_tag_ids(self, rel_path: str) -> np.ndarray:
+        return self._captions[rel_path][2]
+
+    def _incidence(self):
+        # (captions x tags) 0/1 matrix and the tag occurrence counts, cached until the next change
+        if "incidence" not in self._derived:
+            from scipy import sparse
+
+            paths = self.caption_paths()
+            arrays = [self._captions[rel_path][2] for rel_path in paths]
+            tag_ids = np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.int32)
+            rows = np.repeat(np.arange(len(arrays)), [len(ids) for ids in arrays])
+            incidence = sparse.csr_matrix(
+                (np.ones(len(tag_ids), dtype=np.int32), (rows, tag_ids)), shape=(len(arrays), len(self.tags))
+            )
+            incidence.sum_duplicates()
+            incidence.data[:] = 1
+            self._derived["incidence"] = incidence
+            self._derived["counts"] = np.bincount(tag_ids, minlength=len(self.tags))
+        return self._derived["incidence"]
+
+    def tag_counts(self) -> np.ndarray:
+        """
+        Number of occurrences of every tag id, duplicates within a caption included.
+        """
+        with self._lock:
+            self._incidence()
+            return self._derived["counts"]
+
+    def document_frequencies(self) -> np.ndarray:
+        """
+        Number of captions containing every tag id.
+        """
+        with self._lock:
+            return np.asarray(self._incidence().sum(axis=0)).ravel()
+
+    def cooccurrence(self):
+        """
+        Sparse (tags x tags) matrix of the number of captions containing both tags; the diagonal holds the
+        document frequencies.
+        """
+        with self._lock:
+            if "cooccurrence" not in self._derived:
+                incidence = self._incidence()
+                self._derived["cooccurrence"] = (incidence.T @ incidence).tocsr()
+            return self._derived["cooccurrence"]
+
+    def most_common(self, n: Optional[int] = None) -> list:
+        """
+        [(tag, count)] by descending occurrence count, like Counter.most_common.
+        """
+        counts = self.tag_counts()
+        order = np.argsort(-counts, kind="stable")
+        order = order[counts[order] > 0]
+        return [(self.tags[i], int(counts[i])) for i in order[:n]]
+
+    def cooccurring(self, tag: str, n: Optional[int] = 10) -> list:
+        """
+        [(tag, captions)] of the tags most often found together with tag.
+        """
+        tag_id = self._tag_ids.get(tag)
+        if tag_id is None:
+            return []
+        row = self.cooccurrence().getrow(tag_id)
+        pairs = [(int(col), int(value)) for col, value in zip(row.indices, row.data) if col != tag_id]
+        pairs.sort(key=lambda pair: (-pair[1], pair[0]))
+        return [(self.tags[col], value) for col, value in pairs[:n]]
+
+    def ordered_tags(self, rel_paths=None, max_words: Optional[int] = None) -> list:
+        """
+        Distinct tags (case-insensitive) in order of first appearance over rel_paths (default: all caption files,
+        sorted), optionally only those with at most max_words words.
+        """
+        with self._lock:
+            rel_paths = self.caption_paths() if rel_paths is None else rel_paths
+            seen_ids = set()
+            seen_keys = set()
+            tags = []
+            for rel_path in rel_paths:
+                entry = self._captions.get(rel_path)
+                if entry is None:
+                    continue
+                for tag_id in entry[2].tolist():
+                    if tag_id in seen_ids:
+                        continue
+                    seen_ids.add(tag_id)
+                    tag = self.tags[tag_id]
+                    tag_key = tag.lower()
+                    if tag_key not in seen_keys and (max_words is None or count_words(tag) <= max_words):
+                        tags.append(tag)
+                        seen_keys.add(tag_key)
+            return tags
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_tag_index(folder: str, caption_ext: str = ".txt", recursive: bool = True, tag_separator: str = ",") -> Optional[TagIndex]:
+    """
+    Returns the refreshed tag index of folder, shared between callers, or None if the folder does not exist.
+    """
+    if not folder or not os.path.isdir(folder):
+        return None
+    key = (os.path.abspath(folder), caption_ext, recursive, tag_separator)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = TagIndex(key[0], caption_ext, recursive, tag_separator)
+    return index.refresh()
@@ -1011,7 +1011,12 @@ def ti_tab(
                 config=config,
             )
 
-            gradio_dataset_balancing_tab(headless=headless)
+            gradio_dataset_balancing_tab(
+                headless=headless,
+                dataset_config_input=source_model.dataset_config,
+                reg_data_dir_input=folders.reg_data_dir,
+                config_file_input=configuration.config_file_name,
+            )
 
         with gr.Accordion("Parameters", open=False), gr.Column():
             with gr.Accordion("Basic", open="True"):
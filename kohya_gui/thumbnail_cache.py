@@ -0,0 +1,145 @@
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from .custom_logging import setup_logging
+
+# Set up logging
+log = setup_logging()
+
+THUMBNAIL_MAX_SIZE = 512
+THUMBNAIL_QUALITY = 80
+# Gradio only serves files from the working directory and the system temp directory
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "kohya_ss_thumbnails")
+
+
+class ThumbnailCache:
+    """
+    Downscaled WebP copies of images for display, generated lazily by a background thread pool.
+
+    Thumbnails are stored on disk under a name derived from the image path, size, mtime and thumbnail size, so an
+    edited image gets a new thumbnail and unchanged ones are reused across sessions. `get` waits for the
+    thumbnails it is asked for, `prefetch` only queues them (e.g. the next page).
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_size: int = THUMBNAIL_MAX_SIZE, quality: int = THUMBNAIL_QUALITY, max_workers: int = 4, max_bytes: int = 1 << 30):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thumbnail")
+        self._pending = {}  # thumbnail path -> future
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._pool.submit(self.prune)
+
+    def thumbnail_path(self, image_path: str) -> Optional[str]:
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        key = f"{os.path.abspath(image_path)}|{stat.st_size}|{stat.st_mtime_ns}|{self.max_size}|{self.quality}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + ".webp")
+
+    def _generate(self, image_path: str, thumbnail_path: str) -> str:
+        from PIL import Image, ImageOps
+
+        with Image.open(image_path) as image:
+            # let the JPEG decoder downscale by a power of two while decoding, much faster for large photos
+            image.draft("RGB", (self.max_size, self.max_size))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((self.max_size, self.max_size), Image.Resampling.LANCZOS)
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+            os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+            tmp_path = f"{thumbnail_path}.{threading.get_ident()}.tmp"
+            try:
+                image.save(tmp_path, format="WEBP", quality=self.quality, method=4)
+                os.replace(tmp_path, thumbnail_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return thumbnail_path
+
+    def _submit(self, image_path: str):
+        thumbnail_path = self.thumbnail_path(image_path)
+        if thumbnail_path is None or os.path.exists(thumbnail_path):
+            return thumbnail_path, None
+        with self._lock:
+            future = self._pending.get(thumbnail_path)
+            if future is None:
+                future = self._pending[thumbnail_path] = self._pool.submit(self._generate, image_path, thumbnail_path)
+                future.add_done_callback(lambda _: self._forget(thumbnail_path))
+        return thumbnail_path, future
+
+    def _forget(self, thumbnail_path: str):
+        with self._lock:
+            self._pending.pop(thumbnail_path, None)
+
+    def prefetch(self, image_paths) -> None:
+        """
+        Queues thumbnails of image_paths for generation without waiting for them.
+        """
+        for image_path in image_paths:
+            if image_path:
+                self._submit(image_path)
+
+    def get(self, image_paths) -> list:
+        """
+        Returns the thumbnail paths of image_paths, generating missing ones in parallel. Entries that are None stay
+        None; if a thumbnail cannot be generated the original image path is returned instead.
+        """
+        submitted = [self._submit(image_path) if image_path else (None, None) for image_path in image_paths]
+        thumbnails = []
+        for image_path, (thumbnail_path, future) in zip(image_paths, submitted):
+            if future is not None:
+                try:
+                    future.result()
+                except Exception as e:
+                    log.warning(f"Could not create a thumbnail of {image_path}: {e}")
+                    thumbnail_path = image_path
+            thumbnails.append(thumbnail_path if thumbnail_path is not None else image_path)
+        return thumbnails
+
+    def prune(self) -> None:
+        """
+        Deletes the least recently written thumbnails while the cache is larger than max_bytes.
+        """
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_bytes * 0.8:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_thumbnail_cache() -> ThumbnailCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ThumbnailCache()
+        return _cache
@@ -0,0 +1,97 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+from typing import Optional
+
+from .custom_logging import setup_logging
+
+# Set up logging
+log = setup_logging()
+
+# written by tools/tool_daemon.py while it runs
+DEFAULT_STATE_FILE = os.environ.get("KOHYA_TOOL_DAEMON_STATE") or os.path.join(
+    os.path.expanduser("~"), ".cache", "kohya_ss", "tool_daemon.json"
+)
+CONNECT_TIMEOUT = 1.0
+# the daemon sends a heartbeat every 5 s while a job waits or runs; this much silence means it stopped responding
+READ_TIMEOUT = 30.0
+
+
+def _connect(state_file: str):
+    try:
+        with open(state_file, encoding="utf-8") as f:
+            state = json.load(f)
+        sock = socket.create_connection((state["host"], state["port"]), timeout=CONNECT_TIMEOUT)
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, None
+    sock.settimeout(READ_TIMEOUT)
+    return sock, state.get("token", "")
+
+
+def _run_in_daemon(run_cmd, env, capture_output: bool, state_file: str) -> Optional[subprocess.CompletedProcess]:
+    # None if no daemon is running, it refused the job or it stopped responding before starting it
+    sock, token = _connect(state_file)
+    if sock is None:
+        return None
+    request = {"token": token, "argv": [str(arg) for arg in run_cmd[1:]], "env": env, "cwd": os.getcwd()}
+    output = {"stdout": [], "stderr": []}
+    started = False
+    returncode = None
+    with sock, sock.makefile("rb") as replies:
+        try:
+            sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+            for line in replies:
+                message = json.loads(line)
+                if "error" in message:
+                    log.warning(f"The tool daemon refused the job: {message['error']}")
+                    return None
+                if "started" in message:
+                    started = True
+                    log.info("Running in the tool daemon")
+                if "returncode" in message:
+                    returncode = message["returncode"]
+                for name in ("stdout", "stderr"):
+                    if name in message:
+                        if capture_output:
+                            output[name].append(message[name])
+                        else:
+                            stream = sys.stdout if name == "stdout" else sys.stderr
+                            stream.write(message[name])
+                            stream.flush()
+        except socket.timeout:
+            if not started:
+                log.warning(f"The tool daemon sent nothing for {READ_TIMEOUT:.0f}s, running the job here instead")
+                return None
+            # the daemon may still be running the job, so running it here too could clash on its output files
+            log.error(f"The tool daemon stopped responding for {READ_TIMEOUT:.0f}s while running the job")
+        except (OSError, ValueError) as e:
+            log.error(f"Lost the connection to the tool daemon: {e}")
+    if not started:
+        return None
+    if returncode is None:
+        log.error("The tool daemon stopped before the job finished")
+        returncode = 1
+    return subprocess.CompletedProcess(
+        run_cmd,
+        returncode,
+        "".join(output["stdout"]) if capture_output else None,
+        "".join(output["stderr"]) if capture_output else None,
+    )
+
+
+def run_tool(run_cmd, env=None, capture_output: bool = False, state_file: str = DEFAULT_STATE_FILE) -> subprocess.CompletedProcess:
+    """
+    Runs run_cmd ([python, script, *args]) in the tool daemon (tools/tool_daemon.py) when one is running, which
+    keeps torch imported and recently used checkpoints mapped between jobs, else as a subprocess like before.
+    With capture_output the returned stdout and stderr are decoded strings.
+    """
+    result = _run_in_daemon(run_cmd, env, capture_output, state_file)
+    if result is not None:
+        return result
+    result = subprocess.run(run_cmd, env=env, capture_output=capture_output)
+    if capture_output:
+        result.stdout = result.stdout.decode("utf-8", errors="replace")
+        result.stderr = result.stderr.decode("utf-8", errors="replace")
+    return result
@@ -1,5 +1,4 @@
 import gradio as gr
-import subprocess
 import os
 import sys
 from .common_gui import (
@@ -10,6 +9,7 @@ from .common_gui import (
 )
 
 from .custom_logging import setup_logging
+from .tool_daemon_client import run_tool
 
 # Set up logging
 log = setup_logging()
@@ -48,16 +48,10 @@ def verify_lora(
     # Set the environment variable for the Python path
     env = setup_environment()
 
-    # Run the command using subprocess.Popen for asynchronous handling
-    process = subprocess.Popen(
-        run_cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        env=env,
-    )
-    output, error = process.communicate()
+    # Run the command in the tool daemon if one is running, else as a subprocess
+    result = run_tool(run_cmd, env=env, capture_output=True)
 
-    return (output.decode(), error.decode())
+    return (result.stdout, result.stderr)
 
 
 ###
@@ -1,8 +1,8 @@
 import gradio as gr
 import subprocess
+from .caption_pipeline import CaptionPipeline
 from .common_gui import (
     get_folder_path,
-    add_pre_postfix,
     scriptdir,
     list_dirs,
     get_executable_path, setup_environment,
@@ -126,13 +126,15 @@ def caption_images(
     # Run the command in the sd-scripts folder context
     subprocess.run(run_cmd, env=env)
 
-    # Add prefix and postfix
-    add_pre_postfix(
-        folder=train_data_dir,
-        caption_file_ext=caption_extension,
-        prefix=always_first_tags,
-        recursive=recursive,
-    )
+    # Put the always-first tags in front of the generated tags (dropping any duplicate further back)
+    if always_first_tags:
+        CaptionPipeline(
+            caption_ext=caption_extension,
+            overwrite=True,
+            first_tags=always_first_tags,
+            tag_separator=caption_separator,
+            recursive=recursive,
+        ).run(train_data_dir)
 
     log.info("...captioning done")
 
@@ -0,0 +1,108 @@
+import os
+
+import pytest
+import torch
+from PIL import Image
+from safetensors.torch import load_file, save_file
+
+from kohya_gui.blip2_caption_service import Blip2CaptionService
+
+# Runs the resident captioning worker end to end on CPU with a tiny stand-in for BLIP2: a 3x3 linear "model" stored
+# as a .safetensors checkpoint that names the dominant color of each image. The loader is passed to the service
+# like load_blip2, so it has to stay a top-level function the spawned worker can import.
+
+COLOR_NAMES = ["red", "green", "blue"]
+
+
+class TinyProcessor:
+    def __call__(self, images, return_tensors="pt"):
+        pixels = torch.tensor(list(images.resize((4, 4)).getdata()), dtype=torch.float32) / 255
+        return {"pixel_values": pixels.T.reshape(1, 3, 4, 4)}
+
+    def batch_decode(self, generated_ids, skip_special_tokens=True):
+        return [f" a {COLOR_NAMES[int(ids[0])]} image, batch of {int(ids[1])} " for ids in generated_ids]
+
+
+class TinyCaptioner(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.proj = torch.nn.Linear(3, 3, bias=False)
+
+    def generate(self, pixel_values, **generate_kwargs):
+        logits = self.proj(pixel_values.mean(dim=(2, 3)))
+        batch = torch.full((len(pixel_values),), len(pixel_values))
+        return torch.stack([logits.argmax(dim=1), batch], dim=1)
+
+
+def load_tiny_captioner(model_id, dtype, device):
+    # model_id is the checkpoint path; every load is logged next to it so tests can count them
+    with open(model_id + ".loads", "a", encoding="utf-8") as f:
+        f.write(f"{dtype}\n")
+    model = TinyCaptioner()
+    model.load_state_dict(load_file(model_id))
+    return TinyProcessor(), model.to(device, dtype).eval()
+
+
+@pytest.fixture
+def tiny_checkpoint(tmp_path):
+    path = str(tmp_path / "tiny_captioner.safetensors")
+    save_file({"proj.weight": torch.eye(3)}, path)
+    return path
+
+
+@pytest.fixture
+def service():
+    service = Blip2CaptionService(loader=load_tiny_captioner)
+    yield service
+    service.shutdown()
+
+
+def _write_images(folder, colors):
+    paths = []
+    for i, color in enumerate(colors):
+        path = os.path.join(folder, f"{i:02d}_{color}.png")
+        Image.new("RGB", (16, 12), color).save(path)
+        paths.append(path)
+    return paths
+
+
+def _read_caption(image_path, ext=".txt"):
+    with open(os.path.splitext(image_path)[0] + ext, encoding="utf-8") as f:
+        return f.read()
+
+
+def test_captions_batches_and_skips_unreadable_images(tmp_path, tiny_checkpoint, service):
+    images = _write_images(str(tmp_path), ["red", "green", "blue", "red"])
+    broken = str(tmp_path / "broken.png")
+    with open(broken, "wb") as f:
+        f.write(b"not an image")
+    progress = []
+
+    stats = service.caption(
+        images + [broken], {"max_new_tokens": 4}, caption_file_ext=".caption", model_id=tiny_checkpoint,
+        dtype="float32", batch_size=2, num_workers=2, progress=lambda done, total: progress.append((done, total)),
+    )
+
+    assert stats["captioned"] == 4
+    assert stats["failed"] == 1
+    assert [_read_caption(path, ".caption") for path in images] == [
+        "a red image, batch of 2", "a green image, batch of 2", "a blue image, batch of 2", "a red image, batch of 2",
+    ]
+    assert not os.path.exists(str(tmp_path / "broken.caption"))
+    assert progress[-1] == (5, 5)
+
+
+def test_model_stays_loaded_between_jobs(tmp_path, tiny_checkpoint, service):
+    first = _write_images(str(tmp_path), ["blue"])
+    service.caption(first, {}, model_id=tiny_checkpoint, dtype="float32", num_workers=0)
+    assert service.is_alive()
+    second = _write_images(str(tmp_path), ["green", "red", "blue"])[1:]
+    stats = service.caption(second, {}, model_id=tiny_checkpoint, dtype="float32", batch_size=4, num_workers=0)
+
+    assert stats == {"captioned": 2, "failed": 0, "elapsed": stats["elapsed"]}
+    assert [_read_caption(path) for path in second] == ["a red image, batch of 2", "a blue image, batch of 2"]
+    with open(tiny_checkpoint + ".loads", encoding="utf-8") as f:
+        assert f.read().splitlines() == ["torch.float32"]
+
+    service.shutdown()
+    assert not service.is_alive()
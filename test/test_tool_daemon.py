@@ -0,0 +1,105 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from kohya_gui import tool_daemon_client
+from kohya_gui.tool_daemon_client import run_tool
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+JOB = os.path.join(REPO_DIR, "test", "tool_daemon_job.py")
+
+
+def _wait_for_state_file(path, process, timeout=120.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            pytest.fail(f"tool daemon exited with code {process.returncode}")
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            time.sleep(0.2)
+    pytest.fail("tool daemon did not write its state file")
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    state_file = str(tmp_path / "tool_daemon.json")
+    env = dict(os.environ, KOHYA_TOOL_DAEMON_STATE=state_file)
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_DIR, "tools", "tool_daemon.py"), "--port", "0", "--cache_gb", "0.1"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        yield state_file, _wait_for_state_file(state_file, process)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    assert not os.path.exists(state_file)
+
+
+def test_run_tool_forwards_output_and_returncode(daemon, tmp_path, monkeypatch):
+    state_file, state = daemon
+    monkeypatch.chdir(tmp_path)
+
+    result = run_tool([sys.executable, JOB, "3", "x y"], capture_output=True, state_file=state_file)
+
+    assert result.returncode == 3
+    assert result.stdout == f"pid {state['pid']} cwd {tmp_path}\n"
+    assert result.stderr == "args 3 x y\n"
+    assert run_tool([sys.executable, JOB, "0"], capture_output=True, state_file=state_file).returncode == 0
+
+
+def _silent_daemon(tmp_path, replies=()):
+    # accepts the job, sends replies and then never answers again, like a daemon that hangs
+    server = socket.create_server(("127.0.0.1", 0))
+    connections = []
+
+    def serve():
+        connection, _ = server.accept()
+        connections.append(connection)
+        connection.makefile("rb").readline()
+        for reply in replies:
+            connection.sendall((json.dumps(reply) + "\n").encode("utf-8"))
+
+    threading.Thread(target=serve, daemon=True).start()
+    state_file = str(tmp_path / "tool_daemon.json")
+    with open(state_file, "w", encoding="utf-8") as f:
+        json.dump({"host": "127.0.0.1", "port": server.getsockname()[1], "token": "", "pid": -1}, f)
+    return server, connections, state_file
+
+
+def test_run_tool_falls_back_to_subprocess_when_daemon_is_silent(tmp_path, monkeypatch):
+    server, connections, state_file = _silent_daemon(tmp_path)
+    monkeypatch.setattr(tool_daemon_client, "READ_TIMEOUT", 0.5)
+
+    try:
+        result = run_tool([sys.executable, JOB, "2"], capture_output=True, state_file=state_file)
+    finally:
+        server.close()
+
+    assert connections
+    assert result.returncode == 2
+    assert result.stdout.startswith("pid ") and not result.stdout.startswith("pid -1 ")
+    assert result.stderr == "args 2\n"
+
+
+def test_run_tool_does_not_rerun_a_started_job_when_daemon_goes_silent(tmp_path, monkeypatch):
+    server, connections, state_file = _silent_daemon(tmp_path, [{"started": True}, {"stdout": "partial\n"}])
+    monkeypatch.setattr(tool_daemon_client, "READ_TIMEOUT", 0.5)
+
+    try:
+        result = run_tool([sys.executable, JOB, "0"], capture_output=True, state_file=state_file)
+    finally:
+        server.close()
+
+    assert connections
+    assert result.returncode == 1
+    assert result.stdout == "partial\n"
+    assert result.stderr == ""
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Job for test_tool_daemon.py: reports where it ran, writes to both streams and exits with the code it is given.
+
+print(f"pid {os.getpid()} cwd {os.getcwd()}")
+print(f"args {' '.join(sys.argv[1:])}", file=sys.stderr)
+sys.exit(int(sys.argv[1]))
@@ -0,0 +1,153 @@
+import numpy as np
+
+# Aspect ratio bucketing shared by the image grouping tools.
+#
+# Images are handled as arrays sorted by aspect ratio (width / height). A bucketing is described by its
+# boundaries: an int array `bounds` of length n_buckets + 1 with bounds[0] == 0 and bounds[-1] == n, bucket i
+# holding the sorted images bounds[i]:bounds[i+1]. Every image of a bucket is center cropped (or padded) to the
+# mean aspect ratio of the bucket.
+
+
+def equal_count_bounds(n: int, n_groups: int) -> np.ndarray:
+    """
+    Boundaries of n_groups buckets of n // n_groups images each, the last bucket also takes the remainder.
+    """
+    if n_groups <= 0 or n_groups > n:
+        raise ValueError("Error: n_groups must be a positive integer less than or equal to the number of images.")
+    bounds = np.arange(n_groups + 1, dtype=np.int64) * (n // n_groups)
+    bounds[-1] = n
+    return bounds
+
+
+def fixed_size_bounds(n: int, group_size: int) -> np.ndarray:
+    """
+    Boundaries of consecutive buckets of group_size images, the last bucket may be smaller.
+    """
+    if group_size <= 0:
+        raise ValueError("Error: group_size must be a positive integer.")
+    return np.append(np.arange(0, n, group_size, dtype=np.int64), n)
+
+
+def group_means(sorted_ratios: np.ndarray, bounds: np.ndarray) -> np.ndarray:
+    """
+    Mean aspect ratio of every bucket.
+    """
+    sorted_ratios = np.asarray(sorted_ratios, dtype=np.float64)
+    if len(bounds) < 2:
+        return np.zeros(0)
+    return np.add.reduceat(sorted_ratios, bounds[:-1]) / np.diff(bounds)
+
+
+def _prefix_sums(sorted_ratios: np.ndarray, areas):
+    ratios = np.asarray(sorted_ratios, dtype=np.float64)
+    areas = np.ones_like(ratios) if areas is None else np.asarray(areas, dtype=np.float64)
+    prefix = lambda values: np.concatenate(([0.0], np.cumsum(values)))
+    return ratios, prefix(ratios), prefix(areas), prefix(areas * ratios), prefix(areas / ratios)
+
+
+def _segment_losses(ratios, p_ratio, p_area, p_area_ratio, p_area_inv, starts, ends):
+    # Area cropped away when the images starts:ends are cropped to their mean ratio r: an image with ratio
+    # a < r loses 1 - a / r of its area (height is cut), one with a >= r loses 1 - r / a (width is cut).
+    target = (p_ratio[ends] - p_ratio[starts]) / (ends - starts)
+    split = np.clip(np.searchsorted(ratios, target), starts, ends)
+    return (
+        p_area[ends] - p_area[starts]
+        - (p_area_ratio[split] - p_area_ratio[starts]) / target
+        - target * (p_area_inv[ends] - p_area_inv[split])
+    )
+
+
+def bucket_losses(sorted_ratios: np.ndarray, starts, ends, areas=None) -> np.ndarray:
+    """
+    Area cropped away from each bucket sorted_ratios[starts[i]:ends[i]], in units of `areas` (images, i.e. areas
+    of 1, by default). Buckets may overlap, e.g. to evaluate every window of a given size at once.
+    """
+    sums = _prefix_sums(sorted_ratios, areas)
+    return _segment_losses(*sums, np.asarray(starts), np.asarray(ends))
+
+
+def cropped_area(sorted_ratios: np.ndarray, bounds: np.ndarray, areas=None) -> float:
+    """
+    Total area cropped away by a bucketing, in units of `areas` (images, i.e. areas of 1, by default).
+    """
+    return float(np.sum(bucket_losses(sorted_ratios, bounds[:-1], bounds[1:], areas)))
+
+
+def optimal_bounds(sorted_ratios: np.ndarray, n_buckets: int, step: int = 1, areas=None, max_candidates: int = 1024) -> np.ndarray:
+    """
+    Splits the sorted images into n_buckets buckets so that the total cropped area is minimal.
+
+    Dynamic program over the possible bucket boundaries: the cost of any bucket is evaluated in O(1) from prefix
+    sums, a whole layer of the program is one (m, m) array operation for m candidate boundaries.
+
+    Args:
+        sorted_ratios: Aspect ratios sorted ascending.
+        n_buckets: Number of buckets; fewer are returned if there are not enough candidate boundaries.
+        step: Bucket sizes are multiples of step (e.g. the batch size), except for the last bucket.
+        areas: Pixel area of each image to minimize cropped pixels instead of cropped image fractions.
+        max_candidates: Boundaries are only placed between images of different aspect ratio; if there are
+            more such places than max_candidates, an evenly spaced subset of them is used and the result is
+            optimal for that subset.
+
+    Returns:
+        np.ndarray: The bucket boundaries.
+    """
+    sums = _prefix_sums(sorted_ratios, areas)
+    ratios = sums[0]
+    n = len(ratios)
+    if n == 0:
+        return np.zeros(1, dtype=np.int64)
+
+    candidates = np.arange(step, n, step, dtype=np.int64)
+    candidates = candidates[ratios[candidates - 1] < ratios[candidates]]
+    if len(candidates) > max_candidates:
+        candidates = candidates[np.linspace(0, len(candidates) - 1, max_candidates).round().astype(np.int64)]
+    candidates = np.concatenate(([0], candidates, [n]))
+    m = len(candidates)
+    n_buckets = max(1, min(n_buckets, m - 1))
+
+    starts, ends = np.meshgrid(candidates, candidates, indexing="ij")
+    valid = starts < ends
+    cost = np.full((m, m), np.inf)
+    cost[valid] = _segment_losses(*sums, starts[valid], ends[valid])
+
+    # best[j]: minimal loss of covering images 0:candidates[j] with the buckets placed so far
+    best = cost[0].copy()
+    back = []
+    for _ in range(n_buckets - 1):
+        total = best[:, None] + cost
+        previous = np.argmin(total, axis=0)
+        best = total[previous, np.arange(m)]
+        back.append(previous)
+
+    bounds = [m - 1]
+    for previous in reversed(back):
+        bounds.append(previous[bounds[-1]])
+    bounds.append(0)
+    return candidates[np.array(bounds[::-1])]
+
+
+def center_crop_boxes(widths, heights, targets, integer: bool = True) -> np.ndarray:
+    """
+    (left, top, right, bottom) boxes that center crop images of the given sizes to the target aspect ratios.
+
+    With integer=True the cropped side is truncated and the offset rounded down, otherwise float boxes are
+    returned (PIL rounds them when cropping).
+    """
+    widths = np.asarray(widths, dtype=np.float64)
+    heights = np.asarray(heights, dtype=np.float64)
+    targets = np.broadcast_to(np.asarray(targets, dtype=np.float64), widths.shape)
+    ratios = widths / heights
+    too_wide = ratios > targets
+    new_widths = np.where(too_wide, targets * heights, widths)
+    new_heights = np.where(too_wide, heights, widths / targets)
+    if integer:
+        new_widths = np.where(too_wide, np.floor(new_widths), widths)
+        new_heights = np.where(too_wide | (ratios == targets), heights, np.floor(new_heights))
+        left = (widths - new_widths) // 2
+        top = (heights - new_heights) // 2
+    else:
+        left = (widths - new_widths) / 2
+        top = (heights - new_heights) / 2
+    boxes = np.stack([left, top, left + new_widths, top + new_heights], axis=1)
+    return boxes.astype(np.int64) if integer else boxes
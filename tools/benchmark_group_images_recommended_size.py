@@ -0,0 +1,94 @@
+import argparse
+import itertools
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from aspect_buckets import cropped_area, fixed_size_bounds
+from group_images_recommended_size import best_grouping
+
+# Times best_grouping of group_images_recommended_size.py on seeded synthetic aspect ratios for a range of
+# group sizes, next to the exhaustive search over removal subsets it replaced (2^group_size subsets per group,
+# only run up to --max_exhaustive). On small inputs the dynamic program is also checked against a brute force
+# over every choice of removed images.
+
+# Aspect ratios of common photo and render formats, sampled with some jitter.
+COMMON_RATIOS = [9 / 16, 2 / 3, 3 / 4, 4 / 5, 1.0, 5 / 4, 4 / 3, 3 / 2, 16 / 9]
+
+
+def make_ratios(num_images: int, rng: np.random.Generator, jitter: float) -> np.ndarray:
+    ratios = rng.choice(COMMON_RATIOS, num_images) * np.exp(rng.normal(0.0, jitter, num_images))
+    return np.sort(ratios)
+
+
+def exhaustive_group_search(ratios: np.ndarray) -> float:
+    # the removed algorithm for a single group: mean crop loss of every non-empty remaining subset
+    best_loss = np.inf
+    indices = range(len(ratios))
+    for r in range(1, len(ratios)):
+        for combination in itertools.combinations(indices, r):
+            remaining = np.delete(ratios, combination)
+            best_loss = min(best_loss, cropped_area(remaining, np.array([0, len(remaining)])) / len(remaining))
+    return best_loss
+
+
+def brute_force_grouping(ratios: np.ndarray, group_size: int, n_remove: int) -> float:
+    best_loss = np.inf
+    for removed in itertools.combinations(range(len(ratios)), n_remove):
+        remaining = np.delete(ratios, removed)
+        best_loss = min(best_loss, cropped_area(remaining, fixed_size_bounds(len(remaining), group_size)))
+    return best_loss
+
+
+def check_optimality(args: argparse.Namespace, rng: np.random.Generator):
+    worst_gap = 0.0
+    for _ in range(args.check_trials):
+        group_size = int(rng.integers(2, 6))
+        num_images = int(rng.integers(group_size + 1, 15))
+        ratios = make_ratios(num_images, rng, args.jitter)
+        n_remove = num_images % group_size
+        _, _, loss = best_grouping(ratios, group_size, n_remove)
+        reference = brute_force_grouping(ratios, group_size, n_remove)
+        worst_gap = max(worst_gap, (loss - reference) / max(reference, 1e-12))
+    print(f"Optimality check: {args.check_trials} random cases, worst relative gap to brute force {worst_gap:.2e}")
+
+
+def run_benchmark(args: argparse.Namespace):
+    rng = np.random.default_rng(args.seed)
+    check_optimality(args, rng)
+
+    ratios = make_ratios(args.num_images, rng, args.jitter)
+    print(f"{'group size':>10} {'removed':>8} {'dp time':>10} {'avg loss':>10} {'unoptimized':>12} {'exhaustive / group':>19}")
+    for group_size in args.group_sizes:
+        n_remove = args.num_images % group_size
+        start = time.perf_counter()
+        _, _, loss = best_grouping(ratios, group_size, n_remove)
+        dp_time = time.perf_counter() - start
+        # what grouping the sorted images without leaving any out of the last group costs
+        unoptimized = cropped_area(ratios, fixed_size_bounds(args.num_images, group_size)) / args.num_images
+
+        if group_size <= args.max_exhaustive:
+            start = time.perf_counter()
+            exhaustive_group_search(ratios[:group_size])
+            exhaustive = f"{time.perf_counter() - start:.3f}s"
+        else:
+            exhaustive = f"~2^{group_size} subsets"
+        print(f"{group_size:>10} {n_remove:>8} {dp_time:>9.4f}s {loss / (args.num_images - n_remove):>10.5f} {unoptimized:>12.5f} {exhaustive:>19}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the group selection of group_images_recommended_size.py")
+    parser.add_argument("--num_images", type=int, default=5000, help="Number of synthetic images")
+    parser.add_argument("--group_sizes", type=int, nargs="+", default=[2, 4, 8, 12, 16, 24, 32, 64, 128], help="Group sizes to time")
+    parser.add_argument("--max_exhaustive", type=int, default=16, help="Largest group size to run the exhaustive search for")
+    parser.add_argument("--check_trials", type=int, default=200, help="Random cases checked against brute force")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Log-normal jitter of the sampled aspect ratios")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    run_benchmark(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
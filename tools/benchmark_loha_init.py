@@ -0,0 +1,103 @@
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import extract_loha_from_model as loha_extract
+
+# Compares the Kaiming/Normal initializer of extract_loha_from_model.py against --init_method svd on a
+# fixed, seeded set of synthetic weight deltas. For every layer it reports how many iterations were needed
+# to reach the target loss and the wall time spent (SVD time included for the svd initializer).
+
+# (name, shape) pairs loosely following SDXL attention, feed-forward and conv layers.
+SYNTHETIC_LAYERS = [
+    ("attn_320", (320, 320)),
+    ("attn_640", (640, 640)),
+    ("ff_640", (640, 2560)),
+    ("attn_1280", (1280, 1280)),
+    ("conv_320", (320, 320, 3, 3)),
+    ("conv_640", (640, 320, 3, 3)),
+]
+
+def make_synthetic_delta(shape: tuple, generator: torch.Generator, spectrum_rank: int, decay: float, noise: float) -> torch.Tensor:
+    # Fine-tuning deltas are dominated by a few directions with a decaying spectrum plus small dense noise.
+    out_dim = shape[0]
+    in_dim = 1
+    for dim in shape[1:]:
+        in_dim *= dim
+    k = min(spectrum_rank, out_dim, in_dim)
+    U, _ = torch.linalg.qr(torch.randn(out_dim, k, generator=generator))
+    V, _ = torch.linalg.qr(torch.randn(in_dim, k, generator=generator))
+    S = decay ** torch.arange(k, dtype=torch.float32)
+    delta = (U * S) @ V.T
+    delta = delta / delta.std() * 1e-3
+    delta += torch.randn(out_dim, in_dim, generator=generator) * (1e-3 * noise)
+    return delta.reshape(shape)
+
+def build_args(args: argparse.Namespace, init_method: str) -> argparse.Namespace:
+    return argparse.Namespace(
+        init_method=init_method, verbose=args.verbose, verbose_layer_debug=False, no_warm_start=False,
+        progress_check_interval=0, min_progress_loss_ratio=0.0, progress_check_start_iter=0,
+        advanced_projection_decay_cap_min=0.5, advanced_projection_decay_cap_max=1.05,
+        projection_sample_interval=20, projection_ema_alpha=0.1, projection_min_ema_history=5,
+    )
+
+def run_benchmark(args: argparse.Namespace):
+    torch.manual_seed(args.seed)
+    generator = torch.Generator().manual_seed(args.seed)
+    deltas = [(name, make_synthetic_delta(shape, generator, args.spectrum_rank, args.decay, args.noise)) for name, shape in SYNTHETIC_LAYERS]
+    loha_extract.iter_pbar_disabled_global = not args.verbose
+
+    results = {}
+    for init_method in args.init_methods:
+        loha_extract.args_global = build_args(args, init_method)
+        rows = []
+        for layer_idx, (name, delta) in enumerate(deltas):
+            is_conv = delta.dim() == 4
+            out_dim, in_dim_effective = delta.shape[0], delta.shape[1]
+            k_h, k_w = (delta.shape[2], delta.shape[3]) if is_conv else (1, 1)
+            target_loss = args.target_ratio * delta.pow(2).mean().item()
+            torch.manual_seed(args.seed + layer_idx)  # same Kaiming draw for every run of this layer
+            start = time.perf_counter()
+            opt = loha_extract.optimize_loha_for_layer(
+                name, delta, out_dim, in_dim_effective, k_h, k_w, args.rank, args.alpha,
+                lr=args.lr, max_iterations=args.max_iterations, min_iterations=1, target_loss=target_loss,
+                weight_decay=args.weight_decay, device=args.device, dtype=torch.float32, is_conv=is_conv,
+            )
+            elapsed = time.perf_counter() - start
+            rows.append((name, opt['iterations_done'], opt['stopped_early_by_loss'], opt['final_loss'], target_loss, elapsed))
+        results[init_method] = rows
+
+    print(f"\nrank={args.rank} alpha={args.alpha} lr={args.lr} max_iterations={args.max_iterations} target=({args.target_ratio} x mean(delta^2))")
+    header = f"{'init':<8} {'layer':<10} {'iters':>6} {'reached':>8} {'final_loss':>11} {'target':>11} {'time_s':>8}"
+    print(header)
+    print("-" * len(header))
+    for init_method, rows in results.items():
+        for name, iters, reached, final_loss, target_loss, elapsed in rows:
+            print(f"{init_method:<8} {name:<10} {iters:>6} {'yes' if reached else 'no':>8} {final_loss:>11.3e} {target_loss:>11.3e} {elapsed:>8.2f}")
+    print("-" * len(header))
+    for init_method, rows in results.items():
+        total_iters = sum(row[1] for row in rows)
+        reached = sum(1 for row in rows if row[2])
+        total_time = sum(row[5] for row in rows)
+        print(f"{init_method:<8} total iters {total_iters:>7}, reached target {reached}/{len(rows)}, total {total_time:.2f}s, {total_time / len(rows):.2f}s/layer")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark LoHA initializers (kaiming vs svd) on a fixed synthetic delta set.")
+    parser.add_argument("--init_methods", type=str, nargs="+", default=["kaiming", "svd"], choices=["kaiming", "svd"], help="Initializers to compare.")
+    parser.add_argument("--rank", type=int, default=8, help="LoHA rank for every layer.")
+    parser.add_argument("--alpha", type=float, default=8.0, help="LoHA alpha for every layer.")
+    parser.add_argument("--lr", type=float, default=1e-3, help="Learning rate.")
+    parser.add_argument("--max_iterations", type=int, default=1000, help="Iteration cap per layer.")
+    parser.add_argument("--weight_decay", type=float, default=1e-4, help="AdamW weight decay.")
+    parser.add_argument("--target_ratio", type=float, default=0.1, help="Target loss as a fraction of each delta's mean square.")
+    parser.add_argument("--spectrum_rank", type=int, default=64, help="Number of structured directions in each synthetic delta.")
+    parser.add_argument("--decay", type=float, default=0.8, help="Geometric decay of the synthetic singular values.")
+    parser.add_argument("--noise", type=float, default=0.05, help="Dense noise level relative to the structured part.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic deltas and Kaiming draws.")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu", help="Device to benchmark on.")
+    parser.add_argument("--verbose", action="store_true", help="Show per-layer optimizer output and progress bars.")
+    run_benchmark(parser.parse_args())
@@ -0,0 +1,303 @@
+import json
+import math
+import mmap
+import os
+import struct
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Tuple
+
+import torch
+
+from safetensors_header import read_header
+
+# Flat, module-free view of Stable Diffusion checkpoints for the LyCORIS tools.
+#
+# MappedSafetensors memory-maps a .safetensors file and hands out zero-copy torch views of its tensors, so
+# only the pages that are actually touched are read from disk. lora_layer_map maps the LoRA/LyCORIS module
+# names (lora_te_*, lora_te1_*, lora_te2_*, lora_unet_*) to the checkpoint tensors behind them, using the
+# same names the kohya model loaders give the modules (diffusers names for SD1/SD2, original names for SDXL).
+
+# safetensors header dtype strings -> torch dtypes
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8,
+    "U8": torch.uint8, "BOOL": torch.bool,
+}
+for _st_name, _torch_name in (("F8_E4M3", "float8_e4m3fn"), ("F8_E5M2", "float8_e5m2")):
+    if hasattr(torch, _torch_name):
+        SAFETENSORS_DTYPES[_st_name] = getattr(torch, _torch_name)
+SAFETENSORS_DTYPE_NAMES = {dtype: name for name, dtype in SAFETENSORS_DTYPES.items()}
+
+
+class MappedSafetensors:
+    """
+    Read-only memory map of a .safetensors file.
+
+    `get_tensor` returns views into the map without copying; they stay valid while the file is open and must
+    not be written to (the map is copy-on-write, so writes never reach the file but do cost private memory).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            header, self._data_start = read_header(f, path)
+            self.metadata = header.pop("__metadata__", None) or {}
+            self.header = header
+            self.nbytes = os.fstat(f.fileno()).st_size
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY) if self.nbytes > self._data_start else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.header
+
+    def __getitem__(self, key: str) -> torch.Tensor:
+        return self.get_tensor(key)
+
+    def keys(self):
+        return self.header.keys()
+
+    def dtype(self, key: str) -> torch.dtype:
+        return SAFETENSORS_DTYPES[self.header[key]["dtype"]]
+
+    def shape(self, key: str) -> Tuple[int, ...]:
+        return tuple(self.header[key]["shape"])
+
+    def keys_by_offset(self) -> list:
+        """
+        Tensor names in the order their data is stored, for sequential reads.
+        """
+        return sorted(self.header, key=lambda key: self.header[key]["data_offsets"][0])
+
+    def get_tensor(self, key: str, rows: Optional[Tuple[int, int]] = None) -> torch.Tensor:
+        """
+        Zero-copy view of tensor key, or of rows [start, end) of its leading dimension.
+        """
+        info = self.header[key]
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        shape = list(info["shape"])
+        begin, end = info["data_offsets"]
+        if rows is not None:
+            row_bytes = (end - begin) // max(shape[0], 1)
+            begin, end = begin + rows[0] * row_bytes, begin + rows[1] * row_bytes
+            shape[0] = rows[1] - rows[0]
+        if end <= begin:
+            return torch.empty(shape, dtype=dtype)
+        element_size = torch.empty(0, dtype=dtype).element_size()
+        tensor = torch.frombuffer(self._mmap, dtype=dtype, count=(end - begin) // element_size, offset=self._data_start + begin)
+        return tensor.reshape(shape)
+
+    def release(self, key: str):
+        """
+        Drops the mapped pages of tensor key from memory (they are read again if touched), so a single pass over
+        a large file does not leave it all resident. Views of key must not be used afterwards.
+        """
+        if self._mmap is None or not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        begin, end = self.header[key]["data_offsets"]
+        page_begin = (self._data_start + begin) // mmap.PAGESIZE * mmap.PAGESIZE
+        if self._data_start + end > page_begin:
+            self._mmap.madvise(mmap.MADV_DONTNEED, page_begin, self._data_start + end - page_begin)
+
+    def prefetch(self):
+        """
+        Asks the kernel to read the whole file ahead in the background, so later reads are served from memory.
+        """
+        if self._mmap is not None and hasattr(mmap, "MADV_WILLNEED"):
+            self._mmap.madvise(mmap.MADV_WILLNEED)
+
+    def close(self):
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # views handed out by get_tensor are still alive; the map is released with them
+                pass
+            self._mmap = None
+
+
+def safetensors_header(entries, metadata: Optional[dict] = None) -> Tuple[bytes, int]:
+    """
+    Serialized header (length prefix included) for tensors written back to back in the order of entries, a list
+    of (name, torch dtype, shape), and the size of the data section that follows it.
+    """
+    header = {"__metadata__": metadata} if metadata else {}
+    offset = 0
+    for key, dtype, shape in entries:
+        nbytes = math.prod(shape) * torch.empty(0, dtype=dtype).element_size()
+        header[key] = {"dtype": SAFETENSORS_DTYPE_NAMES[dtype], "shape": list(shape), "data_offsets": [offset, offset + nbytes]}
+        offset += nbytes
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    # pad with spaces so the tensor data starts 8-byte aligned
+    header_bytes += b" " * (-len(header_bytes) % 8)
+    return struct.pack("<Q", len(header_bytes)) + header_bytes, offset
+
+
+class LayerRef(NamedTuple):
+    key: str  # checkpoint tensor name
+    rows: Optional[Tuple[int, int]]  # row range of a fused tensor (OpenCLIP in_proj_weight), or None
+    shape: Tuple[int, ...]  # weight shape of the module the LoRA name refers to
+
+
+def detect_checkpoint_type(keys) -> str:
+    """
+    Returns "sdxl", "v2" or "v1" from the tensor names of a single-file checkpoint.
+    """
+    keys = list(keys)
+    if any(key.startswith("conditioner.embedders.") for key in keys):
+        return "sdxl"
+    if any(key.startswith("cond_stage_model.model.") for key in keys):
+        return "v2"
+    return "v1"
+
+
+# (original, diffusers) name parts inside resnet blocks
+_RESNET_PARTS = {
+    "in_layers.2": "conv1",
+    "out_layers.3": "conv2",
+    "emb_layers.1": "time_emb_proj",
+    "skip_connection": "conv_shortcut",
+}
+_UNET_TOP_LEVEL = {
+    "input_blocks.0.0": "conv_in",
+    "out.2": "conv_out",
+    "time_embed.0": "time_embedding.linear_1",
+    "time_embed.2": "time_embedding.linear_2",
+}
+_OPEN_CLIP_PARTS = {"attn.out_proj": "self_attn.out_proj", "mlp.c_fc": "mlp.fc1", "mlp.c_proj": "mlp.fc2"}
+
+
+def _diffusers_unet_name(name: str) -> Optional[str]:
+    # original SD UNet module path (without "model.diffusion_model.") -> diffusers module path
+    if name in _UNET_TOP_LEVEL:
+        return _UNET_TOP_LEVEL[name]
+    parts = name.split(".")
+    if len(parts) < 3 or not parts[1].isdigit():
+        return None
+    if parts[0] == "middle_block":
+        n, rest = int(parts[1]), ".".join(parts[2:])
+        prefix = "mid_block.attentions.0" if n == 1 else f"mid_block.resnets.{n // 2}"
+        return f"{prefix}.{_RESNET_PARTS.get(rest, rest) if n != 1 else rest}"
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    block, n, m, rest = parts[0], int(parts[1]), int(parts[2]), ".".join(parts[3:])
+    if block == "input_blocks":
+        i, j = (n - 1) // 3, (n - 1) % 3
+        if j == 2:
+            prefix, rest = f"down_blocks.{i}.downsamplers.0", rest.replace("op", "conv", 1)
+        else:
+            prefix = f"down_blocks.{i}.{'resnets' if m == 0 else 'attentions'}.{j}"
+    elif block == "output_blocks":
+        i, j = n // 3, n % 3
+        if m == 0:
+            prefix = f"up_blocks.{i}.resnets.{j}"
+        elif m == 1 and i > 0:
+            prefix = f"up_blocks.{i}.attentions.{j}"
+        else:
+            prefix = f"up_blocks.{i}.upsamplers.0"
+    else:
+        return None
+    if ".resnets." in prefix:
+        rest = _RESNET_PARTS.get(rest, rest)
+    return f"{prefix}.{rest}"
+
+
+def _lora_name(prefix: str, module_name: str) -> str:
+    return f"{prefix}.{module_name}".replace(".", "_")
+
+
+def _add_open_clip_layers(layers, prefix, root, shapes, skip_layers=()):
+    # OpenCLIP text encoder -> names of the converted transformers CLIPTextModel; q/k/v are rows of in_proj_weight
+    for key in sorted(shapes):
+        if not key.startswith(root + "transformer.resblocks.") or not key.endswith("weight"):
+            continue
+        layer, rest = key[len(root + "transformer.resblocks."):].split(".", 1)
+        if int(layer) in skip_layers:
+            continue
+        module_prefix = f"text_model.encoder.layers.{layer}."
+        if rest == "attn.in_proj_weight":
+            dim = shapes[key][0] // 3
+            for index, projection in enumerate(("q_proj", "k_proj", "v_proj")):
+                layers[_lora_name(prefix, module_prefix + "self_attn." + projection)] = LayerRef(
+                    key, (index * dim, (index + 1) * dim), (dim,) + tuple(shapes[key][1:])
+                )
+        elif rest[:-len(".weight")] in _OPEN_CLIP_PARTS:
+            layers[_lora_name(prefix, module_prefix + _OPEN_CLIP_PARTS[rest[:-len(".weight")]])] = LayerRef(key, None, tuple(shapes[key]))
+
+
+def _add_clip_layers(layers, prefix, root, shapes):
+    # transformers CLIPTextModel: the attention and MLP linears of the encoder layers
+    for key in sorted(shapes):
+        if not key.startswith(root) or len(shapes[key]) != 2:
+            continue
+        module_name = key[len(root):-len(".weight")]
+        if not module_name.startswith("text_model."):
+            module_name = "text_model." + module_name  # some SD1 checkpoints omit the text_model prefix
+        if module_name.startswith("text_model.encoder.layers.") and (".self_attn." in module_name or ".mlp." in module_name):
+            layers[_lora_name(prefix, module_name)] = LayerRef(key, None, tuple(shapes[key]))
+
+
+def lora_layer_map(shapes: dict, model_type: Optional[str] = None) -> "OrderedDict[str, LayerRef]":
+    """
+    Maps the LoRA module names of a single-file SD1/SD2/SDXL checkpoint to its tensors.
+
+    shapes holds checkpoint tensor name -> shape. The result covers the Linear/Conv2d weights the LyCORIS
+    extract/merge code targets (text encoder attention/MLP, UNet resnet/attention/sampler layers and, for SD1/SD2,
+    conv_in/conv_out/time embedding), text encoder(s) first.
+    """
+    model_type = model_type or detect_checkpoint_type(shapes)
+    layers = OrderedDict()
+    if model_type == "sdxl":
+        _add_clip_layers(layers, "lora_te1", "conditioner.embedders.0.transformer.", shapes)
+        _add_open_clip_layers(layers, "lora_te2", "conditioner.embedders.1.model.", shapes)
+    elif model_type == "v2":
+        # the converted text encoder only has 23 layers, SD2 uses the penultimate layer
+        _add_open_clip_layers(layers, "lora_te", "cond_stage_model.model.", shapes, skip_layers=(23,))
+    else:
+        _add_clip_layers(layers, "lora_te", "cond_stage_model.transformer.", shapes)
+
+    unet_root = "model.diffusion_model."
+    for key in sorted(shapes):
+        if not key.startswith(unet_root) or not key.endswith(".weight") or len(shapes[key]) not in (2, 4):
+            continue
+        name = key[len(unet_root):-len(".weight")]
+        shape = tuple(shapes[key])
+        if model_type == "sdxl":
+            # the SDXL UNet keeps the original module names; only the blocks are LoRA targets
+            if not name.startswith(("input_blocks.", "middle_block.", "output_blocks.")) or name == "input_blocks.0.0":
+                continue
+            module_name = name
+        else:
+            module_name = _diffusers_unet_name(name)
+            if module_name is None:
+                continue
+            if model_type == "v2" and len(shape) == 2 and module_name.split(".")[-1] in ("proj_in", "proj_out"):
+                shape = shape + (1, 1)  # the SD2 diffusers UNet keeps 1x1 convolutions for the transformer projections
+        layers[_lora_name("lora_unet", module_name)] = LayerRef(key, None, shape)
+    return layers
+
+
+def checkpoint_shapes(checkpoint) -> dict:
+    """
+    Tensor name -> shape of a MappedSafetensors or a state dict.
+    """
+    if isinstance(checkpoint, MappedSafetensors):
+        return {key: checkpoint.shape(key) for key in checkpoint.keys()}
+    return {key: tuple(value.shape) for key, value in checkpoint.items() if isinstance(value, torch.Tensor)}
+
+
+def load_layer(checkpoint, ref: LayerRef) -> torch.Tensor:
+    """
+    The weight behind ref from a MappedSafetensors (zero-copy) or a state dict, in the module's shape.
+    """
+    if isinstance(checkpoint, MappedSafetensors):
+        tensor = checkpoint.get_tensor(ref.key, ref.rows)
+    else:
+        tensor = checkpoint[ref.key]
+        if ref.rows is not None:
+            tensor = tensor[ref.rows[0]:ref.rows[1]]
+    return tensor.reshape(ref.shape)
@@ -1,8 +1,8 @@
 import argparse
-import glob
 import os
 from pathlib import Path
-from PIL import Image
+
+from image_transcode import add_transcode_arguments, find_images, output_path, transcode_images
 
 
 def writable_dir(target_path):
@@ -16,35 +16,22 @@ def writable_dir(target_path):
     else:
         raise argparse.ArgumentTypeError(f"Directory '{path}' does not exist.")
 
-def main(directory, in_ext, quality, delete_originals):
+def main(directory, in_ext, quality, delete_originals, recursive=False, workers=None, max_in_flight=None, verbose=True):
     out_ext = "jpg"
 
-    # Create the file pattern string using the input file extension
-    file_pattern = f"*.{in_ext}"
-
-    # Get the list of files in the directory that match the file pattern
-    files = glob.glob(os.path.join(directory, file_pattern))
-
-    # Iterate over the list of files
-    for file in files:
-        # Open the image file
-        img = Image.open(file)
-
-        # Create a new file path with the output file extension
-        new_path = Path(file).with_suffix(f".{out_ext}")
-
-        # Check if the output file already exists
-        if new_path.exists():
-            # Skip the conversion if the output file already exists
-            print(f"Skipping {file} because {new_path} already exists")
-            continue
-
-        # Save the image to the new file as high-quality JPEG
-        img.save(new_path, quality=quality, optimize=True)
+    # Get the list of files in the directory that match the input file extension
+    files = find_images(directory, in_ext, recursive=recursive)
 
-        # Optionally, delete the original file
-        if delete_originals:
-            os.remove(file)
+    # Save the images in parallel as high-quality JPEG, dropping the alpha channel JPEG cannot store
+    return transcode_images(
+        ((file, output_path(file, out_ext)) for file in files),
+        save_kwargs={"format": "JPEG", "quality": quality, "optimize": True},
+        mode="RGB",
+        delete_originals=delete_originals,
+        workers=workers,
+        max_in_flight=max_in_flight,
+        verbose=verbose,
+    )
 
 
 if __name__ == "__main__":
@@ -56,10 +43,18 @@ if __name__ == "__main__":
                         help="the input file extension")
     parser.add_argument("--quality", type=int, default=95,
                         help="the JPEG quality (0-100)")
-    parser.add_argument("--delete_originals", action="store_true",
-                        help="whether to delete the original files after conversion")
+    add_transcode_arguments(parser)
     
     # Parse the command-line arguments
     args = parser.parse_args()
     
-    main(directory=args.directory, in_ext=args.in_ext, quality=args.quality, delete_originals=args.delete_originals)
+    main(
+        directory=args.directory,
+        in_ext=args.in_ext,
+        quality=args.quality,
+        delete_originals=args.delete_originals,
+        recursive=args.recursive,
+        workers=args.workers,
+        max_in_flight=args.max_in_flight,
+        verbose=not args.quiet,
+    )
@@ -3,6 +3,8 @@ from pathlib import Path
 import os
 from PIL import Image
 
+from image_transcode import add_transcode_arguments, find_images, output_path, transcode_images
+
 def writable_dir(target_path):
     """ Check if a path is a valid directory and that it can be written to. """
     path = Path(target_path)
@@ -23,48 +25,26 @@ def main():
                         help="the input file extension")
     parser.add_argument("--out_ext", type=str, default="webp",
                         help="the output file extension")
-    parser.add_argument("--delete_originals", action="store_true",
-                        help="whether to delete the original files after conversion")
+    add_transcode_arguments(parser)
 
     # Parse the command-line arguments
     args = parser.parse_args()
-    directory = Path(args.directory)
-    in_ext = args.in_ext
-    delete_originals = args.delete_originals
-
-    # Create the file pattern string using the input file extension
-    file_pattern = f"*.{in_ext}"
-
-    # Get the list of files in the directory that match the file pattern
-    files = list(directory.glob(file_pattern))
-
-    # Iterate over the list of files
-    for file in files:
-        try:
-            # Open the image file
-            img = Image.open(file)
-
-            # Create a new file path with the output file extension
-            new_path = file.with_suffix(f".{args.out_ext}")
-            print(new_path)
-
-            # Check if the output file already exists
-            if new_path.exists():
-                # Skip the conversion if the output file already exists
-                print(f"Skipping {file} because {new_path} already exists")
-                continue
-
-            # Save the image to the new file as lossless
-            img.save(new_path, lossless=True)
-
-            # Close the image file
-            img.close()
 
-            # Optionally, delete the original file
-            if delete_originals:
-                file.unlink()
-        except Exception as e:
-            print(f"Error processing {file}: {e}")
+    # Resolve the output format from the output file extension
+    out_format = Image.registered_extensions().get(f".{args.out_ext.lower()}")
+    if out_format is None:
+        parser.error(f"Unknown output file extension '{args.out_ext}'")
+
+    # Convert the matching files in parallel, saving them as lossless images
+    files = find_images(args.directory, args.in_ext, recursive=args.recursive)
+    transcode_images(
+        ((file, output_path(file, args.out_ext)) for file in files),
+        save_kwargs={"format": out_format, "lossless": True},
+        delete_originals=args.delete_originals,
+        workers=args.workers,
+        max_in_flight=args.max_in_flight,
+        verbose=not args.quiet,
+    )
 
 
 if __name__ == "__main__":
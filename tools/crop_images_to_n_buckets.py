@@ -8,10 +8,19 @@ import os
 import cv2
 import argparse
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from aspect_buckets import center_crop_boxes, cropped_area, equal_count_bounds, group_means, optimal_bounds
+from image_size import get_image_size, get_image_sizes
 
 def aspect_ratio(img_path):
     """
     Calculate and return the aspect ratio of an image.
+
+    Only the image header is read; EXIF rotation is taken into account the same way cv2.imread applies it.
     
     Parameters:
     img_path: A string representing the path to the input image.
@@ -20,27 +29,41 @@ def aspect_ratio(img_path):
     float: Aspect ratio of the input image, defined as width / height.
            Returns None if the image cannot be read.
     """
-    try:
-        image = cv2.imread(img_path)
-        if image is None:
-            raise ValueError("Image not found or could not be read.")
-        height, width = image.shape[:2]
-        return float(width) / float(height)
-    except Exception as e:
-        print(f"Error: {e}")
+    size = get_image_size(img_path, exif_transpose=True)
+    if size is None:
+        print(f"Error: Image not found or could not be read: {img_path}")
         return None
+    width, height = size
+    return float(width) / float(height)
 
-def sort_images_by_aspect_ratio(path):
-    """Sort all images in a folder by aspect ratio"""
-    images = []
+def load_sorted_images(path):
+    """
+    Read the sizes of all images in a folder from their headers and sort them by aspect ratio.
+
+    Returns:
+    tuple: (list of image paths, np.ndarray of widths, np.ndarray of heights), sorted by width / height.
+    """
+    img_paths = []
     for filename in os.listdir(path):
         if filename.endswith(".jpg") or filename.endswith(".jpeg") or filename.endswith(".png") or filename.endswith(".webp"):
-            print(filename)
-            img_path = os.path.join(path, filename)
-            images.append((img_path, aspect_ratio(img_path)))
-    # sort the list of tuples based on the aspect ratio
-    sorted_images = sorted(images, key=lambda x: x[1])
-    return sorted_images
+            img_paths.append(os.path.join(path, filename))
+    # read all image headers in parallel
+    sizes = get_image_sizes(img_paths, exif_transpose=True)
+    for img_path in img_paths:
+        if sizes[img_path] is None:
+            print(f"Error: Image not found or could not be read: {img_path}")
+    img_paths = [img_path for img_path in img_paths if sizes[img_path] is not None]
+    widths = np.array([sizes[img_path][0] for img_path in img_paths], dtype=np.int64)
+    heights = np.array([sizes[img_path][1] for img_path in img_paths], dtype=np.int64)
+    # stable sort by aspect ratio
+    order = np.argsort(widths / np.maximum(heights, 1), kind="stable")
+    return [img_paths[i] for i in order], widths[order], heights[order]
+
+def sort_images_by_aspect_ratio(path):
+    """Sort all images in a folder by aspect ratio"""
+    img_paths, widths, heights = load_sorted_images(path)
+    # list of (path, aspect ratio) tuples
+    return list(zip(img_paths, (widths / heights).tolist()))
 
 def create_groups(sorted_images, n_groups):
     """
@@ -63,11 +86,8 @@ def create_groups(sorted_images, n_groups):
         raise ValueError("Error: n_groups must be a positive integer.")
     if n_groups > len(sorted_images):
         raise ValueError("Error: n_groups must be less than or equal to the number of images.")
-    n = len(sorted_images)
-    size = n // n_groups
-    groups = [sorted_images[i * size : (i + 1) * size] for i in range(n_groups - 1)]
-    groups.append(sorted_images[(n_groups - 1) * size:])
-    return groups
+    bounds = equal_count_bounds(len(sorted_images), n_groups)
+    return [sorted_images[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
 
 def average_aspect_ratio(group):
     """
@@ -174,8 +194,80 @@ def copy_related_files(img_path, save_path):
     except OSError as e:
         print(f"Error: {e}")  # Handle errors from os.listdir()
 
-def save_resized_cropped_images(group, folder_name, group_number, avg_aspect_ratio, use_original_name=False):
-    """Crop and resize all images in the input group to the smallest resolution, and save them to a folder.
+def save_cropped_image(img_path, save_path, size, box, target_aspect_ratio):
+    """Crop one image with its precomputed crop box and save it, together with its related files.
+
+    Args:
+        img_path: Path to the input image.
+        save_path: Path of the cropped image.
+        size: (width, height) of the image as read from its header.
+        box: (left, top, right, bottom) crop box computed for that size.
+        target_aspect_ratio: Aspect ratio of the image group, used if the decoded image has another size.
+    """
+    image = cv2.imread(img_path)
+    if image is not None and image.shape[1::-1] == tuple(size):
+        left, top, right, bottom = box
+        cropped_image = image[top:bottom, left:right]
+    else:
+        cropped_image = center_crop_image(image, target_aspect_ratio)
+    cv2.imwrite(save_path, cropped_image)
+
+    # Copy matching files named the same as img_path to
+    copy_related_files(img_path, save_path)
+
+def save_groups(img_paths, widths, heights, bounds, folder_name, use_original_name=False, workers=None):
+    """Crop all images to the average aspect ratio of their group and save them to a folder.
+
+    Group means and crop boxes are computed for all images at once, decoding, cropping and saving runs in a
+    thread pool.
+
+    Args:
+        img_paths: Image paths sorted by aspect ratio.
+        widths: np.ndarray of the image widths.
+        heights: np.ndarray of the image heights.
+        bounds: Group boundaries, group i holds the images bounds[i]:bounds[i+1].
+        folder_name: A string representing the name of the folder to save the images to.
+        use_original_name: A boolean indicating whether to save the images with their original file names.
+        workers: Number of images decoded, cropped and saved at the same time.
+
+    Returns:
+        int: Number of images that could not be saved.
+    """
+    if not os.path.exists(folder_name):
+        os.makedirs(folder_name)
+
+    avg_aspect_ratios = group_means(widths / heights, bounds)
+    group_sizes = np.diff(bounds)
+    targets = np.repeat(avg_aspect_ratios, group_sizes)
+    boxes = center_crop_boxes(widths, heights, targets).tolist()
+    group_numbers = np.repeat(np.arange(1, len(group_sizes) + 1), group_sizes).tolist()
+    indices_in_group = (np.arange(len(img_paths)) - np.repeat(bounds[:-1], group_sizes)).tolist()
+
+    for i, avg_aspect_ratio in enumerate(avg_aspect_ratios):
+        print(f"Group {i+1}: {group_sizes[i]} images, average aspect ratio {avg_aspect_ratio}")
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for i, img_path in enumerate(img_paths):
+            if use_original_name:
+                save_name = os.path.basename(img_path)
+            else:
+                save_name = f"group_{group_numbers[i]}_{indices_in_group[i]}.jpg"
+            save_path = os.path.join(folder_name, save_name)
+            size = (int(widths[i]), int(heights[i]))
+            futures[pool.submit(save_cropped_image, img_path, save_path, size, boxes[i], targets[i])] = (img_path, save_name)
+        for future, (img_path, save_name) in futures.items():
+            try:
+                future.result()
+                print(f"Saved {save_name} to {folder_name}")
+            except Exception as e:
+                failed += 1
+                print(f"Error: Failed to save {img_path}: {e}")
+    return failed
+
+def save_resized_cropped_images(group, folder_name, group_number, avg_aspect_ratio, use_original_name=False, workers=None):
+    """Crop all images in the input group to the average aspect ratio, and save them to a folder.
 
     Args:
         group: A list of tuples, where each tuple contains the path to an image and its aspect ratio.
@@ -183,38 +275,25 @@ def save_resized_cropped_images(group, folder_name, group_number, avg_aspect_rat
         group_number: An integer representing the group number.
         avg_aspect_ratio: A float representing the average aspect ratio of the images in the group.
         use_original_name: A boolean indicating whether to save the images with their original file names.
+        workers: Number of images decoded, cropped and saved at the same time.
 
     """
     if not os.path.exists(folder_name):
         os.makedirs(folder_name)
 
-    # get the smallest size of the images
-    smallest_res = float("inf")
-    for img_path, _ in group:
-        image = cv2.imread(img_path)
-        cropped_image = center_crop_image(image, avg_aspect_ratio)
-        height, width = cropped_image.shape[:2]
-        image_res = height * width
-        if image_res < smallest_res:
-            smallest_res = image_res
-            small_height, small_width = height, width
-
-    # resize all images to the smallest resolution of the images in the group
-    for i, (img_path, aspect_ratio) in enumerate(group):
-        image = cv2.imread(img_path)
-        cropped_image = center_crop_image(image, avg_aspect_ratio)
-        # resized_image = cv2.resize(cropped_image, (small_width, small_height))
-        if use_original_name:
-            save_name = os.path.basename(img_path)
-        else:
-            save_name = f"group_{group_number}_{i}.jpg"
-        save_path = os.path.join(folder_name, save_name)
-        cv2.imwrite(save_path, cropped_image)
-        
-        # Copy matching files named the same as img_path to
-        copy_related_files(img_path, save_path)
-        
-        print(f"Saved {save_name} to {folder_name}")
+    img_paths = [img_path for img_path, _ in group]
+    sizes = get_image_sizes(img_paths, exif_transpose=True)
+    boxes = center_crop_boxes([sizes[p][0] for p in img_paths], [sizes[p][1] for p in img_paths], avg_aspect_ratio).tolist()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for i, img_path in enumerate(img_paths):
+            save_name = os.path.basename(img_path) if use_original_name else f"group_{group_number}_{i}.jpg"
+            save_path = os.path.join(folder_name, save_name)
+            futures.append((pool.submit(save_cropped_image, img_path, save_path, sizes[img_path], boxes[i], avg_aspect_ratio), save_name))
+        for future, save_name in futures:
+            future.result()
+            print(f"Saved {save_name} to {folder_name}")
         
 
 def main():
@@ -223,6 +302,10 @@ def main():
     parser.add_argument('output_dir', type=str, help='Path to the directory to save the cropped images')
     parser.add_argument('batch_size', type=int, help='Size of the batches to create')
     parser.add_argument('--use_original_name', action='store_true', help='Whether to use original file names for the saved images')
+    parser.add_argument('--bucketing', choices=['batch', 'optimal'], default='batch',
+                        help='batch: one aspect ratio per train batch; optimal: --buckets aspect ratios chosen to minimize the total cropped area')
+    parser.add_argument('--buckets', type=int, default=None, help='Number of aspect ratio buckets for --bucketing optimal')
+    parser.add_argument('--workers', type=int, default=None, help='Number of images processed in parallel (default: Python thread pool default)')
 
     args = parser.parse_args()
 
@@ -238,8 +321,12 @@ def main():
             print(f"Error: Failed to create output directory: {args.output_dir}")
             return
 
-    sorted_images = sort_images_by_aspect_ratio(args.input_dir)
-    total_images = len(sorted_images)
+    if args.bucketing == 'optimal' and (args.buckets is None or args.buckets <= 0):
+        print("Error: --bucketing optimal requires a positive --buckets")
+        return
+
+    img_paths, widths, heights = load_sorted_images(args.input_dir)
+    total_images = len(img_paths)
     print(f'Total images: {total_images}')
 
     if args.batch_size <= 0:
@@ -253,24 +340,30 @@ def main():
 
     if remainder != 0:
         print(f'Dropping {remainder} images that do not fit in groups...')
-        sorted_images = sorted_images[:-remainder]
-        total_images = len(sorted_images)
+        img_paths, widths, heights = img_paths[:-remainder], widths[:-remainder], heights[:-remainder]
+        total_images = len(img_paths)
         group_size = total_images // args.batch_size
 
+    if total_images == 0:
+        print("Error: Not enough images for one batch")
+        return
+
     print('Creating groups...')
-    groups = create_groups(sorted_images, group_size)
-    print(f"Created {len(groups)} groups")
+    start = time.perf_counter()
+    ratios = widths / heights
+    if args.bucketing == 'optimal':
+        bounds = optimal_bounds(ratios, args.buckets, step=args.batch_size, areas=widths * heights)
+    else:
+        bounds = equal_count_bounds(total_images, group_size)
+    lost = cropped_area(ratios, bounds, areas=widths * heights) / np.sum(widths * heights)
+    print(f"Created {len(bounds) - 1} groups in {time.perf_counter() - start:.2f}s, cropping {lost:.2%} of the total image area")
 
     print('Saving cropped and resize images...')
-    for i, group in enumerate(groups):
-        avg_aspect_ratio = average_aspect_ratio(group)
-        print(f"Processing group {i+1} with {len(group)} images...")
-        try:
-            save_resized_cropped_images(group, args.output_dir, i+1, avg_aspect_ratio, args.use_original_name)
-        except Exception as e:
-            print(f"Error: Failed to save images in group {i+1}: {e}")
+    failed = save_groups(img_paths, widths, heights, bounds, args.output_dir, args.use_original_name, args.workers)
+    if failed:
+        print(f"Error: {failed} images could not be saved")
 
     print('Done')
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -14,7 +14,12 @@ import sys
 import glob
 import traceback
 import re
+import zlib
+import queue
+import multiprocessing
 from enum import Enum, auto
+from safetensors_header import sort_header_metadata
+from svd_cache import add_svd_cache_arguments, svd_cache_from_args
 
 # --- Global variables ---
 extracted_loha_state_dict_global = OrderedDict()
@@ -32,6 +37,9 @@ outer_pbar_global = None
 main_loop_completed_scan_flag_global = False
 params_to_seed_optimizer_global = {}
 skipped_vae_layers_count = 0 # Ensure this is a global if accessed in main and other places
+worker_pool_global = None
+iter_pbar_disabled_global = False
+svd_cache_global = None
 
 # --- Logging Helper ---
 class LogType(Enum):
@@ -39,6 +47,7 @@ class LogType(Enum):
     RANK_INCREASED_INFO = auto()
     INITIAL_PARAMS_LOADED = auto()
     INITIAL_PARAMS_KAIMING_NORMAL = auto()
+    INITIAL_PARAMS_SVD = auto()
     INSUFFICIENT_PROGRESS_STOP = auto()
     PROJECTION_STOP = auto()
     INSUFFICIENT_PROGRESS_LOG_ONLY = auto()
@@ -58,7 +67,7 @@ def log_layer_optimization_event(log_type: LogType, layer_name: str, **kwargs):
         return
     if not args_global.verbose_layer_debug:
         if log_type in [
-            LogType.INITIAL_PARAMS_LOADED, LogType.INITIAL_PARAMS_KAIMING_NORMAL,
+            LogType.INITIAL_PARAMS_LOADED, LogType.INITIAL_PARAMS_KAIMING_NORMAL, LogType.INITIAL_PARAMS_SVD,
             LogType.EMA_PROJECTION_SKIPPED_HISTORY, LogType.EMA_PROJECTION_INCONCLUSIVE_FALLBACK_RAW
         ]:
             return
@@ -78,6 +87,8 @@ def log_layer_optimization_event(log_type: LogType, layer_name: str, **kwargs):
         msg = f"    R:{kwargs['rank']} Initialized from existing LoHA."
     elif log_type == LogType.INITIAL_PARAMS_KAIMING_NORMAL:
         msg = f"    R:{kwargs['rank']} Initialized Kaiming/Normal (Attempt {kwargs.get('attempt', 1)})."
+    elif log_type == LogType.INITIAL_PARAMS_SVD:
+        msg = f"    R:{kwargs['rank']} Initialized from truncated SVD of the delta (Attempt {kwargs.get('attempt', 1)})."
     elif log_type == LogType.INSUFFICIENT_PROGRESS_STOP:
         msg = f"Att {kwargs['attempt']}(R:{kwargs['rank']}): Stop - RawProg Low (Imprv: {kwargs['rel_imprv']:.1e} < {kwargs['min_ratio']:.1e}; Loss: {kwargs['current_loss']:.2e})."
     elif log_type == LogType.PROJECTION_STOP:
@@ -134,13 +145,38 @@ def _get_closest_ema_value_before_iter(target_iter: int, ema_history: list[tuple
             if best_match_iter is not None and target_iter - hist_iter > getattr(args_global, 'projection_sample_interval', 20) * 2: break
     return (best_match_iter, best_match_loss) if best_match_iter is not None else (ema_history[0] if ema_history else (None, None))
 
+def svd_initialize_loha_factors(delta_W_target: torch.Tensor, rank: int, alpha: float, layer_name: str | None = None) -> tuple[torch.Tensor, ...]:
+    # Analytic start instead of Kaiming/Normal: delta / (alpha / rank) is split into sign * sqrt|.| and sqrt|.|,
+    # whose Hadamard product is exact, and each half is replaced by its best rank-`rank` approximation.
+    # The halves are decomposed unscaled so cached spectra stay valid across ranks and alphas.
+    scale = alpha / rank if alpha and rank > 0 else 1.0
+    target = delta_W_target.reshape(delta_W_target.shape[0], -1).float()
+    magnitude = target.abs().sqrt()
+    signed = torch.where(target >= 0, magnitude, -magnitude)
+    factors = []
+    for kind, half in (("loha_init_signed", signed), ("loha_init_magnitude", magnitude)):
+        if svd_cache_global is not None and layer_name is not None:
+            U, S, Vh = svd_cache_global.svd(layer_name, half, key_tensors=(delta_W_target,), kind=kind, min_rank=rank)
+        else:
+            U, S, Vh = torch.linalg.svd(half, full_matrices=False)
+        k = min(rank, S.numel(), U.shape[1])
+        s_sqrt = (S[:k] / math.sqrt(scale)).sqrt()
+        a = torch.zeros(half.shape[0], rank, device=half.device)
+        b = torch.zeros(rank, half.shape[1], device=half.device)
+        a[:, :k] = U[:, :k] * s_sqrt.unsqueeze(0)
+        b[:k] = s_sqrt.unsqueeze(1) * Vh[:k]
+        factors.extend([a, b])
+    return tuple(factors)
+
 def initialize_loha_parameters(
     out_dim: int, current_rank: int, in_dim_effective_k_ops: int,
     device: str, dtype: torch.dtype, layer_name: str, attempt_idx: int,
     is_continuation_attempt: bool,
     existing_params_to_load: dict | None = None,
     warm_start_status: str | None = None,
-    prev_rank_for_warm_start: int | None = None
+    prev_rank_for_warm_start: int | None = None,
+    delta_W_target_for_init: torch.Tensor | None = None,
+    alpha_for_init: float | None = None
 ):
     hada_w1_a_p = nn.Parameter(torch.empty(out_dim, current_rank, device=device, dtype=dtype))
     hada_w1_b_p = nn.Parameter(torch.empty(current_rank, in_dim_effective_k_ops, device=device, dtype=dtype))
@@ -172,6 +208,12 @@ def initialize_loha_parameters(
                 for p_slice in [hada_w1_b_p.data[prev_rank_for_warm_start:, :], hada_w2_b_p.data[prev_rank_for_warm_start:, :]]:
                     nn.init.normal_(p_slice, std=0.02)
             initialized_from_external_or_warm_start = True
+        if not initialized_from_external_or_warm_start and delta_W_target_for_init is not None and getattr(args_global, 'init_method', 'kaiming') == 'svd':
+            log_layer_optimization_event(LogType.INITIAL_PARAMS_SVD, layer_name, rank=current_rank, attempt=attempt_idx + 1)
+            svd_factors = svd_initialize_loha_factors(delta_W_target_for_init, current_rank, alpha_for_init, layer_name)
+            for target_param, factor in zip([hada_w1_a_p, hada_w1_b_p, hada_w2_a_p, hada_w2_b_p], svd_factors):
+                target_param.data.copy_(factor.to(device, dtype))
+            initialized_from_external_or_warm_start = True
         if not initialized_from_external_or_warm_start:
             log_layer_optimization_event(LogType.INITIAL_PARAMS_KAIMING_NORMAL, layer_name, rank=current_rank, attempt=attempt_idx + 1)
             for p in [hada_w1_a_p, hada_w2_a_p]: nn.init.kaiming_uniform_(p.data, a=math.sqrt(5))
@@ -381,7 +423,7 @@ def perform_graceful_save(output_path_to_save: str):
         skipped_other_this_run=skipped_other_reason_count_global,
         skipped_good_initial_this_run=skipped_good_initial_loss_count_global,
         scanned_keys_this_run=keys_scanned_this_run_global,
-        all_completed_module_prefixes_list=list(all_completed_module_prefixes_ever_global),
+        all_completed_module_prefixes_list=sorted(all_completed_module_prefixes_ever_global),
         layer_opt_stats_this_run=layer_optimization_stats_global,
         is_interrupted_save=save_attempted_on_interrupt
     )
@@ -392,6 +434,7 @@ def perform_graceful_save(output_path_to_save: str):
             final_json_path = os.path.splitext(output_path_to_save)[0] + "_extraction_metadata.json"
             temp_json_path = final_json_path + ".part"
             save_file(final_sd, temp_sf_path, metadata=sf_meta)
+            sort_header_metadata(temp_sf_path)
             with open(temp_json_path, 'w') as f: json.dump(json_meta, f, indent=4)
             os.replace(temp_sf_path, output_path_to_save)
             os.replace(temp_json_path, final_json_path)
@@ -674,14 +717,15 @@ def optimize_loha_for_layer(
             out_dim, current_rank_for_this_attempt, (in_dim_effective * k_ops), device, dtype, layer_name, attempt_idx,
             (attempt_idx == 0 and is_initial_call_with_existing_params),
             params_for_initialization, current_warm_start_status,
-            prev_rank_for_warm_start_log if current_warm_start_status == 'applied' else None
+            prev_rank_for_warm_start_log if current_warm_start_status == 'applied' else None,
+            delta_W_target, alpha_init_for_this_attempt
         )
         alpha_param = nn.Parameter(torch.tensor(alpha_init_for_this_attempt, device=device, dtype=dtype))
         params_to_optimize = [hada_w1_a_p, hada_w1_b_p, hada_w2_a_p, hada_w2_b_p, alpha_param]
         optimizer = torch.optim.AdamW(params_to_optimize, lr=lr, weight_decay=weight_decay)
         scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, 'min', patience=max(10, int(max_iterations * 0.05)), factor=0.5, min_lr=max(1e-7, lr * 0.001))
         iter_pbar_desc = f"Opt Att {attempt_idx+1}/{max_rank_retries+1} (R:{current_rank_for_this_attempt}){' [LastRank]' if is_last_rank_attempt else ''}: {layer_name}"
-        iter_pbar = tqdm(range(max_iterations), desc=iter_pbar_desc, leave=False, dynamic_ncols=True, position=1, mininterval=0.5)
+        iter_pbar = tqdm(range(max_iterations), desc=iter_pbar_desc, leave=False, dynamic_ncols=True, position=1, mininterval=0.5, disable=iter_pbar_disabled_global)
         
         current_attempt_final_loss = float('inf'); current_attempt_stopped_early_by_loss = False
         current_attempt_insufficient_progress = False; current_attempt_stopped_by_projection = False
@@ -825,12 +869,385 @@ def optimize_loha_for_layer(
     return best_result_so_far
 
 
+def optimize_loha_batch(
+    layer_names: list[str], delta_W_targets: torch.Tensor, rank: int, initial_alpha: float,
+    lr: float = 1e-3, max_iterations: int = 1000, min_iterations: int = 100,
+    target_loss: float = None, weight_decay: float = 1e-4,
+    device: str = 'cuda', dtype: torch.dtype = torch.float32,
+    is_last_rank_attempt: bool = True
+) -> list[dict]:
+    # Fits one LoHA attempt for a stack of same-shaped layers (delta_W_targets: [B, out, in_eff]) in a
+    # single batched forward/backward. AdamW and ReduceLROnPlateau are applied per layer in vectorized
+    # form, so every layer follows the same update rule it would get from optimize_loha_for_layer.
+    # Layers that hit target_loss, or fail the raw progress check, are dropped out of the batch.
+    targets = delta_W_targets.to(device, dtype=dtype)
+    batch_size, out_dim, in_dim = targets.shape
+    ids = torch.arange(batch_size, device=device)
+
+    params = {
+        'hada_w1_a': torch.empty(batch_size, out_dim, rank, device=device, dtype=dtype),
+        'hada_w1_b': torch.empty(batch_size, rank, in_dim, device=device, dtype=dtype),
+        'hada_w2_a': torch.empty(batch_size, out_dim, rank, device=device, dtype=dtype),
+        'hada_w2_b': torch.empty(batch_size, rank, in_dim, device=device, dtype=dtype),
+        'alpha': torch.full((batch_size,), float(initial_alpha), device=device, dtype=dtype),
+    }
+    with torch.no_grad():
+        for b in range(batch_size):
+            if getattr(args_global, 'init_method', 'kaiming') == 'svd':
+                svd_factors = svd_initialize_loha_factors(targets[b], rank, initial_alpha, layer_names[b])
+                for p_name, factor in zip(['hada_w1_a', 'hada_w1_b', 'hada_w2_a', 'hada_w2_b'], svd_factors):
+                    params[p_name][b].copy_(factor.to(device, dtype))
+                continue
+            for p_name in ['hada_w1_a', 'hada_w2_a']: nn.init.kaiming_uniform_(params[p_name][b], a=math.sqrt(5))
+            for p_name in ['hada_w1_b', 'hada_w2_b']: nn.init.normal_(params[p_name][b], std=0.02)
+    for p in params.values(): p.requires_grad_(True)
+    exp_avg = {k: torch.zeros_like(v) for k, v in params.items()}
+    exp_avg_sq = {k: torch.zeros_like(v) for k, v in params.items()}
+    beta1, beta2, adam_eps = 0.9, 0.999, 1e-8
+
+    # per-layer ReduceLROnPlateau('min', patience, factor=0.5, min_lr) state
+    layer_lr = torch.full((batch_size,), lr, device=device, dtype=torch.float64)
+    plateau_best = torch.full((batch_size,), float('inf'), device=device, dtype=torch.float64)
+    plateau_bad = torch.zeros(batch_size, device=device, dtype=torch.long)
+    patience, min_lr = max(10, int(max_iterations * 0.05)), max(1e-7, lr * 0.001)
+
+    prog_check_interval_val = args_global.progress_check_interval
+    min_prog_ratio_val = args_global.min_progress_loss_ratio
+    iter_to_begin_first_progress_window = args_global.progress_check_start_iter
+    progress_window_started = False
+    loss_at_window_start = torch.full((batch_size,), float('inf'), device=device, dtype=torch.float64)
+    last_loss = torch.full((batch_size,), float('inf'), device=device, dtype=torch.float64)
+
+    results = [None] * batch_size
+    rel_imprv = torch.zeros(batch_size, device=device, dtype=torch.float64)
+
+    def finish(rows: torch.Tensor, iterations_done: int, by_target: bool, by_progress: bool):
+        for row in rows.tolist():
+            layer_name = layer_names[int(ids[row])]
+            if by_target:
+                log_layer_optimization_event(LogType.TARGET_LOSS_REACHED_IN_ATTEMPT, layer_name, attempt=1, rank=rank, target_loss=target_loss, iter=iterations_done)
+            elif by_progress:
+                log_layer_optimization_event(LogType.INSUFFICIENT_PROGRESS_STOP, layer_name, attempt=1, rank=rank, rel_imprv=float(rel_imprv[row]), min_ratio=min_prog_ratio_val, current_loss=float(last_loss[row]))
+            results[int(ids[row])] = {
+                'hada_w1_a': params['hada_w1_a'][row].detach().cpu().contiguous(),
+                'hada_w1_b': params['hada_w1_b'][row].detach().cpu().contiguous(),
+                'hada_w2_a': params['hada_w2_a'][row].detach().cpu().contiguous(),
+                'hada_w2_b': params['hada_w2_b'][row].detach().cpu().contiguous(),
+                'alpha': params['alpha'][row].detach().cpu().contiguous(),
+                'final_loss': float(last_loss[row]), 'stopped_early_by_loss': by_target,
+                'stopped_by_insufficient_progress': by_progress, 'stopped_by_projection': False,
+                'projection_type_used': 'none', 'iterations_done': iterations_done, 'final_rank_used': rank,
+                'interrupted_mid_layer': False, 'final_projected_loss_on_stop': None
+            }
+
+    iter_pbar = tqdm(range(max_iterations), desc=f"Batch Opt (R:{rank}, {batch_size}x{out_dim}x{in_dim})", leave=False, dynamic_ncols=True, position=1, mininterval=0.5, disable=iter_pbar_disabled_global)
+    for i in iter_pbar:
+        iterations_done = i + 1
+        if save_attempted_on_interrupt:
+            iter_pbar.close()
+            return [{'final_loss': float('inf'), 'interrupted_mid_layer': True, 'final_rank_used': rank, 'iterations_done': i} if r is None else r for r in results]
+
+        if prog_check_interval_val > 0 and not progress_window_started and iterations_done >= iter_to_begin_first_progress_window:
+            loss_at_window_start = last_loss.clone()
+            progress_window_started = True
+
+        eff_alpha_scale = (params['alpha'] / rank).view(-1, 1, 1)
+        delta_W_loha = eff_alpha_scale * torch.bmm(params['hada_w1_a'], params['hada_w1_b']) * torch.bmm(params['hada_w2_a'], params['hada_w2_b'])
+        loss_per_layer = (delta_W_loha - targets).pow(2).mean(dim=(1, 2))
+        # layers share no parameters, so the gradient of the sum is each layer's own MSE gradient
+        for p in params.values(): p.grad = None
+        loss_per_layer.sum().backward()
+        last_loss = loss_per_layer.detach().to(torch.float64)
+        if i == 0 and progress_window_started:
+            loss_at_window_start = torch.where(torch.isinf(loss_at_window_start), last_loss, loss_at_window_start)
+
+        with torch.no_grad():
+            step = i + 1
+            bias_correction1, bias_correction2 = 1 - beta1 ** step, 1 - beta2 ** step
+            for p_name, p in params.items():
+                lr_b = layer_lr.to(dtype).view(-1, *([1] * (p.dim() - 1)))
+                p.mul_(1 - lr_b * weight_decay)
+                exp_avg[p_name].mul_(beta1).add_(p.grad, alpha=1 - beta1)
+                exp_avg_sq[p_name].mul_(beta2).addcmul_(p.grad, p.grad, value=1 - beta2)
+                denom = (exp_avg_sq[p_name].sqrt() / math.sqrt(bias_correction2)).add_(adam_eps)
+                p.sub_((lr_b / bias_correction1) * exp_avg[p_name] / denom)
+            improved = last_loss < plateau_best * (1 - 1e-4)
+            plateau_best = torch.where(improved, last_loss, plateau_best)
+            plateau_bad = torch.where(improved, torch.zeros_like(plateau_bad), plateau_bad + 1)
+            reduce = plateau_bad > patience
+            layer_lr = torch.where(reduce, torch.clamp(layer_lr * 0.5, min=min_lr), layer_lr)
+            plateau_bad = torch.where(reduce, torch.zeros_like(plateau_bad), plateau_bad)
+
+        iter_pbar.set_postfix_str(f"Active={len(ids)}, MaxLoss={float(last_loss.max()):.3e}", refresh=False)
+
+        done_target = torch.zeros(len(ids), dtype=torch.bool, device=device)
+        if target_loss is not None and iterations_done >= min_iterations:
+            done_target = last_loss <= target_loss
+        done_progress = torch.zeros_like(done_target)
+        if prog_check_interval_val > 0 and progress_window_started and \
+           (iterations_done >= iter_to_begin_first_progress_window + prog_check_interval_val) and \
+           (((iterations_done - iter_to_begin_first_progress_window) % prog_check_interval_val) == 0):
+            has_start = (loss_at_window_start > 1e-12) & (loss_at_window_start > last_loss)
+            rel_imprv = torch.where(has_start, (loss_at_window_start - last_loss) / loss_at_window_start, torch.zeros_like(last_loss))
+            above_target = torch.ones_like(done_target) if target_loss is None else last_loss > target_loss * 1.01
+            # like check_insufficient_progress, the last rank attempt only logs and keeps going
+            if not is_last_rank_attempt:
+                done_progress = above_target & (rel_imprv < min_prog_ratio_val) & ~done_target
+            loss_at_window_start = last_loss.clone()
+
+        finished = done_target | done_progress
+        if bool(finished.any()):
+            finish(torch.nonzero(done_target).flatten(), iterations_done, True, False)
+            finish(torch.nonzero(done_progress).flatten(), iterations_done, False, True)
+            keep = ~finished
+            if not bool(keep.any()):
+                break
+            # drop finished layers so the remaining iterations only pay for the active ones
+            with torch.no_grad():
+                for p_name in params:
+                    params[p_name] = params[p_name][keep].detach().requires_grad_(True)
+                    exp_avg[p_name] = exp_avg[p_name][keep]
+                    exp_avg_sq[p_name] = exp_avg_sq[p_name][keep]
+            targets, ids, rel_imprv = targets[keep], ids[keep], rel_imprv[keep]
+            layer_lr, plateau_best, plateau_bad = layer_lr[keep], plateau_best[keep], plateau_bad[keep]
+            loss_at_window_start, last_loss = loss_at_window_start[keep], last_loss[keep]
+    iter_pbar.close()
+
+    if any(r is None for r in results):
+        finish(torch.arange(len(ids), device=device), max_iterations, False, False)
+    return results
+
+def apply_layer_optimization_result(
+    loha_key_prefix: str, original_module_path: str, initial_rank_opt: int, opt_results: dict,
+    base_model_sd: OrderedDict, ft_model_sd: OrderedDict, final_save_dtype_torch: torch.dtype
+) -> bool:
+    global processed_layers_this_session_count_global, skipped_other_reason_count_global
+    if not opt_results.get('interrupted_mid_layer') and 'hada_w1_a' in opt_results :
+        for p_name, p_val in opt_results.items():
+            if p_name not in ['final_loss', 'stopped_early_by_loss', 'stopped_by_insufficient_progress', 'stopped_by_projection', 'projection_type_used', 'iterations_done', 'final_rank_used', 'interrupted_mid_layer', 'final_projected_loss_on_stop']:
+                if torch.is_tensor(p_val): extracted_loha_state_dict_global[f'{loha_key_prefix}.{p_name}'] = p_val.to(final_save_dtype_torch)
+        final_rank_used = opt_results['final_rank_used']
+        stat_entry = {"name": str(loha_key_prefix),"original_name": str(original_module_path),"initial_rank_attempted": int(initial_rank_opt),"final_rank_used": int(final_rank_used),"rank_was_increased": bool(final_rank_used > initial_rank_opt),"final_loss": float(opt_results['final_loss']),"alpha_final": float(opt_results['alpha'].item()) if isinstance(opt_results.get('alpha'), torch.Tensor) else float(opt_results.get('alpha', 0.0)),"iterations_done": int(opt_results['iterations_done']),"stopped_early_by_loss_target": bool(opt_results['stopped_early_by_loss']),"stopped_by_insufficient_progress": bool(opt_results.get('stopped_by_insufficient_progress', False)),"stopped_by_projection": bool(opt_results.get('stopped_by_projection', False)),"projection_type_used": str(opt_results.get('projection_type_used', 'none')),"final_projected_loss_on_stop": float(l_val) if (l_val := opt_results.get('final_projected_loss_on_stop')) is not None else None,"skipped_reopt_due_to_initial_good_loss": False,"interrupted_mid_layer": bool(opt_results.get('interrupted_mid_layer', False))}
+        layer_optimization_stats_global.append(stat_entry)
+        all_completed_module_prefixes_ever_global.add(loha_key_prefix)
+        stop_reason_short = ""
+        if opt_results['stopped_early_by_loss']: stop_reason_short = ", Stop:LossTarget"
+        elif opt_results.get('stopped_by_projection', False): stop_reason_short = f", Stop:Proj({opt_results.get('projection_type_used','?')})"
+        elif opt_results['stopped_by_insufficient_progress']: stop_reason_short = ", Stop:RawProg"
+        tqdm.write(f"  Layer {loha_key_prefix} Opt. Done. R_used: {final_rank_used}, FinalLoss: {opt_results['final_loss']:.4e}, Iters: {opt_results['iterations_done']}{stop_reason_short}")
+        if args_global.use_bias:
+            bias_key = f"{original_module_path}.bias"
+            if bias_key in ft_model_sd and (bias_key not in base_model_sd or not torch.allclose(base_model_sd[bias_key], ft_model_sd[bias_key], atol=args_global.atol_fp32_check)):
+                extracted_loha_state_dict_global[bias_key] = ft_model_sd[bias_key].cpu().to(final_save_dtype_torch)
+                if args_global.verbose: tqdm.write(f"    Saved differing/new bias for {bias_key}")
+        processed_layers_this_session_count_global += 1
+        return True
+    else:
+        tqdm.write(f"  Optimization for {loha_key_prefix} did not yield saveable results (Interrupt: {opt_results.get('interrupted_mid_layer', 'N/A')}, Loss: {opt_results.get('final_loss', 'N/A')})")
+        if not opt_results.get('interrupted_mid_layer', False) and 'hada_w1_a' not in opt_results :
+            skipped_other_reason_count_global += 1
+            all_completed_module_prefixes_ever_global.add(loha_key_prefix)
+    return False
+
+def maybe_periodic_save(more_work_remaining: bool):
+    if args_global.save_every_n_layers > 0 and processed_layers_this_session_count_global > 0 and processed_layers_this_session_count_global % args_global.save_every_n_layers == 0 and more_work_remaining: 
+        periodic_save_path = generate_intermediate_filename(args_global.save_to, len(all_completed_module_prefixes_ever_global))
+        tqdm.write(f"\n--- Periodic Save: Processed {processed_layers_this_session_count_global} layers this session. Saving to {periodic_save_path} ---")
+        if perform_graceful_save(periodic_save_path) and args_global.keep_n_resume_files > 0:
+            cleanup_intermediate_files(args_global.save_to, True, args_global.keep_n_resume_files)
+
+def _init_layer_worker(cli_args: argparse.Namespace, num_threads: int):
+    # Runs once in every worker process: workers leave Ctrl+C and progress bars to the main process.
+    global args_global, iter_pbar_disabled_global, svd_cache_global
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    args_global = cli_args
+    svd_cache_global = svd_cache_from_args(cli_args)
+    iter_pbar_disabled_global = True
+    torch.set_num_threads(num_threads)
+
+def _optimize_layer_worker(order: int, job: dict) -> tuple[int, dict | None, str | None]:
+    try:
+        # seed per layer so results do not depend on which worker picks the layer up, or when
+        torch.manual_seed(zlib.crc32(job['loha_key_prefix'].encode("utf-8")))
+        out_dim, in_dim_effective, k_h, k_w, is_conv = job['shape_info']
+        opt_results = optimize_loha_for_layer(
+            job['loha_key_prefix'], job['delta_W'], out_dim, in_dim_effective, k_h, k_w,
+            job['initial_rank'], job['initial_alpha'], args_global.lr, args_global.max_iterations,
+            args_global.min_iterations, args_global.target_loss, args_global.weight_decay, args_global.device,
+            job['opt_dtype'], is_conv, args_global.verbose_layer_debug, job['max_rank_retries'],
+            args_global.rank_increase_factor, job['existing_params']
+        )
+        return order, opt_results, None
+    except Exception as e:
+        return order, None, f"{type(e).__name__}: {e}"
+
+def run_parallel_layer_jobs(
+    layer_jobs: list[dict], candidate_order: dict, base_model_sd: OrderedDict, ft_model_sd: OrderedDict,
+    final_save_dtype_torch: torch.dtype
+):
+    global worker_pool_global, outer_pbar_global, skipped_other_reason_count_global
+    num_workers = args_global.workers
+    num_threads = args_global.threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+    target_opt_dtype = {"fp16": torch.float16, "bf16": torch.bfloat16, "fp32": torch.float32}.get(args_global.precision, torch.float32)
+    # largest layers first so the long ones do not end up alone at the tail of the run
+    layer_jobs = sorted(layer_jobs, key=lambda j: (-j['numel'], j['order']))
+    jobs_by_order = {job['order']: job for job in layer_jobs}
+    print(f"\nOptimizing {len(layer_jobs)} layers with {num_workers} worker processes x {num_threads} torch threads.")
+
+    if outer_pbar_global: outer_pbar_global.close()
+    outer_pbar_global = tqdm(total=len(layer_jobs), desc="Optimizing Layers", dynamic_ncols=True, position=0)
+    results_queue = queue.Queue()
+    worker_pool_global = multiprocessing.get_context("spawn").Pool(
+        num_workers, initializer=_init_layer_worker, initargs=(args_global, num_threads)
+    )
+    # deltas are built at submit time and only a few are in flight, so memory stays bounded
+    max_in_flight = num_workers * 2
+    next_job_idx, in_flight = 0, 0
+    # results are applied in candidate order like a serial run, so the saved file does not depend on which worker
+    # finishes first; a layer that finishes early waits in `finished` until all earlier ones are in
+    apply_order = sorted(jobs_by_order)
+    next_apply = 0
+    finished = {}
+    try:
+        while next_job_idx < len(layer_jobs) or in_flight > 0:
+            while in_flight < max_in_flight and next_job_idx < len(layer_jobs):
+                job = layer_jobs[next_job_idx]; next_job_idx += 1
+                payload = {k: job[k] for k in ['loha_key_prefix', 'shape_info', 'initial_rank', 'initial_alpha', 'max_rank_retries', 'existing_params']}
+                payload['delta_W'] = ft_model_sd[job['key_name']].to(dtype=torch.float32) - base_model_sd[job['key_name']].to(dtype=torch.float32)
+                payload['opt_dtype'] = target_opt_dtype
+                worker_pool_global.apply_async(
+                    _optimize_layer_worker, (job['order'], payload),
+                    callback=results_queue.put,
+                    error_callback=lambda e, order=job['order']: results_queue.put((order, None, f"{type(e).__name__}: {e}"))
+                )
+                in_flight += 1
+            try:
+                order, opt_results, error = results_queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            in_flight -= 1
+            outer_pbar_global.update(1)
+            finished[order] = (opt_results, error)
+            while next_apply < len(apply_order) and apply_order[next_apply] in finished:
+                order = apply_order[next_apply]; next_apply += 1
+                opt_results, error = finished.pop(order)
+                job = jobs_by_order[order]
+                if error is not None:
+                    tqdm.write(f"  Optimization for {job['loha_key_prefix']} failed in worker: {error}")
+                    skipped_other_reason_count_global += 1
+                    all_completed_module_prefixes_ever_global.add(job['loha_key_prefix'])
+                    continue
+                processed = apply_layer_optimization_result(
+                    job['loha_key_prefix'], job['original_module_path'], job['initial_rank'], opt_results,
+                    base_model_sd, ft_model_sd, final_save_dtype_torch
+                )
+                # stats of layers skipped during the scan are already in, keep them all in candidate order
+                layer_optimization_stats_global.sort(key=lambda st: candidate_order.get(st['name'], len(candidate_order)))
+                if processed:
+                    maybe_periodic_save(next_apply < len(apply_order))
+    finally:
+        if worker_pool_global is not None:
+            worker_pool_global.terminate()
+            worker_pool_global.join()
+            worker_pool_global = None
+
+
+def _increase_rank_for_retry(opt_results: dict, initial_rank: int, initial_alpha: float) -> tuple[int, float, dict | None]:
+    # Mirrors the rank-retry step of optimize_loha_for_layer: next rank, alpha at the same alpha/rank
+    # ratio, and the previous factors warm-started into the first columns of the larger rank.
+    prev_rank = opt_results['final_rank_used']
+    new_rank = max(prev_rank + 1, math.ceil(prev_rank * args_global.rank_increase_factor))
+    new_alpha = (initial_alpha / float(initial_rank) if initial_rank > 0 else 1.0) * float(new_rank)
+    if args_global.no_warm_start:
+        return new_rank, new_alpha, None
+    warm = {}
+    for p_name in ['hada_w1_a', 'hada_w2_a']:
+        prev = opt_results[p_name]
+        extra = torch.empty(prev.shape[0], new_rank - prev_rank, dtype=prev.dtype)
+        nn.init.kaiming_uniform_(extra, a=math.sqrt(5))
+        warm[p_name] = torch.cat([prev, extra], dim=1)
+    for p_name in ['hada_w1_b', 'hada_w2_b']:
+        prev = opt_results[p_name]
+        extra = torch.empty(new_rank - prev_rank, prev.shape[1], dtype=prev.dtype)
+        nn.init.normal_(extra, std=0.02)
+        warm[p_name] = torch.cat([prev, extra], dim=0)
+    return new_rank, new_alpha, warm
+
+def run_batched_layer_jobs(
+    layer_jobs: list[dict], candidate_order: dict, base_model_sd: OrderedDict, ft_model_sd: OrderedDict,
+    final_save_dtype_torch: torch.dtype
+):
+    global outer_pbar_global, skipped_other_reason_count_global
+    target_opt_dtype = {"fp16": torch.float16, "bf16": torch.bfloat16, "fp32": torch.float32}.get(args_global.precision, torch.float32)
+    buckets = OrderedDict()
+    single_jobs = []
+    for job in layer_jobs:
+        # re-optimized layers start from their own loaded factors and keep the per-layer path
+        if job['existing_params'] is not None:
+            single_jobs.append([job])
+        else:
+            buckets.setdefault((job['shape_info'], job['initial_rank'], job['initial_alpha']), []).append(job)
+    work_items = []
+    for bucket_jobs in buckets.values():
+        for start in range(0, len(bucket_jobs), args_global.max_batch_size):
+            work_items.append(bucket_jobs[start:start + args_global.max_batch_size])
+    work_items.extend(single_jobs)
+    print(f"\nOptimizing {len(layer_jobs)} layers in {len(work_items)} shape-bucketed batches (max batch size {args_global.max_batch_size}).")
+
+    if outer_pbar_global: outer_pbar_global.close()
+    outer_pbar_global = tqdm(total=len(layer_jobs), desc="Optimizing Layers", dynamic_ncols=True, position=0)
+    for item_idx, jobs in enumerate(work_items):
+        if save_attempted_on_interrupt: break
+        out_dim, in_dim_effective, k_h, k_w, is_conv = jobs[0]['shape_info']
+        deltas = [ft_model_sd[job['key_name']].to(dtype=torch.float32) - base_model_sd[job['key_name']].to(dtype=torch.float32) for job in jobs]
+        if len(jobs) == 1:
+            job = jobs[0]
+            all_results = [optimize_loha_for_layer(
+                job['loha_key_prefix'], deltas[0], out_dim, in_dim_effective, k_h, k_w, job['initial_rank'], job['initial_alpha'],
+                args_global.lr, args_global.max_iterations, args_global.min_iterations, args_global.target_loss, args_global.weight_decay,
+                args_global.device, target_opt_dtype, is_conv, args_global.verbose_layer_debug, job['max_rank_retries'],
+                args_global.rank_increase_factor, job['existing_params']
+            )]
+        else:
+            all_results = optimize_loha_batch(
+                [job['loha_key_prefix'] for job in jobs], torch.stack([d.reshape(out_dim, -1) for d in deltas]),
+                jobs[0]['initial_rank'], jobs[0]['initial_alpha'], args_global.lr, args_global.max_iterations,
+                args_global.min_iterations, args_global.target_loss, args_global.weight_decay, args_global.device,
+                target_opt_dtype, is_last_rank_attempt=(jobs[0]['max_rank_retries'] == 0)
+            )
+            for idx, (job, opt_results) in enumerate(zip(jobs, all_results)):
+                # layers still above target go through the regular rank-retry ladder from the batched result
+                if save_attempted_on_interrupt or opt_results.get('interrupted_mid_layer') or job['max_rank_retries'] == 0 or \
+                   opt_results['stopped_early_by_loss'] or args_global.target_loss is None:
+                    continue
+                new_rank, new_alpha, warm_params = _increase_rank_for_retry(opt_results, job['initial_rank'], job['initial_alpha'])
+                log_layer_optimization_event(LogType.RANK_RETRY_STARTING, job['loha_key_prefix'], prev_rank=job['initial_rank'], prev_best_loss=opt_results['final_loss'])
+                retry_results = optimize_loha_for_layer(
+                    job['loha_key_prefix'], deltas[idx], out_dim, in_dim_effective, k_h, k_w, new_rank, new_alpha,
+                    args_global.lr, args_global.max_iterations, args_global.min_iterations, args_global.target_loss, args_global.weight_decay,
+                    args_global.device, target_opt_dtype, is_conv, args_global.verbose_layer_debug, job['max_rank_retries'] - 1,
+                    args_global.rank_increase_factor, warm_params
+                )
+                if 'hada_w1_a' in retry_results and retry_results['final_loss'] < opt_results['final_loss']:
+                    all_results[idx] = retry_results
+        del deltas
+        for job, opt_results in zip(jobs, all_results):
+            outer_pbar_global.update(1)
+            processed = apply_layer_optimization_result(
+                job['loha_key_prefix'], job['original_module_path'], job['initial_rank'], opt_results,
+                base_model_sd, ft_model_sd, final_save_dtype_torch
+            )
+            if processed:
+                layer_optimization_stats_global.sort(key=lambda st: candidate_order.get(st['name'], len(candidate_order)))
+                maybe_periodic_save(item_idx < len(work_items) - 1)
+
 def handle_interrupt(signum, frame):
     # ... (remains the same) ...
     global save_attempted_on_interrupt, outer_pbar_global, args_global, all_completed_module_prefixes_ever_global
     print("\n" + "="*30 + "\nCtrl+C Detected!\n" + "="*30)
     if save_attempted_on_interrupt: print("Save already attempted. Exiting."); return
     save_attempted_on_interrupt = True
+    if worker_pool_global is not None: worker_pool_global.terminate()
     if outer_pbar_global: outer_pbar_global.close()
     if args_global and args_global.save_to:
         save_path = generate_intermediate_filename(args_global.save_to, len(all_completed_module_prefixes_ever_global))
@@ -848,9 +1265,10 @@ def main(cli_args):
            skipped_identical_count_global, skipped_other_reason_count_global, keys_scanned_this_run_global, \
            previously_completed_module_prefixes_global, all_completed_module_prefixes_ever_global, \
            main_loop_completed_scan_flag_global, params_to_seed_optimizer_global, skipped_good_initial_loss_count_global, \
-           skipped_vae_layers_count 
+           skipped_vae_layers_count, svd_cache_global
 
     args_global = cli_args
+    svd_cache_global = svd_cache_from_args(cli_args)
     signal.signal(signal.SIGINT, handle_interrupt) 
     extracted_loha_state_dict_global.clear(); layer_optimization_stats_global.clear()
     params_to_seed_optimizer_global.clear(); previously_completed_module_prefixes_global.clear()
@@ -871,6 +1289,8 @@ def main(cli_args):
     total_candidates_to_scan = len(all_candidate_keys) 
     print(f"Found {total_candidates_to_scan} candidate '.weight' keys for LoHA extraction.")
     outer_pbar_global = tqdm(total=total_candidates_to_scan, desc="Scanning Layers", dynamic_ncols=True, position=0)
+    pending_layer_jobs = [] # only used with --workers > 1 or --batched_fit: layers are optimized after the scan
+    candidate_order = {}
     
     try:
         for key_name in all_candidate_keys:
@@ -889,8 +1309,8 @@ def main(cli_args):
             if loha_key_prefix in all_completed_module_prefixes_ever_global and not is_reopt_target:
                 if args_global.verbose_layer_debug: tqdm.write(f"  Skipping {loha_key_prefix} (already processed/resumed, not re-opt target).")
                 continue
-            if args_global.max_layers is not None and args_global.max_layers > 0 and processed_layers_this_session_count_global >= args_global.max_layers:
-                if args_global.verbose and processed_layers_this_session_count_global == args_global.max_layers:
+            if args_global.max_layers is not None and args_global.max_layers > 0 and processed_layers_this_session_count_global + len(pending_layer_jobs) >= args_global.max_layers:
+                if args_global.verbose and processed_layers_this_session_count_global + len(pending_layer_jobs) == args_global.max_layers:
                     tqdm.write(f"\nMax_layers ({args_global.max_layers}) for new/re-optimized hit. Scan continues to find all identical/skipped layers.")
                 outer_pbar_global.set_description_str(f"Scan {keys_scanned_this_run_global}/{total_candidates_to_scan} (Max Layers Reached)")
                 continue
@@ -920,6 +1340,7 @@ def main(cli_args):
                                 tqdm.write(f"  Skip Re-Opt {loha_key_prefix}: Loaded (R:{loaded_rank_check}, A:{loaded_alpha_check:.2f}) meets target. Loss: {init_loss_c:.4e} <= {args_global.target_loss:.4e}")
                                 stat_entry_skip = {"name": str(loha_key_prefix), "original_name": str(original_module_path),"initial_rank_attempted": int(loaded_rank_check), "final_rank_used": int(loaded_rank_check),"rank_was_increased": False, "final_loss": float(init_loss_c),"alpha_final": float(loaded_alpha_check), "iterations_done": 0,"stopped_early_by_loss_target": True, "stopped_by_insufficient_progress": False,"stopped_by_projection": False, "projection_type_used": "none","final_projected_loss_on_stop": None,"skipped_reopt_due_to_initial_good_loss": True, "interrupted_mid_layer": False}
                                 layer_optimization_stats_global.append(stat_entry_skip)
+                                candidate_order[loha_key_prefix] = len(candidate_order)
                                 all_completed_module_prefixes_ever_global.add(loha_key_prefix)
                                 processed_layers_this_session_count_global += 1; skipped_good_initial_loss_count_global += 1
                                 should_skip_due_to_pre_existing_good_loss = True; current_key_processed_or_skipped_good = True
@@ -945,38 +1366,29 @@ def main(cli_args):
                         max_retries_layer = max(0, args_global.max_rank_retries - est_retries_used)
                         if args_global.verbose: tqdm.write(f"    Using loaded R:{initial_rank_opt}, A:{initial_alpha_opt:.1f}. Max further retries for layer: {max_retries_layer}.")
                 outer_pbar_global.set_description_str(f"{current_op_mode_str} L{processed_layers_this_session_count_global + 1 - skipped_good_initial_loss_count_global} (Scan {keys_scanned_this_run_global}/{total_candidates_to_scan}, SkipGood:{skipped_good_initial_loss_count_global})")
+                if args_global.workers > 1 or args_global.batched_fit:
+                    pending_layer_jobs.append({
+                        "order": len(candidate_order), "key_name": key_name, "loha_key_prefix": loha_key_prefix,
+                        "original_module_path": original_module_path, "numel": delta_W_fp32.numel(),
+                        "shape_info": (out_dim, in_dim_effective, k_h, k_w, is_conv),
+                        "initial_rank": initial_rank_opt, "initial_alpha": initial_alpha_opt,
+                        "max_rank_retries": max_retries_layer, "existing_params": existing_params_init
+                    })
+                    candidate_order[loha_key_prefix] = len(candidate_order)
+                    continue
+                # same per-layer seed as _optimize_layer_worker, so --workers 1 saves the same file as a parallel run
+                torch.manual_seed(zlib.crc32(loha_key_prefix.encode("utf-8")))
                 opt_results = optimize_loha_for_layer(loha_key_prefix, delta_W_fp32, out_dim, in_dim_effective, k_h, k_w, initial_rank_opt, initial_alpha_opt, args_global.lr, args_global.max_iterations, args_global.min_iterations, args_global.target_loss, args_global.weight_decay, args_global.device, target_opt_dtype, is_conv, args_global.verbose_layer_debug, max_retries_layer, args_global.rank_increase_factor, existing_params_init)
-                if not opt_results.get('interrupted_mid_layer') and 'hada_w1_a' in opt_results :
-                    for p_name, p_val in opt_results.items():
-                        if p_name not in ['final_loss', 'stopped_early_by_loss', 'stopped_by_insufficient_progress', 'stopped_by_projection', 'projection_type_used', 'iterations_done', 'final_rank_used', 'interrupted_mid_layer', 'final_projected_loss_on_stop']:
-                            if torch.is_tensor(p_val): extracted_loha_state_dict_global[f'{loha_key_prefix}.{p_name}'] = p_val.to(final_save_dtype_torch)
-                    final_rank_used = opt_results['final_rank_used']
-                    stat_entry = {"name": str(loha_key_prefix),"original_name": str(original_module_path),"initial_rank_attempted": int(initial_rank_opt),"final_rank_used": int(final_rank_used),"rank_was_increased": bool(final_rank_used > initial_rank_opt),"final_loss": float(opt_results['final_loss']),"alpha_final": float(opt_results['alpha'].item()) if isinstance(opt_results.get('alpha'), torch.Tensor) else float(opt_results.get('alpha', 0.0)),"iterations_done": int(opt_results['iterations_done']),"stopped_early_by_loss_target": bool(opt_results['stopped_early_by_loss']),"stopped_by_insufficient_progress": bool(opt_results.get('stopped_by_insufficient_progress', False)),"stopped_by_projection": bool(opt_results.get('stopped_by_projection', False)),"projection_type_used": str(opt_results.get('projection_type_used', 'none')),"final_projected_loss_on_stop": float(l_val) if (l_val := opt_results.get('final_projected_loss_on_stop')) is not None else None,"skipped_reopt_due_to_initial_good_loss": False,"interrupted_mid_layer": bool(opt_results.get('interrupted_mid_layer', False))}
-                    layer_optimization_stats_global.append(stat_entry)
-                    all_completed_module_prefixes_ever_global.add(loha_key_prefix)
-                    stop_reason_short = ""
-                    if opt_results['stopped_early_by_loss']: stop_reason_short = ", Stop:LossTarget"
-                    elif opt_results.get('stopped_by_projection', False): stop_reason_short = f", Stop:Proj({opt_results.get('projection_type_used','?')})"
-                    elif opt_results['stopped_by_insufficient_progress']: stop_reason_short = ", Stop:RawProg"
-                    tqdm.write(f"  Layer {loha_key_prefix} Opt. Done. R_used: {final_rank_used}, FinalLoss: {opt_results['final_loss']:.4e}, Iters: {opt_results['iterations_done']}{stop_reason_short}")
-                    if args_global.use_bias:
-                        bias_key = f"{original_module_path}.bias"
-                        if bias_key in ft_model_sd and (bias_key not in base_model_sd or not torch.allclose(base_model_sd[bias_key], ft_model_sd[bias_key], atol=args_global.atol_fp32_check)):
-                            extracted_loha_state_dict_global[bias_key] = ft_model_sd[bias_key].cpu().to(final_save_dtype_torch)
-                            if args_global.verbose: tqdm.write(f"    Saved differing/new bias for {bias_key}")
-                    processed_layers_this_session_count_global += 1
-                    current_key_processed_or_skipped_good = True 
-                else:
-                     tqdm.write(f"  Optimization for {loha_key_prefix} did not yield saveable results (Interrupt: {opt_results.get('interrupted_mid_layer', 'N/A')}, Loss: {opt_results.get('final_loss', 'N/A')})")
-                     if not opt_results.get('interrupted_mid_layer', False) and 'hada_w1_a' not in opt_results :
-                         skipped_other_reason_count_global += 1
-                         all_completed_module_prefixes_ever_global.add(loha_key_prefix)
+                current_key_processed_or_skipped_good = apply_layer_optimization_result(
+                    loha_key_prefix, original_module_path, initial_rank_opt, opt_results, base_model_sd, ft_model_sd, final_save_dtype_torch
+                )
             if current_key_processed_or_skipped_good: 
-                if args_global.save_every_n_layers > 0 and processed_layers_this_session_count_global > 0 and processed_layers_this_session_count_global % args_global.save_every_n_layers == 0 and keys_scanned_this_run_global < total_candidates_to_scan: 
-                    periodic_save_path = generate_intermediate_filename(args_global.save_to, len(all_completed_module_prefixes_ever_global))
-                    tqdm.write(f"\n--- Periodic Save: Processed {processed_layers_this_session_count_global} layers this session. Saving to {periodic_save_path} ---")
-                    if perform_graceful_save(periodic_save_path) and args_global.keep_n_resume_files > 0:
-                        cleanup_intermediate_files(args_global.save_to, True, args_global.keep_n_resume_files)
+                maybe_periodic_save(keys_scanned_this_run_global < total_candidates_to_scan)
+        if pending_layer_jobs and not save_attempted_on_interrupt:
+            if args_global.batched_fit:
+                run_batched_layer_jobs(pending_layer_jobs, candidate_order, base_model_sd, ft_model_sd, final_save_dtype_torch)
+            else:
+                run_parallel_layer_jobs(pending_layer_jobs, candidate_order, base_model_sd, ft_model_sd, final_save_dtype_torch)
         if not save_attempted_on_interrupt and keys_scanned_this_run_global == total_candidates_to_scan:
             main_loop_completed_scan_flag_global = True
     finally:
@@ -994,6 +1406,7 @@ def main(cli_args):
             keys_scanned_session=keys_scanned_this_run_global,
             total_candidates=total_candidates_to_scan 
         )
+        if svd_cache_global is not None: print(svd_cache_global.summary())
         
         is_fully_complete = main_loop_completed_scan_flag_global and len(all_completed_module_prefixes_ever_global) >= total_candidates_to_scan
         actual_save_path = args_global.save_to if is_fully_complete else generate_intermediate_filename(args_global.save_to, len(all_completed_module_prefixes_ever_global))
@@ -1057,6 +1470,8 @@ if __name__ == "__main__":
     parser.add_argument("--precision", type=str, default="fp32", choices=["fp32", "fp16", "bf16"], help="Optimization precision.")
     parser.add_argument("--save_weights_dtype", type=str, default="bf16", choices=["fp32", "fp16", "bf16"], help="Dtype for saved LoHA weights.")
     parser.add_argument("--atol_fp32_check", type=float, default=1e-6, help="Tolerance for identical weight check.")
+    parser.add_argument("--init_method", type=str, default="kaiming", choices=["kaiming", "svd"], help="Initializer for fresh layers: Kaiming/Normal, or factors derived from a truncated SVD of the weight delta.")
+    add_svd_cache_arguments(parser)
     parser.add_argument("--no_warm_start", action="store_true", help="Disable warm-starting higher rank attempts from previous best.")
     parser.add_argument("--use_bias", action="store_true", help="Save differing bias terms into LoHA.")
     parser.add_argument("--dropout", type=float, default=0.0, help="General dropout (metadata only).")
@@ -1069,6 +1484,10 @@ if __name__ == "__main__":
     parser.add_argument("--projection_ema_alpha", type=float, default=0.1, help="Smoothing factor for EMA.")
     parser.add_argument("--projection_min_ema_history", type=int, default=5, help="Min EMA samples for EMA-based projection.")
     parser.add_argument("--save_every_n_layers", type=int, default=0, help="Save intermediate LoHA every N processed layers (0 to disable).")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes optimizing independent layers in parallel (1 = sequential).")
+    parser.add_argument("--batched_fit", action="store_true", help="Fit same-shaped layers together in one batched optimization (takes precedence over --workers).")
+    parser.add_argument("--max_batch_size", type=int, default=16, help="Max layers stacked into one batch with --batched_fit.")
+    parser.add_argument("--threads_per_worker", type=int, default=None, help="Torch threads per worker process. Defaults to CPU cores / workers.")
     parser.add_argument("--keep_n_resume_files", type=int, default=0, help="Keep only N most recent intermediate resume files (0 to keep all).")
     
     raw_parsed_args = parser.parse_args()
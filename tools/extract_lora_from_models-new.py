@@ -2,11 +2,15 @@ import sys
 import os
 import argparse
 import json
+import math
 import time
 import torch
 from safetensors.torch import load_file, save_file
 from tqdm import tqdm
 import logging # Import for logging
+from svd_cache import SVDCache, add_svd_cache_arguments
+from rank_sweep import (estimate_safetensors_size, index_sv_cumulative_knee, index_sv_knee, parse_sweep_settings,
+                        sweep_setting_ranks, sweep_table_lines)
 
 # NEW: Add diffusers import for model loading
 try:
@@ -112,35 +116,6 @@ def index_sv_ratio(S, target):
     index = max(1, min(index, len(S) - 1))
     return index
 
-def index_sv_knee(S, MIN_SV_KNEE=1e-8):
-    n = len(S)
-    if n < 3: return 1
-    s_max, s_min = S[0], S[-1]
-    if s_max - s_min < MIN_SV_KNEE: return 1
-    s_normalized = (S - s_min) / (s_max - s_min)
-    x_normalized = torch.linspace(0, 1, n, device=S.device, dtype=S.dtype)
-    distances = (x_normalized + s_normalized - 1).abs()
-    knee_index_0based = torch.argmax(distances).item()
-    rank = knee_index_0based + 1
-    rank = max(1, min(rank, n - 1))
-    return rank
-
-def index_sv_cumulative_knee(S, min_sv_threshold=1e-8):
-    n = len(S)
-    if n < 3: return 1
-    s_sum = torch.sum(S)
-    if s_sum < min_sv_threshold: return 1
-    y_values = torch.cumsum(S, dim=0) / s_sum
-    y_min, y_max = y_values[0], y_values[n-1]
-    if y_max - y_min < min_sv_threshold: return 1
-    y_norm = (y_values - y_min) / (y_max - y_min)
-    x_norm = torch.linspace(0, 1, n, device=S.device, dtype=S.dtype)
-    distances = (y_norm - x_norm).abs()
-    knee_index_0based = torch.argmax(distances).item()
-    rank = knee_index_0based + 1
-    rank = max(1, min(rank, n - 1))
-    return rank
-
 def index_sv_rel_decrease(S, tau=0.1):
     if len(S) < 2: return 1
     ratios = S[1:] / S[:-1]
@@ -257,6 +232,28 @@ def _determine_rank(S_values, dynamic_method_name, dynamic_param_value, max_rank
     rank = max(1, rank)
     return rank
 
+def _determine_ranks_sweep(S_values, settings, max_rank_limit, module_eff_in_dim, module_eff_out_dim, min_sv_threshold=MIN_SV):
+    # _determine_rank for every (method, param) setting from one spectrum, see rank_sweep.sweep_ranks
+    n = len(S_values)
+    if not S_values.numel(): return [1] * len(settings)
+    S = S_values.float().unsqueeze(0)
+    ranks = sweep_setting_ranks(S, torch.tensor([n], device=S.device), settings, max_rank_limit, min_sv_threshold)[0]
+    return [max(1, min(rank, module_eff_in_dim, module_eff_out_dim, n)) for rank in ranks.tolist()]
+
+def _log_sweep_table(settings, sweep_stats, save_dtype_torch):
+    rows = []
+    for (method, param), stats in zip(settings, sweep_stats):
+        rows.append({
+            "method": method, "param": param, "total_params": stats["params"],
+            "file_size": estimate_safetensors_size(stats["shapes"], save_dtype_torch),
+            "fro_retained": math.sqrt(stats["retained"] / stats["total"]) if stats["total"] > 0 else 1.0,
+            "mean_fro_retained": sum(stats["fro_list"]) / len(stats["fro_list"]) if stats["fro_list"] else 1.0,
+            "mean_rank": sum(stats["ranks"]) / len(stats["ranks"]) if stats["ranks"] else 0.0,
+            "max_rank": max(stats["ranks"], default=0),
+        })
+    for line in sweep_table_lines(rows):
+        logger.info(line)
+
 def _construct_lora_weights_from_svd_components(U_full, S_all_values, Vh_full, rank,
                                                 clamp_quantile_val, is_conv2d, is_conv2d_3x3,
                                                 conv_kernel_size,
@@ -336,6 +333,16 @@ def _prepare_lora_metadata(output_path, is_v2_flag, kohya_base_model_version_str
         final_metadata.update(sai_metadata_content)
     return final_metadata
 
+def _save_lora_weights(lora_weights, save_to, save_dtype_torch, final_weights_device, metadata_to_save):
+    lora_sd = {}
+    for lora_name, (up_weight, down_weight) in lora_weights.items():
+        lora_sd[lora_name + ".lora_up.weight"] = up_weight
+        lora_sd[lora_name + ".lora_down.weight"] = down_weight
+        # Alpha is set to the rank (dim of down_weight's 0th axis, which is rank)
+        lora_sd[lora_name + ".alpha"] = torch.tensor(down_weight.size()[0], dtype=save_dtype_torch, device=final_weights_device)
+    save_to_file(save_to, lora_sd, save_dtype_torch, metadata_to_save)
+    logger.info(f"LoRA saved to: {save_to}")
+
 # --- Main SVD Function ---
 def svd(
     model_org=None, model_tuned=None, save_to=None, dim=4, v2=None, sdxl=None, 
@@ -343,6 +350,8 @@ def svd(
     clamp_quantile=0.99, min_diff=0.01, no_metadata=False, load_precision=None,
     load_original_model_to=None, load_tuned_model_to=None,
     dynamic_method=None, dynamic_param=None, verbose=False,
+    svd_cache_dir=None, svd_cache_max_rank=128, svd_cache_max_gb=10.0,
+    sweep=None, sweep_save=False,
 ):
     actual_v_parameterization = v2 if v_parameterization is None else v_parameterization
     load_dtype_torch = _str_to_dtype(load_precision)
@@ -353,6 +362,9 @@ def svd(
     diff_calculation_device = torch.device("cpu")
     logger.info(f"Calculating weight differences on: {diff_calculation_device}")
     final_weights_device = torch.device("cpu")
+    svd_cache = SVDCache(svd_cache_dir, svd_cache_max_rank, svd_cache_max_gb, verbose) if svd_cache_dir else None
+    if svd_cache is not None:
+        logger.info(f"Using SVD cache: {svd_cache_dir}")
 
     if not sdxl:
         text_encoders_o, unet_o = _load_sd_model_components(model_org, v2, load_original_model_to, load_dtype_torch)
@@ -416,6 +428,12 @@ def svd(
     
     logger.info("Extracting and resizing LoRA via SVD")
     lora_weights = {}
+    sweep_settings = parse_sweep_settings(sweep) if sweep else []
+    sweep_stats = [{"params": 0, "retained": 0.0, "total": 0.0, "fro_list": [], "ranks": [], "shapes": {}} for _ in sweep_settings]
+    sweep_weights = [{} for _ in sweep_settings]
+    max_fixed_rank = max([param for method, param in sweep_settings if method == "fixed"], default=0)
+    if sweep_settings:
+        logger.info(f"Sweeping {len(sweep_settings)} rank settings from one SVD per module")
     with torch.no_grad():
         for lora_name in tqdm(lora_names_to_process):
             if lora_name not in all_diffs:
@@ -433,19 +451,45 @@ def svd(
             if mat_for_svd.numel() == 0 or mat_for_svd.shape[0] == 0 or mat_for_svd.shape[1] == 0 :
                 logger.warning(f"Skipping SVD for {lora_name} due to empty/invalid shape: {mat_for_svd.shape}")
                 continue
-            try:
-                U_full, S_full, Vh_full = torch.linalg.svd(mat_for_svd)
-            except Exception as e:
-                logger.error(f"SVD failed for {lora_name} with shape {mat_for_svd.shape}. Error: {e}")
-                continue
-            
             # Max rank for SVD is based on 'dim' for linear and 'conv_dim' for conv3x3
             # The original `current_max_rank` logic was:
             # current_max_rank = dim if not is_conv2d_3x3_layer or conv_dim is None else conv_dim
             # Here, `dim` is args.dim and `conv_dim` is args.conv_dim (defaulted to args.dim)
             module_specific_max_rank = conv_dim if is_conv2d_3x3_layer else dim
+            try:
+                if svd_cache is not None:
+                    U_full, S_full, Vh_full = svd_cache.svd(lora_name, mat_for_svd, key_tensors=(original_diff_tensor,), min_rank=max(module_specific_max_rank, max_fixed_rank))
+                else:
+                    U_full, S_full, Vh_full = torch.linalg.svd(mat_for_svd)
+            except Exception as e:
+                logger.error(f"SVD failed for {lora_name} with shape {mat_for_svd.shape}. Error: {e}")
+                continue
             
             eff_out_dim, eff_in_dim = mat_for_svd.shape[0], mat_for_svd.shape[1]
+            if sweep_settings:
+                layer_ranks = _determine_ranks_sweep(S_full, sweep_settings, module_specific_max_rank, eff_in_dim, eff_out_dim, MIN_SV)
+                energy = torch.cumsum(S_full.float().pow(2), dim=0).cpu()
+                for index, rank in enumerate(layer_ranks):
+                    stats = sweep_stats[index]
+                    retained = float(energy[min(rank, len(energy)) - 1])
+                    stats["params"] += rank * (eff_out_dim + eff_in_dim) + 1
+                    stats["retained"] += retained
+                    stats["total"] += float(energy[-1])
+                    stats["ranks"].append(rank)
+                    if float(energy[-1]) > MIN_SV ** 2:
+                        stats["fro_list"].append(math.sqrt(retained / float(energy[-1])))
+                    down_tail = (tuple(kernel_s) if is_conv2d_3x3_layer else (1, 1)) if is_conv2d_layer else ()
+                    stats["shapes"][lora_name + ".lora_up.weight"] = (module_true_out_channels, rank) + ((1, 1) if is_conv2d_layer else ())
+                    stats["shapes"][lora_name + ".lora_down.weight"] = (rank, module_true_in_channels) + down_tail
+                    stats["shapes"][lora_name + ".alpha"] = ()
+                    if sweep_save:
+                        sweep_weights[index][lora_name] = _construct_lora_weights_from_svd_components(
+                            U_full, S_full, Vh_full, rank, clamp_quantile,
+                            is_conv2d_layer, is_conv2d_3x3_layer, kernel_s,
+                            module_true_out_channels, module_true_in_channels,
+                            final_weights_device, save_dtype_torch
+                        )
+                continue
             rank = _determine_rank(S_full, dynamic_method, dynamic_param,
                                    module_specific_max_rank, eff_in_dim, eff_out_dim, MIN_SV)
             U_clamped, Vh_clamped = _construct_lora_weights_from_svd_components(
@@ -456,13 +500,8 @@ def svd(
             )
             lora_weights[lora_name] = (U_clamped, Vh_clamped)
             if verbose: _log_svd_stats(lora_name, S_full, rank, MIN_SV)
-
-    lora_sd = {}
-    for lora_name, (up_weight, down_weight) in lora_weights.items():
-        lora_sd[lora_name + ".lora_up.weight"] = up_weight
-        lora_sd[lora_name + ".lora_down.weight"] = down_weight
-        # Alpha is set to the rank (dim of down_weight's 0th axis, which is rank)
-        lora_sd[lora_name + ".alpha"] = torch.tensor(down_weight.size()[0], dtype=save_dtype_torch, device=final_weights_device)
+    if svd_cache is not None:
+        logger.info(svd_cache.summary())
 
     del text_encoders_o, unet_o, lora_network_o, all_diffs # Clean up original models and placeholders
     if 'torch' in sys.modules and hasattr(torch, 'cuda') and torch.cuda.is_available():
@@ -471,6 +510,22 @@ def svd(
     if not os.path.exists(os.path.dirname(save_to)) and os.path.dirname(save_to) != "":
         os.makedirs(os.path.dirname(save_to), exist_ok=True)
 
+    if sweep_settings:
+        _log_sweep_table(sweep_settings, sweep_stats, save_dtype_torch)
+        if sweep_save:
+            root, ext = os.path.splitext(save_to)
+            for (method, param), setting_weights in zip(sweep_settings, sweep_weights):
+                setting_save_to = f"{root}_{method}{'' if param is None else '-' + str(param)}{ext}"
+                metadata_to_save = _prepare_lora_metadata(
+                    output_path=setting_save_to, is_v2_flag=v2, kohya_base_model_version_str=kohya_model_version,
+                    network_conv_dim_val=param if method == "fixed" else conv_dim,
+                    use_dynamic_method_flag=method != "fixed",
+                    network_dim_config_val=param if method == "fixed" else dim,
+                    is_v_param_flag=actual_v_parameterization, is_sdxl_flag=sdxl, skip_sai_meta=no_metadata
+                )
+                _save_lora_weights(setting_weights, setting_save_to, save_dtype_torch, final_weights_device, metadata_to_save)
+        return
+
     metadata_to_save = _prepare_lora_metadata(
         output_path=save_to, 
         is_v2_flag=v2, 
@@ -483,8 +538,7 @@ def svd(
         skip_sai_meta=no_metadata
     )
     
-    save_to_file(save_to, lora_sd, save_dtype_torch, metadata_to_save)
-    logger.info(f"LoRA saved to: {save_to}")
+    _save_lora_weights(lora_weights, save_to, save_dtype_torch, final_weights_device, metadata_to_save)
 
 def setup_parser():
     parser = argparse.ArgumentParser()
@@ -511,6 +565,13 @@ def setup_parser():
         choices=[None, "sv_ratio", "sv_fro", "sv_cumulative", "sv_knee", "sv_rel_decrease", "sv_cumulative_knee"],
         default=None, help="Dynamic rank reduction method"
     )
+    add_svd_cache_arguments(parser)
+    parser.add_argument(
+        "--sweep", type=str, nargs="+", default=None,
+        help="Evaluate many rank settings from one SVD per module and log params / size / retained Frobenius norm per setting, "
+             "e.g. --sweep sv_fro:0.8,0.9 sv_ratio:4,8 sv_knee fixed:16,32. --dim/--conv_dim cap the dynamic methods"
+    )
+    parser.add_argument("--sweep_save", action="store_true", help="With --sweep, also save every setting next to --save_to as <name>_<method>-<param>.safetensors")
     return parser
 
 if __name__ == "__main__":
@@ -1,8 +1,28 @@
 import torch
 from safetensors.torch import load_file, save_file
+from safetensors import safe_open
 from collections import OrderedDict
 import os
+import json
+import math
+import queue
+import struct
+import threading
 import argparse # Import argparse
+from safetensors_header import SAFETENSORS_ITEMSIZES, read_safetensors_header
+
+# safetensors header dtype strings -> torch dtypes
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8,
+    "U8": torch.uint8, "BOOL": torch.bool,
+}
+for _st_name, _torch_name in (
+    ("F8_E4M3", "float8_e4m3fn"), ("F8_E5M2", "float8_e5m2"), ("U16", "uint16"), ("U32", "uint32"), ("U64", "uint64"),
+):
+    if hasattr(torch, _torch_name):
+        SAFETENSORS_DTYPES[_st_name] = getattr(torch, _torch_name)
+SAVE_DTYPE_NAMES = {"float32": "F32", "float16": "F16", "bfloat16": "BF16"}
 
 def extract_model_differences(base_model_path, finetuned_model_path, output_delta_path=None, save_dtype_str="float32"):
     """
@@ -126,6 +146,213 @@ def extract_model_differences(base_model_path, finetuned_model_path, output_delt
 
     return delta_state_dict
 
+def _is_float_dtype(dtype_str):
+    return dtype_str.startswith("F") or dtype_str == "BF16"
+
+
+def plan_streaming_delta(base_header, finetuned_header, save_dtype_name):
+    """
+    Builds the output layout of the delta file from the two input headers alone.
+
+    Returns:
+        tuple: (plan, skipped_count, keys_only_in_base). plan is a list of
+               (key, kind, shape, out_dtype_name) where kind is "diff" for common
+               float tensors and "copy" for tensors only present in the fine-tuned model.
+    """
+    plan = []
+    skipped_count = 0
+
+    for key in sorted(finetuned_header):
+        ft_info = finetuned_header[key]
+        base_info = base_header.get(key)
+        if ft_info["dtype"] not in SAFETENSORS_DTYPES or (base_info is not None and base_info["dtype"] not in SAFETENSORS_DTYPES):
+            # this torch build cannot load the tensor (e.g. F8 before torch 2.1, U16/U32/U64 before 2.3)
+            print(f"Skipping key '{key}': dtype {ft_info['dtype']} is not supported by this torch version.")
+            skipped_count += 1
+            continue
+        if base_info is None:
+            print(f"Warning: Key '{key}' (Shape: {ft_info['shape']}, Dtype: {ft_info['dtype']}) is present in fine-tuned model but not in base model. Storing as is.")
+            out_dtype = save_dtype_name if _is_float_dtype(ft_info["dtype"]) else ft_info["dtype"]
+            plan.append((key, "copy", ft_info["shape"], out_dtype))
+            continue
+        if not (_is_float_dtype(ft_info["dtype"]) and _is_float_dtype(base_info["dtype"])):
+            skipped_count += 1
+            continue
+        if ft_info["shape"] != base_info["shape"]:
+            print(f"Skipping key '{key}': Shape mismatch (FT: {ft_info['shape']}, Base: {base_info['shape']}).")
+            skipped_count += 1
+            continue
+        plan.append((key, "diff", ft_info["shape"], save_dtype_name))
+
+    keys_only_in_base = [key for key in base_header if key not in finetuned_header]
+    return plan, skipped_count, keys_only_in_base
+
+
+def _build_output_header(plan):
+    header = {}
+    offset = 0
+    for key, _, shape, out_dtype in plan:
+        nbytes = math.prod(shape) * SAFETENSORS_ITEMSIZES[out_dtype]
+        header[key] = {"dtype": out_dtype, "shape": shape, "data_offsets": [offset, offset + nbytes]}
+        offset += nbytes
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    # pad with spaces so the tensor buffer starts 8-byte aligned
+    header_bytes += b" " * (-len(header_bytes) % 8)
+    return header_bytes, offset
+
+
+_END_OF_STREAM = object()
+
+
+def _chunk_reader(base_model_path, finetuned_model_path, plan, chunk_bytes, out_queue, stop_event):
+    """
+    Reader thread: yields (key, base_chunk, ft_chunk) row blocks in plan order so the
+    next tensor is already being read while the current one is diffed and written.
+    """
+    def put(item):
+        while not stop_event.is_set():
+            try:
+                out_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        with safe_open(base_model_path, framework="pt", device="cpu") as base_f, \
+             safe_open(finetuned_model_path, framework="pt", device="cpu") as ft_f:
+            for key, kind, shape, _ in plan:
+                if len(shape) == 0:
+                    base_chunk = base_f.get_tensor(key) if kind == "diff" else None
+                    if not put((key, base_chunk, ft_f.get_tensor(key))):
+                        return
+                    continue
+                # rows of the leading dim are contiguous, so row blocks can be written back to back
+                row_bytes = max(1, math.prod(shape[1:]) * 4)
+                rows_per_chunk = max(1, chunk_bytes // row_bytes)
+                ft_slice = ft_f.get_slice(key)
+                base_slice = base_f.get_slice(key) if kind == "diff" else None
+                for start in range(0, max(shape[0], 1), rows_per_chunk):
+                    end = min(start + rows_per_chunk, shape[0])
+                    base_chunk = base_slice[start:end] if base_slice is not None else None
+                    if not put((key, base_chunk, ft_slice[start:end])):
+                        return
+        put(_END_OF_STREAM)
+    except Exception as e:
+        put(e)
+
+
+def extract_model_differences_streaming(base_model_path, finetuned_model_path, output_delta_path, save_dtype_str="float32",
+                                        chunk_size_mb=256, prefetch=2):
+    """
+    Streaming variant of extract_model_differences for checkpoints that do not fit in RAM.
+
+    Both inputs are opened with safe_open and diffed tensor by tensor in row blocks of at most
+    chunk_size_mb (fp32). The output header is precomputed from the two input headers, so every
+    block is written to disk as soon as it is computed. Peak memory stays at a few blocks.
+
+    Args:
+        base_model_path (str): Path to the base model .safetensors file.
+        finetuned_model_path (str): Path to the fine-tuned model .safetensors file.
+        output_delta_path (str): Path to save the resulting delta weights .safetensors file.
+        save_dtype_str (str, optional): Data type to save the delta weights ('float32', 'float16', 'bfloat16').
+                                        Defaults to 'float32'.
+        chunk_size_mb (int, optional): Size of the row blocks that are read and diffed at once. Defaults to 256.
+        prefetch (int, optional): Number of blocks the reader thread may read ahead. Defaults to 2.
+    Returns:
+        list: Keys written to the delta file. Returns None if reading or writing fails.
+    """
+    if save_dtype_str not in SAVE_DTYPE_NAMES:
+        print(f"Warning: Invalid save_dtype '{save_dtype_str}'. Defaulting to float32.")
+        save_dtype_str = "float32"
+    save_dtype_name = SAVE_DTYPE_NAMES[save_dtype_str]
+    save_dtype = SAFETENSORS_DTYPES[save_dtype_name]
+
+    try:
+        base_header = read_safetensors_header(base_model_path)
+        finetuned_header = read_safetensors_header(finetuned_model_path)
+        base_header.pop("__metadata__", None)
+        finetuned_header.pop("__metadata__", None)
+    except Exception as e:
+        print(f"Error reading safetensors headers: {e}")
+        return None
+    print(f"Base model header: {len(base_header)} tensors. Fine-tuned model header: {len(finetuned_header)} tensors.")
+
+    plan, skipped_count, keys_only_in_base = plan_streaming_delta(base_header, finetuned_header, save_dtype_name)
+    if keys_only_in_base:
+        print(f"\nWarning: {len(keys_only_in_base)} key(s) are present only in the base model and will not be in the delta file.")
+        for key in keys_only_in_base[:5]: # Print first 5 as examples
+             print(f"  - Example key only in base: {key}")
+        if len(keys_only_in_base) > 5:
+            print(f"  ... and {len(keys_only_in_base) - 5} more.")
+    if not plan:
+        print("No tensors to write.")
+        return None
+
+    header_bytes, data_size = _build_output_header(plan)
+    print(f"\nStreaming {len(plan)} tensors ({data_size / 1024**3:.2f} GiB, dtype {save_dtype_str}) to: {output_delta_path}")
+
+    out_queue = queue.Queue(maxsize=max(1, prefetch))
+    stop_event = threading.Event()
+    reader = threading.Thread(
+        target=_chunk_reader,
+        args=(base_model_path, finetuned_model_path, plan, int(chunk_size_mb * 1024**2), out_queue, stop_event),
+        daemon=True,
+    )
+
+    temp_path = output_delta_path + ".part"
+    diff_count = 0
+    unique_to_finetuned_count = 0
+    written_keys = []
+    try:
+        with open(temp_path, "wb") as out_f:
+            out_f.write(struct.pack("<Q", len(header_bytes)))
+            out_f.write(header_bytes)
+            reader.start()
+            current_key = None
+            while True:
+                item = out_queue.get()
+                if item is _END_OF_STREAM:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                key, base_chunk, ft_chunk = item
+                if base_chunk is not None:
+                    # Calculate difference in float32 for precision, then cast to save_dtype
+                    out_chunk = (ft_chunk.to(dtype=torch.float32) - base_chunk.to(dtype=torch.float32)).to(save_dtype)
+                elif ft_chunk.is_floating_point():
+                    out_chunk = ft_chunk.to(save_dtype)
+                else:
+                    out_chunk = ft_chunk # Keep non-float as is
+                out_f.write(out_chunk.contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+                if key != current_key:
+                    current_key = key
+                    written_keys.append(key)
+                    if base_chunk is not None:
+                        diff_count += 1
+                    else:
+                        unique_to_finetuned_count += 1
+            if out_f.tell() != 8 + len(header_bytes) + data_size:
+                raise RuntimeError(f"Wrote {out_f.tell()} bytes, expected {8 + len(header_bytes) + data_size}")
+        os.replace(temp_path, output_delta_path)
+    except Exception as e:
+        print(f"Error while streaming delta weights: {e}")
+        import traceback
+        traceback.print_exc()
+        stop_event.set()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return None
+    finally:
+        stop_event.set()
+
+    print(f"\nDifference calculation complete.")
+    print(f"  {diff_count} layers successfully diffed.")
+    print(f"  {unique_to_finetuned_count} layers unique to fine-tuned model (added as is).")
+    print(f"  {skipped_count} common layers skipped (shape/type mismatch).")
+    print(f"Delta weights saved to: {output_delta_path}")
+    return written_keys
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Extract weight differences between a fine-tuned and a base SDXL model.")
     parser.add_argument("base_model_path", type=str, help="File path for the BASE SDXL model (.safetensors).")
@@ -136,6 +363,13 @@ if __name__ == "__main__":
     parser.add_argument("--save_dtype", type=str, default="float32", choices=["float32", "float16", "bfloat16"],
                         help="Data type for saving the delta weights. Choose from 'float32', 'float16', 'bfloat16'. "
                              "Defaults to 'float32'.")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Diff the models tensor by tensor with safe_open and write the delta incrementally. "
+                             "Keeps peak memory at a few tensors instead of ~3x the model size.")
+    parser.add_argument("--chunk_size_mb", type=int, default=256,
+                        help="Streaming mode: size of the row blocks read and diffed at once. Defaults to 256.")
+    parser.add_argument("--prefetch", type=int, default=2,
+                        help="Streaming mode: number of blocks the reader thread reads ahead. Defaults to 2.")
 
     args = parser.parse_args()
 
@@ -162,12 +396,22 @@ if __name__ == "__main__":
             os.makedirs(output_dir_for_file, exist_ok=True)
 
 
-    differences = extract_model_differences(
-        args.base_model_path,
-        args.finetuned_model_path,
-        output_delta_path=output_delta_file,
-        save_dtype_str=args.save_dtype
-    )
+    if args.streaming:
+        differences = extract_model_differences_streaming(
+            args.base_model_path,
+            args.finetuned_model_path,
+            output_delta_file,
+            save_dtype_str=args.save_dtype,
+            chunk_size_mb=args.chunk_size_mb,
+            prefetch=args.prefetch
+        )
+    else:
+        differences = extract_model_differences(
+            args.base_model_path,
+            args.finetuned_model_path,
+            output_delta_path=output_delta_file,
+            save_dtype_str=args.save_dtype
+        )
 
     if differences:
         print(f"\nExtraction process finished. {len(differences)} total keys in the delta state_dict.")
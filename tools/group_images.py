@@ -1,9 +1,13 @@
 import argparse
 import shutil
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image, ImageOps
 import os
 import numpy as np
 
+from aspect_buckets import center_crop_boxes, fixed_size_bounds, group_means, optimal_bounds
+from image_size import get_aspect_ratios, get_image_sizes
 from library.utils import setup_logging
 import logging
 
@@ -13,7 +17,7 @@ log = logging.getLogger(__name__)
 
 class ImageProcessor:
 
-    def __init__(self, input_folder, output_folder, group_size, include_subfolders, do_not_copy_other_files, pad, caption, caption_ext):
+    def __init__(self, input_folder, output_folder, group_size, include_subfolders, do_not_copy_other_files, pad, caption, caption_ext, bucketing='fixed', num_buckets=None, workers=None):
         self.input_folder = input_folder
         self.output_folder = output_folder
         self.group_size = group_size
@@ -23,6 +27,12 @@ class ImageProcessor:
         self.caption = caption
         self.caption_ext = caption_ext
         self.image_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.tiff')
+        self.bucketing = bucketing
+        self.num_buckets = num_buckets
+        self.workers = workers
+        self.aspect_ratios = {}  # path -> width / height, read from the image headers
+        self.image_sizes = {}  # path -> (width, height), read from the image headers
+        self.related_files = {}  # folder -> base name -> file names in that folder
 
     def get_image_paths(self):
         images = []
@@ -35,31 +45,35 @@ class ImageProcessor:
             images = [os.path.join(self.input_folder, f) for f in os.listdir(self.input_folder) if f.endswith(self.image_extensions)]
         return images
 
+    def load_sorted_images(self, images):
+        self.image_sizes.update(get_image_sizes([path for path in images if path not in self.image_sizes]))
+        for path in images:
+            if self.image_sizes[path] is None:
+                log.warning(f"Skipping unreadable image {path}")
+        images = [path for path in images if self.image_sizes[path] is not None]
+        widths = np.array([self.image_sizes[path][0] for path in images], dtype=np.int64)
+        heights = np.array([self.image_sizes[path][1] for path in images], dtype=np.int64)
+        ratios = widths / heights
+        self.aspect_ratios.update(zip(images, ratios.tolist()))
+        order = np.argsort(ratios, kind="stable")
+        return [images[i] for i in order], widths[order], heights[order]
+
+    def group_bounds(self, widths, heights):
+        if self.bucketing == 'optimal':
+            return optimal_bounds(widths / heights, self.num_buckets, step=self.group_size, areas=widths * heights)
+        return fixed_size_bounds(len(widths), self.group_size)
+
     def group_images(self, images):
-        sorted_images = sorted(images, key=lambda path: Image.open(path).size[0] / Image.open(path).size[1])
-        groups = [sorted_images[i:i+self.group_size] for i in range(0, len(sorted_images), self.group_size)]
+        sorted_images, widths, heights = self.load_sorted_images(images)
+        bounds = self.group_bounds(widths, heights)
+        groups = [sorted_images[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
         return groups
 
-    def process_group(self, group, group_index):
-        if len(group) > 0:
-            aspect_ratios = self.get_aspect_ratios(group)
-            avg_aspect_ratio = np.mean(aspect_ratios)
-            if self.pad:
-                padded_images = self.pad_images(group, avg_aspect_ratio)
-                self.resize_and_save_images(padded_images, group_index, group)
-            else:
-                cropped_images = self.crop_images(group, avg_aspect_ratio)
-                self.resize_and_save_images(cropped_images, group_index, group)
-            if not self.do_not_copy_other_files:
-                self.copy_other_files(group, group_index)
-
     def get_aspect_ratios(self, group):
-        aspect_ratios = []
-        for path in group:
-            with Image.open(path) as img:
-                width, height = img.size
-                aspect_ratios.append(width / height)
-        return aspect_ratios
+        missing = [path for path in group if path not in self.aspect_ratios]
+        if missing:
+            self.aspect_ratios.update(get_aspect_ratios(missing))
+        return [self.aspect_ratios[path] for path in group]
 
     def crop_images(self, group, avg_aspect_ratio):
         cropped_images = []
@@ -90,17 +104,19 @@ class ImageProcessor:
         max_width = max(img.width for img in cropped_images)
         max_height = max(img.height for img in cropped_images)
         for j, img in enumerate(cropped_images):
-            img = img.resize((max_width, max_height))
-            os.makedirs(self.output_folder, exist_ok=True)
-            original_filename = os.path.basename(source_paths[j])
-            filename_without_ext = os.path.splitext(original_filename)[0]
-            final_file_name = f"group-{group_index+1}-{j+1}-{filename_without_ext}"
-            output_path = os.path.join(self.output_folder, f"{final_file_name}.jpg")
-            log.info(f"  Saving processed image to {output_path}")
-            img.convert('RGB').save(output_path, quality=70)
-            
-            if self.caption:
-                self.create_caption_file(source_paths[j], group_index, final_file_name)
+            self.save_image(img.resize((max_width, max_height)), group_index, j, source_paths[j])
+
+    def save_image(self, img, group_index, j, source_path):
+        os.makedirs(self.output_folder, exist_ok=True)
+        original_filename = os.path.basename(source_path)
+        filename_without_ext = os.path.splitext(original_filename)[0]
+        final_file_name = f"group-{group_index+1}-{j+1}-{filename_without_ext}"
+        output_path = os.path.join(self.output_folder, f"{final_file_name}.jpg")
+        log.info(f"  Saving processed image to {output_path}")
+        img.convert('RGB').save(output_path, quality=70)
+
+        if self.caption:
+            self.create_caption_file(source_path, group_index, final_file_name)
 
     def create_caption_file(self, source_path, group_index, caption_filename):
         dirpath = os.path.dirname(source_path)
@@ -115,20 +131,69 @@ class ImageProcessor:
         for j, path in enumerate(group):
             dirpath, original_filename = os.path.split(path)
             original_basename, original_ext = os.path.splitext(original_filename)
-            for filename in os.listdir(dirpath):
+            for filename in self.get_related_files(dirpath).get(original_basename, []):
                 if filename.endswith('.npz'):  # Skip .npz
                     continue
                 basename, ext = os.path.splitext(filename)
-                if basename == original_basename and ext != original_ext:
+                if ext != original_ext:
                     shutil.copy2(os.path.join(dirpath, filename), os.path.join(self.output_folder, f"group-{group_index+1}-{j+1}-{filename}"))
 
+    def get_related_files(self, dirpath):
+        # list every folder once instead of once per image
+        if dirpath not in self.related_files:
+            related_files = defaultdict(list)
+            for filename in os.listdir(dirpath):
+                related_files[os.path.splitext(filename)[0]].append(filename)
+            self.related_files[dirpath] = related_files
+        return self.related_files[dirpath]
+
     def process_images(self):
         images = self.get_image_paths()
-        groups = self.group_images(images)
-        for i, group in enumerate(groups):
-            log.info(f"Processing group {i+1} with {len(group)} images...")
-            self.process_group(group, i)
-            
+        sorted_images, widths, heights = self.load_sorted_images(images)
+        bounds = self.group_bounds(widths, heights)
+        group_sizes = np.diff(bounds)
+        avg_aspect_ratios = group_means(widths / heights, bounds)
+        targets = np.repeat(avg_aspect_ratios, group_sizes)
+
+        # size of every image after cropping or padding, and the size every group is resized to
+        if self.pad:
+            boxes = self.pad_borders(widths, heights, targets)
+            new_widths = widths + 2 * boxes[:, 0]
+            new_heights = heights + 2 * boxes[:, 1]
+        else:
+            boxes = center_crop_boxes(widths, heights, targets, integer=False)
+            new_widths = np.round(boxes[:, 2]) - np.round(boxes[:, 0])
+            new_heights = np.round(boxes[:, 3]) - np.round(boxes[:, 1])
+        output_widths = np.maximum.reduceat(new_widths, bounds[:-1]).astype(np.int64) if len(sorted_images) else []
+        output_heights = np.maximum.reduceat(new_heights, bounds[:-1]).astype(np.int64) if len(sorted_images) else []
+        os.makedirs(self.output_folder, exist_ok=True)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for i, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+                group = sorted_images[start:end]
+                log.info(f"Processing group {i+1} with {len(group)} images...")
+                output_size = (int(output_widths[i]), int(output_heights[i]))
+                futures = [
+                    pool.submit(self.process_image, path, i, j, tuple(boxes[start + j].tolist()), avg_aspect_ratios[i], output_size)
+                    for j, path in enumerate(group)
+                ]
+                for future in futures:
+                    future.result()
+                if not self.do_not_copy_other_files:
+                    self.copy_other_files(group, i)
+
+    def process_image(self, path, group_index, j, box, avg_aspect_ratio, output_size):
+        with Image.open(path) as img:
+            log.info(f"  Processing image {j+1}: {path}")
+            if img.size != self.image_sizes[path]:
+                # the header did not match the decoded image, fall back to computing the box from the image
+                img = self.pad_image(img, avg_aspect_ratio) if self.pad else self.crop_image(img, avg_aspect_ratio)
+            elif self.pad:
+                img = ImageOps.expand(img, border=box, fill='black')
+            else:
+                img = img.crop(box)
+            self.save_image(img.resize(output_size), group_index, j, path)
+
     def process_group(self, group, group_index):
         if len(group) > 0:
             aspect_ratios = self.get_aspect_ratios(group)
@@ -151,6 +216,15 @@ class ImageProcessor:
                 padded_images.append(img)
         return padded_images
 
+    def pad_borders(self, widths, heights, targets):
+        # (left/right, top/bottom) border of every image, the vectorized form of pad_image
+        widths = np.asarray(widths, dtype=np.float64)
+        heights = np.asarray(heights, dtype=np.float64)
+        too_tall = widths / heights < targets
+        pad_widths = np.where(too_tall, np.trunc((targets * heights - widths) / 2), 0)
+        pad_heights = np.where(too_tall, 0, np.trunc((widths / targets - heights) / 2))
+        return np.stack([pad_widths, pad_heights], axis=1).astype(np.int64)
+
     def pad_image(self, img, avg_aspect_ratio):
         img_aspect_ratio = img.width / img.height
         if img_aspect_ratio < avg_aspect_ratio:
@@ -175,10 +249,15 @@ def main():
     parser.add_argument('--pad', action='store_true', help='Pad images instead of cropping them')
     parser.add_argument('--caption', action='store_true', help='Create a caption file for each image')
     parser.add_argument('--caption_ext', type=str, default='.txt', help='Extension for the caption file')
+    parser.add_argument('--bucketing', choices=['fixed', 'optimal'], default='fixed', help='fixed: consecutive groups of group_size images; optimal: --num_buckets groups (multiples of group_size) chosen to minimize the total cropped area')
+    parser.add_argument('--num_buckets', type=int, default=None, help='Number of groups for --bucketing optimal')
+    parser.add_argument('--workers', type=int, default=None, help='Number of images processed in parallel')
 
     args = parser.parse_args()
+    if args.bucketing == 'optimal' and (args.num_buckets is None or args.num_buckets <= 0):
+        parser.error('--bucketing optimal requires a positive --num_buckets')
 
-    processor = ImageProcessor(args.input_folder, args.output_folder, args.group_size, args.include_subfolders, args.do_not_copy_other_files, args.pad, args.caption, args.caption_ext)
+    processor = ImageProcessor(args.input_folder, args.output_folder, args.group_size, args.include_subfolders, args.do_not_copy_other_files, args.pad, args.caption, args.caption_ext, args.bucketing, args.num_buckets, args.workers)
     processor.process_images()
 
 if __name__ == "__main__":
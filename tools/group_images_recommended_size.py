@@ -1,8 +1,58 @@
 import argparse
-from PIL import Image
 import os
 import numpy as np
-import itertools
+
+from aspect_buckets import bucket_losses
+from image_size import get_image_sizes
+
+
+def best_grouping(sorted_ratios, group_size, n_remove):
+    """
+    Chooses n_remove images to leave out so that the others, split into consecutive groups of group_size
+    images, lose the least area when each group is cropped to its mean aspect ratio.
+
+    Dynamic program over the sorted aspect ratios: cost[i, d] is the minimal loss of the first i images with d
+    of them left out, an image is either left out or ends a group of the group_size images before it. Runs in
+    O(n * n_remove) time.
+
+    Args:
+        sorted_ratios: Aspect ratios sorted ascending.
+        group_size: Number of images per group.
+        n_remove: Number of images to leave out, at most len(sorted_ratios) - group_size.
+
+    Returns:
+        tuple: (list of group start indices, list of removed indices, total loss as the sum of the per-image
+            crop loss fractions)
+    """
+    sorted_ratios = np.asarray(sorted_ratios, dtype=np.float64)
+    n = len(sorted_ratios)
+    if group_size <= 0 or n_remove < 0 or (n - n_remove) % group_size != 0:
+        raise ValueError("n - n_remove must be a multiple of group_size")
+    window_starts = np.arange(max(n - group_size + 1, 0))
+    window_losses = bucket_losses(sorted_ratios, window_starts, window_starts + group_size)
+
+    cost = np.full((n + 1, n_remove + 1), np.inf)
+    cost[0, 0] = 0.0
+    removed = np.zeros((n + 1, n_remove + 1), dtype=bool)  # whether image i - 1 is left out in the best solution
+    for i in range(1, n + 1):
+        if i >= group_size:
+            cost[i] = cost[i - group_size] + window_losses[i - group_size]
+        if n_remove:
+            skip = cost[i - 1, :-1]
+            better = skip < cost[i, 1:]
+            cost[i, 1:][better] = skip[better]
+            removed[i, 1:] = better
+
+    group_starts, removed_indices = [], []
+    i, d = n, n_remove
+    while i > 0:
+        if removed[i, d]:
+            removed_indices.append(i - 1)
+            i, d = i - 1, d - 1
+        else:
+            group_starts.append(i - group_size)
+            i -= group_size
+    return group_starts[::-1], removed_indices[::-1], float(cost[n, n_remove])
 
 class ImageProcessor:
 
@@ -13,7 +63,7 @@ class ImageProcessor:
         self.include_subfolders = include_subfolders
         self.pad = pad
         self.image_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
-        self.losses = []  # List to store loss values for each image
+        self.image_sizes = {}  # path -> (width, height), read from the image headers
 
     def get_image_paths(self):
         images = []
@@ -26,77 +76,60 @@ class ImageProcessor:
             images = [os.path.join(self.input_folder, f) for f in os.listdir(self.input_folder) if f.endswith(self.image_extensions)]
         return images
 
+    def load_image_sizes(self, images):
+        missing = [path for path in images if path not in self.image_sizes]
+        if missing:
+            self.image_sizes.update(get_image_sizes(missing))
+
     def group_images(self, images, group_size):
-        sorted_images = sorted(images, key=lambda path: Image.open(path).size[0] / Image.open(path).size[1])
+        self.load_image_sizes(images)
+        sorted_images = sorted(images, key=lambda path: self.image_sizes[path][0] / self.image_sizes[path][1])
         groups = [sorted_images[i:i+group_size] for i in range(0, len(sorted_images), group_size)]
         return groups
 
-    def process_group(self, group):
-        if len(group) > 0:
-            aspect_ratios = self.get_aspect_ratios(group)
-            avg_aspect_ratio = np.mean(aspect_ratios)
-            self.calculate_losses(group, avg_aspect_ratio)
-
     def get_aspect_ratios(self, group):
-        aspect_ratios = []
-        for path in group:
-            with Image.open(path) as img:
-                width, height = img.size
-                aspect_ratios.append(width / height)
-        return aspect_ratios
-
-    def calculate_losses(self, group, avg_aspect_ratio):
-        for j, path in enumerate(group):
-            with Image.open(path) as img:
-                loss = self.calculate_loss(img, avg_aspect_ratio)
-                self.losses.append((path, loss))  # Add (path, loss) tuple to the list
-
-    def calculate_loss(self, img, avg_aspect_ratio):
-        img_aspect_ratio = img.width / img.height
+        self.load_image_sizes(group)
+        return [self.image_sizes[path][0] / self.image_sizes[path][1] for path in group]
+
+    def calculate_loss(self, size, avg_aspect_ratio):
+        width, height = size
+        img_aspect_ratio = width / height
         if img_aspect_ratio > avg_aspect_ratio:
             # Too wide, reduce width
-            new_width = avg_aspect_ratio * img.height
-            loss = abs(img.width - new_width) / img.width  # Calculate loss value
+            new_width = avg_aspect_ratio * height
+            loss = abs(width - new_width) / width  # Calculate loss value
         else:
             # Too tall, reduce height
-            new_height = img.width / avg_aspect_ratio
-            loss = abs(img.height - new_height) / img.height  # Calculate loss value
+            new_height = width / avg_aspect_ratio
+            loss = abs(height - new_height) / height  # Calculate loss value
         return loss
 
-    def monte_carlo_optimization(self, groups):
-        best_groups = groups.copy()
-        best_loss = np.inf
-        best_removed_images = []
-
-        for group in groups:
-            num_images = len(group)
-            all_combinations = []
-            # Generate all possible combinations of images to remove
-            for r in range(1, num_images + 1):
-                combinations = list(itertools.combinations(group, r))
-                all_combinations.extend(combinations)
-
-            for combination in all_combinations:
-                self.losses = []  # Reset losses for each combination
-                remaining_images = list(set(group) - set(combination))
-                self.process_group(remaining_images)
-                avg_loss = np.mean(self.losses)
-
-                if avg_loss < best_loss:
-                    best_loss = avg_loss
-                    best_groups[best_groups.index(group)] = remaining_images
-                    best_removed_images = combination
-
+    def optimize_groups(self, groups):
+        # groups are consecutive slices of the images sorted by aspect ratio, all but the last one full
+        images = [path for group in groups for path in group]
+        group_size = len(groups[0]) if groups else 0
+        if group_size == 0 or len(images) < group_size:
+            return groups.copy(), np.nan, ()
+        sorted_ratios = self.get_aspect_ratios(images)
+        group_starts, removed_indices, total_loss = best_grouping(sorted_ratios, group_size, len(images) % group_size)
+
+        best_groups = [images[start:start + group_size] for start in group_starts]
+        best_removed_images = tuple(images[i] for i in removed_indices)
+        best_loss = total_loss / (len(images) - len(removed_indices))
         return best_groups, best_loss, best_removed_images
 
     def process_images(self):
         images = self.get_image_paths()
+        self.load_image_sizes(images)
+        for path in [path for path in images if self.image_sizes[path] is None]:
+            print(f"Skipping unreadable image {path}")
+            images.remove(path)
         num_images = len(images)
         results = []
 
         for group_size in range(self.min_group, self.max_group + 1):
             groups = self.group_images(images, group_size)
-            optimized_groups, avg_loss, removed_images = self.monte_carlo_optimization(groups)
+            optimized_groups, avg_loss, removed_images = self.optimize_groups(groups)
             num_remaining = num_images % group_size
 
             results.append((group_size, avg_loss, num_remaining, optimized_groups, removed_images))
@@ -0,0 +1,168 @@
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+# Fast image dimension probe shared by the grouping/cropping tools.
+#
+# PNG, GIF, WebP and JPEG sizes are read straight from the file header (a few hundred bytes at most, the JPEG
+# parser only skips segment lengths until the first SOF marker), so no pixel data is ever decoded. Anything
+# the parsers do not recognise falls back to PIL, imported on first use. Results are memoized per
+# (path, mtime, size) and bulk lookups run in a thread pool, which is what matters on slow or network disks.
+
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+def _png_size(f, head: bytes):
+    if head[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", head[16:24])
+
+
+def _gif_size(f, head: bytes):
+    return struct.unpack("<HH", head[6:10])
+
+
+def _webp_size(f, head: bytes):
+    chunk = head[12:16]
+    if chunk == b"VP8 " and head[23:26] == b"\x9d\x01\x2a":
+        width, height = struct.unpack("<HH", head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and head[20] == 0x2F:
+        bits = int.from_bytes(head[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        return int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+    return None
+
+
+def _exif_orientation(segment: bytes) -> int:
+    # segment is an APP1 payload starting with b"Exif\0\0" followed by a TIFF header
+    tiff = segment[6:]
+    if len(tiff) < 8:
+        return 1
+    endian = {b"II": "<", b"MM": ">"}.get(tiff[:2])
+    if endian is None:
+        return 1
+    ifd_offset = struct.unpack(endian + "I", tiff[4:8])[0]
+    if ifd_offset + 2 > len(tiff):
+        return 1
+    count = struct.unpack(endian + "H", tiff[ifd_offset:ifd_offset + 2])[0]
+    for i in range(count):
+        entry = ifd_offset + 2 + i * 12
+        if entry + 12 > len(tiff):
+            break
+        tag, _, _ = struct.unpack(endian + "HHI", tiff[entry:entry + 8])
+        if tag == EXIF_ORIENTATION_TAG:
+            return struct.unpack(endian + "H", tiff[entry + 8:entry + 10])[0]
+    return 1
+
+
+def _jpeg_size(f, head: bytes, exif_transpose: bool = False):
+    f.seek(2)
+    orientation = 1
+    while True:
+        byte = f.read(1)
+        while byte and byte != b"\xff":
+            byte = f.read(1)
+        while byte == b"\xff":  # markers may be padded with fill bytes
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            continue  # standalone markers carry no length
+        if marker == 0xD9:
+            return None
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack(">H", length_bytes)[0]
+        if marker in JPEG_SOF_MARKERS:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack(">HH", data[1:5])
+            if exif_transpose and orientation in (5, 6, 7, 8):
+                width, height = height, width
+            return width, height
+        if exif_transpose and marker == 0xE1:
+            segment = f.read(length - 2)
+            if segment.startswith(b"Exif\x00\x00"):
+                orientation = _exif_orientation(segment)
+            continue
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def _pil_size(path: str, exif_transpose: bool):
+    from PIL import Image
+
+    with Image.open(path) as img:
+        width, height = img.size
+        if exif_transpose and img.getexif().get(EXIF_ORIENTATION_TAG, 1) in (5, 6, 7, 8):
+            width, height = height, width
+        return width, height
+
+
+def _read_header_size(path: str, exif_transpose: bool):
+    with open(path, "rb") as f:
+        head = f.read(32)
+        if head.startswith(b"\x89PNG\r\n\x1a\n"):
+            return _png_size(f, head)
+        if head[:6] in (b"GIF87a", b"GIF89a"):
+            return _gif_size(f, head)
+        if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+            return _webp_size(f, head)
+        if head[:2] == b"\xff\xd8":
+            return _jpeg_size(f, head, exif_transpose)
+    return None
+
+
+@lru_cache(maxsize=1 << 16)
+def _cached_size(path: str, mtime_ns: int, file_size: int, exif_transpose: bool):
+    # mtime_ns and file_size only take part in the cache key
+    try:
+        size = _read_header_size(path, exif_transpose)
+    except (OSError, struct.error, IndexError):
+        size = None
+    if size is None or 0 in size:
+        try:
+            size = _pil_size(path, exif_transpose)
+        except Exception:
+            return None
+    return size
+
+
+def get_image_size(path: str, exif_transpose: bool = False):
+    """
+    Returns (width, height) of an image without decoding it, or None if it cannot be read.
+    With exif_transpose, width and height are swapped for EXIF-rotated JPEGs (what cv2.imread returns).
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return _cached_size(os.path.abspath(path), stat.st_mtime_ns, stat.st_size, exif_transpose)
+
+
+def get_image_sizes(paths, max_workers: int = 16, exif_transpose: bool = False) -> dict:
+    """
+    Returns {path: (width, height) or None} for all paths, probed in a thread pool.
+    """
+    paths = list(paths)
+    if len(paths) <= 1 or max_workers <= 1:
+        return {path: get_image_size(path, exif_transpose) for path in paths}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        sizes = pool.map(lambda path: get_image_size(path, exif_transpose), paths)
+        return dict(zip(paths, sizes))
+
+
+def get_aspect_ratios(paths, max_workers: int = 16, exif_transpose: bool = False) -> dict:
+    """
+    Returns {path: width / height or None} for all paths.
+    """
+    return {
+        path: (size[0] / size[1] if size else None)
+        for path, size in get_image_sizes(paths, max_workers, exif_transpose).items()
+    }
@@ -0,0 +1,150 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+# Parallel image transcoding shared by the convert_images_* tools.
+#
+# Images are decoded and re-encoded in a process pool sized to the CPU count. Only a bounded number of jobs is
+# in flight at a time, so a folder with hundreds of thousands of images does not queue all of them (and their
+# results) in memory at once. An output is considered up to date, and skipped, when it is non-empty and not older
+# than its source. Outputs are written to a temporary file first and renamed into place, so an interrupted run
+# never leaves a truncated image behind.
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif", ".tiff", ".tif")
+
+
+def find_images(directory, in_ext=None, recursive: bool = False) -> list:
+    """
+    Returns the images in directory, optionally only those with extension in_ext (with or without dot).
+    """
+    if in_ext:
+        extensions = ("." + in_ext.lstrip(".").lower(),)
+    else:
+        extensions = IMAGE_EXTENSIONS
+    if recursive:
+        files = [
+            os.path.join(root, file)
+            for root, _, names in os.walk(directory)
+            for file in names
+            if file.lower().endswith(extensions)
+        ]
+    else:
+        files = [
+            os.path.join(directory, file)
+            for file in os.listdir(directory)
+            if file.lower().endswith(extensions) and os.path.isfile(os.path.join(directory, file))
+        ]
+    return sorted(files)
+
+
+def is_up_to_date(src: str, dst: str) -> bool:
+    try:
+        src_stat = os.stat(src)
+        dst_stat = os.stat(dst)
+    except OSError:
+        return False
+    return dst_stat.st_size > 0 and dst_stat.st_mtime_ns >= src_stat.st_mtime_ns
+
+
+def transcode_one(src: str, dst: str, save_kwargs: dict, mode=None, delete_original: bool = False) -> tuple:
+    # Runs in a pool worker; returns (src, status, input bytes, output bytes, error)
+    from PIL import Image
+
+    try:
+        input_bytes = os.path.getsize(src)
+        with Image.open(src) as img:
+            if mode is not None and img.mode != mode:
+                img = img.convert(mode)
+            tmp_path = f"{dst}.{os.getpid()}.part"
+            try:
+                img.save(tmp_path, **save_kwargs)  # save_kwargs names the format, tmp_path has no known suffix
+                os.replace(tmp_path, dst)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        if delete_original and os.path.abspath(src) != os.path.abspath(dst):
+            os.remove(src)
+        return src, "converted", input_bytes, os.path.getsize(dst), None
+    except Exception as e:
+        return src, "error", 0, 0, str(e)
+
+
+def transcode_images(jobs, save_kwargs: dict, mode=None, delete_originals: bool = False, workers: int = None, max_in_flight: int = None, verbose: bool = True) -> dict:
+    """
+    Converts every (src, dst) pair of jobs in a process pool and prints a throughput summary.
+
+    Args:
+        jobs: Iterable of (source path, output path).
+        save_kwargs: Keyword arguments for PIL's Image.save, "format" selects the output format.
+        mode: PIL mode to convert to before saving (e.g. "RGB" for JPEG), None to keep the source mode.
+        delete_originals: Delete each source after its output was written.
+        workers: Number of worker processes, defaults to the CPU count.
+        max_in_flight: Maximum number of queued or running conversions, defaults to 4 per worker.
+
+    Returns:
+        dict with "converted", "skipped" and "errors" counts, "elapsed" seconds and input/output byte totals.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 4
+    stats = {"converted": 0, "skipped": 0, "errors": 0, "input_bytes": 0, "output_bytes": 0}
+    start = time.perf_counter()
+
+    def collect(future):
+        src, status, input_bytes, output_bytes, error = future.result()
+        if status == "error":
+            stats["errors"] += 1
+            print(f"Error processing {src}: {error}")
+            return
+        stats["converted"] += 1
+        stats["input_bytes"] += input_bytes
+        stats["output_bytes"] += output_bytes
+        if verbose:
+            print(f"Converted {src}")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = set()
+        for src, dst in jobs:
+            if os.path.abspath(src) == os.path.abspath(dst) or is_up_to_date(src, dst):
+                stats["skipped"] += 1
+                if verbose:
+                    print(f"Skipping {src} because {dst} already exists")
+                continue
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+            in_flight.add(pool.submit(transcode_one, src, dst, save_kwargs, mode, delete_originals))
+        for future in wait(in_flight).done:
+            collect(future)
+
+    stats["elapsed"] = time.perf_counter() - start
+    print(format_transcode_stats(stats, workers))
+    return stats
+
+
+def format_transcode_stats(stats: dict, workers: int) -> str:
+    elapsed = max(stats["elapsed"], 1e-9)
+    return (
+        f"{stats['converted']} converted, {stats['skipped']} skipped, {stats['errors']} errors in {stats['elapsed']:.1f}s "
+        f"with {workers} workers ({stats['converted'] / elapsed:.1f} images/s, "
+        f"{stats['input_bytes'] / 1024 ** 2 / elapsed:.1f} MiB/s read, "
+        f"{stats['input_bytes'] / 1024 ** 2:.1f} MiB -> {stats['output_bytes'] / 1024 ** 2:.1f} MiB)"
+    )
+
+
+def output_path(src: str, out_ext: str) -> str:
+    return str(Path(src).with_suffix("." + out_ext.lstrip(".")))
+
+
+def add_transcode_arguments(parser):
+    parser.add_argument("--delete_originals", action="store_true",
+                        help="whether to delete the original files after conversion")
+    parser.add_argument("--recursive", action="store_true",
+                        help="also convert images in subdirectories")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: number of CPU cores)")
+    parser.add_argument("--max_in_flight", type=int, default=None,
+                        help="maximum number of images queued or being converted at once (default: 4 per worker)")
+    parser.add_argument("--quiet", action="store_true",
+                        help="only print errors and the final summary")
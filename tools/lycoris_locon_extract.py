@@ -3,6 +3,8 @@ import os, sys
 sys.path.insert(0, os.getcwd())
 import argparse
 
+from svd_cache import add_svd_cache_arguments, svd_cache_from_args
+
 
 def get_args():
     parser = argparse.ArgumentParser()
@@ -111,34 +113,54 @@ def get_args():
     parser.add_argument(
         "--sparsity", help="sparsity for sparse bias", default=0.98, type=float
     )
+    parser.add_argument(
+        "--sparse_method",
+        help=(
+            'how the sparse bias threshold is found when extracting directly from .safetensors files: '
+            '"exact" or "histogram" (approximate, never keeps fewer elements)'
+        ),
+        default="exact",
+        choices=["exact", "histogram"],
+        type=str,
+    )
     parser.add_argument(
         "--disable_cp",
         help="don't use cp decomposition",
         default=False,
         action="store_true",
     )
+    parser.add_argument(
+        "--workers",
+        help="number of layers decomposed in parallel when extracting directly from .safetensors files",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--load_models",
+        help=(
+            "always build the text encoder/UNet modules to extract from. "
+            "By default two .safetensors checkpoints are read directly, layer by layer"
+        ),
+        default=False,
+        action="store_true",
+    )
+    add_svd_cache_arguments(parser)
     return parser.parse_args()
 
 
 ARGS = get_args()
 
 
-from lycoris.utils import extract_diff
-from library.model_util import load_models_from_stable_diffusion_checkpoint
-from library.sdxl_model_util import load_models_from_sdxl_checkpoint
-
 import torch
 from safetensors.torch import save_file
 
 
+def is_safetensors(path):
+    return os.path.splitext(path)[1].lower() == ".safetensors"
+
+
 def main():
     args = ARGS
-    if args.is_sdxl:
-        base = load_models_from_sdxl_checkpoint(None, args.base_model, "cpu")
-        db = load_models_from_sdxl_checkpoint(None, args.db_model, "cpu")
-    else:
-        base = load_models_from_stable_diffusion_checkpoint(args.is_v2, args.base_model)
-        db = load_models_from_stable_diffusion_checkpoint(args.is_v2, args.db_model)
 
     linear_mode_param = {
         "fixed": args.linear_dim,
@@ -155,6 +177,44 @@ def main():
         "full": None,
     }[args.mode]
 
+    if not args.load_models and is_safetensors(args.base_model) and is_safetensors(args.db_model):
+        # no model construction: both files are memory-mapped and the changed layers are read one at a time
+        from lycoris_utils import extract_diff as extract_checkpoint_diff
+
+        svd_cache = svd_cache_from_args(args)
+        state_dict = extract_checkpoint_diff(
+            args.base_model,
+            args.db_model,
+            args.mode,
+            linear_mode_param,
+            conv_mode_param,
+            args.device,
+            args.use_sparse_bias,
+            args.sparsity,
+            not args.disable_cp,
+            svd_cache=svd_cache,
+            sparse_method=args.sparse_method,
+            workers=args.workers,
+        )
+        if svd_cache is not None:
+            print(svd_cache.summary())
+        save_state_dict(state_dict, args)
+        return
+
+    if args.svd_cache_dir:
+        print("--svd_cache_dir is only used when extracting directly from two .safetensors files, ignoring it")
+
+    from lycoris.utils import extract_diff
+    from library.model_util import load_models_from_stable_diffusion_checkpoint
+    from library.sdxl_model_util import load_models_from_sdxl_checkpoint
+
+    if args.is_sdxl:
+        base = load_models_from_sdxl_checkpoint(None, args.base_model, "cpu")
+        db = load_models_from_sdxl_checkpoint(None, args.db_model, "cpu")
+    else:
+        base = load_models_from_stable_diffusion_checkpoint(args.is_v2, args.base_model)
+        db = load_models_from_stable_diffusion_checkpoint(args.is_v2, args.db_model)
+
     if args.is_sdxl:
         db_tes = [db[0], db[1]]
         db_unet = db[3]
@@ -179,7 +239,10 @@ def main():
         args.sparsity,
         not args.disable_cp,
     )
+    save_state_dict(state_dict, args)
+
 
+def save_state_dict(state_dict, args):
     if args.safetensors:
         save_file(state_dict, args.output_name)
     else:
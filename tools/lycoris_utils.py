@@ -1,3 +1,7 @@
+import math
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import *
 
 import numpy as np
@@ -10,6 +14,8 @@ import torch.linalg as linalg
 
 from tqdm import tqdm
 
+from checkpoint_index import MappedSafetensors, checkpoint_shapes, load_layer, lora_layer_map, safetensors_header
+
 
 def make_sparse(t: torch.Tensor, sparsity=0.95):
     abs_t = torch.abs(t)
@@ -19,17 +25,104 @@ def make_sparse(t: torch.Tensor, sparsity=0.95):
     return sparse_t
 
 
+def _quantile_candidates(flat: torch.Tensor, sparsity, lower, samples=65536, margin=0.01):
+    # The elements that can be the lower-th smallest or above, located with a strided sample, and the number of
+    # smaller elements left out; selecting among them only touches a few percent of a large tensor. Falls back to
+    # all elements when the sample's estimate turns out too high.
+    n = flat.numel()
+    if n <= 4 * samples:
+        return flat, 0
+    sample = flat[::n // samples].float()
+    estimate = torch.quantile(sample, max(float(sparsity) - margin, 0.0))
+    candidates = flat[flat >= estimate.to(flat.dtype)]
+    skipped = n - candidates.numel()
+    if skipped > lower:
+        return flat, 0
+    return candidates, skipped
+
+
+def sparse_threshold(abs_t: torch.Tensor, sparsity=0.95, method='exact', bins=4096, passes=2, overwrite_input=False):
+    # Magnitude threshold of make_sparse: elements with abs >= threshold are kept.
+    # 'exact' gives the value np.quantile (linear interpolation) gives, from the two order statistics it
+    # interpolates between. They are selected among the candidates of _quantile_candidates with NumPy's in-place
+    # introselect on CPU (measurably faster there than torch.kthvalue) and torch.kthvalue elsewhere;
+    # overwrite_input lets the fallback over all elements reorder abs_t instead of copying it.
+    # 'histogram' narrows the quantile down with `passes` histograms of `bins` bins each and returns the lower
+    # edge of the final bin, so it never keeps fewer elements than the exact threshold and is at most
+    # max(abs_t) / bins ** passes too low.
+    flat = abs_t.detach().reshape(-1)
+    n = flat.numel()
+    if n == 0:
+        return 0.0
+    virtual_index = (n - 1) * np.float64(sparsity)
+    lower = int(np.floor(virtual_index))
+    upper = min(lower + 1, n - 1)
+    if method == 'exact':
+        candidates, skipped = _quantile_candidates(flat, sparsity, lower)
+        if flat.device.type == 'cpu':
+            values = candidates.numpy() if overwrite_input or candidates is not flat else candidates.numpy().copy()
+            values.partition([lower - skipped, upper - skipped])
+            a, b = values[lower - skipped], values[upper - skipped]
+        else:
+            a = torch.kthvalue(candidates, lower - skipped + 1).values.cpu().numpy()
+            b = torch.kthvalue(candidates, upper - skipped + 1).values.cpu().numpy()
+        # same rounding as NumPy's interpolation
+        gamma = virtual_index - lower
+        diff = b - a
+        return float(a + diff * gamma if gamma < 0.5 else b - diff * (1 - gamma))
+    elif method == 'histogram':
+        low, high = 0.0, float(flat.max())
+        below = 0  # elements smaller than low
+        for _ in range(passes):
+            if high <= low:
+                break
+            counts = torch.histc(flat.float(), bins=bins, min=low, max=high)
+            cumulative = counts.cumsum(0) + below
+            index = min(int(torch.searchsorted(cumulative, torch.tensor(float(lower + 1), device=cumulative.device))), bins - 1)
+            if index > 0:
+                below = int(cumulative[index - 1])
+            width = (high - low) / bins
+            low, high = low + index * width, low + (index + 1) * width
+        return low
+    else:
+        raise NotImplementedError('Sparsity method should be "exact" or "histogram"')
+
+
+def sparse_residual(t: torch.Tensor, sparsity=0.95, method='exact', bins=4096):
+    # COO (indices [t.dim(), nnz], values) of make_sparse(t, sparsity).to_sparse().coalesce(), built straight from
+    # a boolean mask instead of a masked dense copy and a sparse conversion. Indices are in row-major order, as
+    # coalesce() leaves them.
+    t = t.detach()
+    threshold = sparse_threshold(t.abs(), sparsity, method, bins, overwrite_input=True)
+    keep = t >= threshold
+    keep |= t <= -threshold
+    keep &= t != 0  # to_sparse() drops exact zeros too
+    return keep.nonzero().T, t[keep]
+
+
+def cached_svd(matrix: torch.Tensor, svd_cache = None, layer_name = None, min_rank = 0):
+    # svd_cache is an optional svd_cache.SVDCache; the returned U/Vh may then be truncated
+    # to the cached rank, which is at least min_rank.
+    if svd_cache is None or layer_name is None:
+        return linalg.svd(matrix)
+    return svd_cache.svd(layer_name, matrix, min_rank=min_rank)
+
+
 def extract_conv(
     weight: Union[torch.Tensor, nn.Parameter],
     mode = 'fixed',
     mode_param = 0,
     device = 'cpu',
     is_cp = False,
+    svd_cache = None,
+    layer_name = None,
 ) -> Tuple[nn.Parameter, nn.Parameter]:
     weight = weight.to(device)
     out_ch, in_ch, kernel_size, _ = weight.shape
+    if mode=='full':
+        return weight, 'full'
     
-    U, S, Vh = linalg.svd(weight.reshape(out_ch, -1))
+    U, S, Vh = cached_svd(weight.reshape(out_ch, -1), svd_cache, layer_name)
     
     if mode=='fixed':
         lora_rank = mode_param
@@ -51,6 +144,8 @@ def extract_conv(
     lora_rank = min(out_ch, in_ch, lora_rank)
     if lora_rank>=out_ch/2 and not is_cp:
         return weight, 'full'
+    if lora_rank > U.shape[1]:
+        U, S, Vh = cached_svd(weight.reshape(out_ch, -1), svd_cache, layer_name, int(lora_rank))
     
     U = U[:, :lora_rank]
     S = S[:lora_rank]
@@ -69,11 +164,15 @@ def extract_linear(
     mode = 'fixed',
     mode_param = 0,
     device = 'cpu',
+    svd_cache = None,
+    layer_name = None,
 ) -> Tuple[nn.Parameter, nn.Parameter]:
     weight = weight.to(device)
     out_ch, in_ch = weight.shape
+    if mode=='full':
+        return weight, 'full'
     
-    U, S, Vh = linalg.svd(weight)
+    U, S, Vh = cached_svd(weight, svd_cache, layer_name)
     
     if mode=='fixed':
         lora_rank = mode_param
@@ -95,6 +194,8 @@ def extract_linear(
     lora_rank = min(out_ch, in_ch, lora_rank)
     if lora_rank>=out_ch/2:
         return weight, 'full'
+    if lora_rank > U.shape[1]:
+        U, S, Vh = cached_svd(weight, svd_cache, layer_name, int(lora_rank))
     
     U = U[:, :lora_rank]
     S = S[:lora_rank]
@@ -108,6 +209,167 @@ def extract_linear(
     return (extract_weight_A, extract_weight_B, diff), 'low rank'
 
 
+UNET_TARGET_REPLACE_MODULE = [
+    "Transformer2DModel",
+    "Attention",
+    "ResnetBlock2D",
+    "Downsample2D",
+    "Upsample2D"
+]
+UNET_TARGET_REPLACE_NAME = [
+    "conv_in",
+    "conv_out",
+    "time_embedding.linear_1",
+    "time_embedding.linear_2",
+]
+TEXT_ENCODER_TARGET_REPLACE_MODULE = ["CLIPAttention", "CLIPMLP"]
+LORA_PREFIX_UNET = 'lora_unet'
+LORA_PREFIX_TEXT_ENCODER = 'lora_te'
+
+
+def module_layers(
+    prefix,
+    root_module: torch.nn.Module,
+    target_replace_modules,
+    target_replace_names = []
+) -> Dict[str, torch.Tensor]:
+    # LoRA name -> weight of every Linear/Conv2d the LyCORIS modules target, from a single walk of the module tree.
+    # Nested targets (an Attention inside a Transformer2DModel) produce the same names and are only listed once.
+    layers = {}
+    for name, module in root_module.named_modules():
+        if module.__class__.__name__ in target_replace_modules:
+            for child_name, child_module in module.named_modules():
+                if child_module.__class__.__name__ in {'Linear', 'Conv2d'}:
+                    lora_name = (prefix + '.' + name + '.' + child_name).replace('.', '_')
+                    layers.setdefault(lora_name, child_module.weight)
+        elif name in target_replace_names and module.__class__.__name__ in {'Linear', 'Conv2d'}:
+            layers.setdefault((prefix + '.' + name).replace('.', '_'), module.weight)
+    return layers
+
+
+def weights_identical(base: torch.Tensor, db: torch.Tensor, samples = 4096) -> bool:
+    # Same answer as torch.allclose(base, db). A strided sample of the elements is compared first, which settles
+    # almost every changed layer after touching a few pages; only layers that pass it are compared in full
+    # (bytewise when the dtypes match, which needs no float conversion).
+    if base.shape != db.shape:
+        return False
+    flat_base = base.detach().reshape(-1)
+    flat_db = db.detach().reshape(-1)
+    if flat_base.numel() > samples:
+        index = torch.linspace(0, flat_base.numel() - 1, samples, device=flat_base.device).long()
+        if not torch.allclose(flat_base[index].float(), flat_db[index.to(flat_db.device)].float().to(flat_base.device)):
+            return False
+    if base.dtype == db.dtype and base.device == db.device and torch.equal(flat_base, flat_db):
+        return True
+    return torch.allclose(flat_base.float(), flat_db.float().to(flat_base.device))
+
+
+def extract_layer(
+    lora_name,
+    delta: torch.Tensor,
+    mode = 'fixed',
+    linear_mode_param = 0,
+    conv_mode_param = 0,
+    extract_device = 'cpu',
+    use_bias = False,
+    sparsity = 0.98,
+    small_conv = True,
+    svd_cache = None,
+    sparse_method = 'exact',
+) -> Dict[str, torch.Tensor]:
+    # LyCORIS tensors of one layer from its weight difference (fine-tuned - base)
+    loras = {}
+    if delta.dim() == 2:
+        weight, decompose_mode = extract_linear(
+            delta,
+            mode,
+            linear_mode_param,
+            device = extract_device,
+            svd_cache = svd_cache,
+            layer_name = lora_name,
+        )
+        if decompose_mode == 'low rank':
+            extract_a, extract_b, diff = weight
+    elif delta.dim() == 4:
+        is_linear = (delta.shape[2] == 1 and delta.shape[3] == 1)
+        weight, decompose_mode = extract_conv(
+            delta,
+            mode,
+            linear_mode_param if is_linear else conv_mode_param,
+            device = extract_device,
+            svd_cache = svd_cache,
+            layer_name = lora_name,
+        )
+        if decompose_mode == 'low rank':
+            extract_a, extract_b, diff = weight
+        if small_conv and not is_linear and decompose_mode == 'low rank':
+            dim = extract_a.size(0)
+            (extract_c, extract_a, _), _ = extract_conv(
+                extract_a.transpose(0, 1),
+                'fixed', dim,
+                extract_device, True
+            )
+            extract_a = extract_a.transpose(0, 1)
+            extract_c = extract_c.transpose(0, 1)
+            loras[f'{lora_name}.lora_mid.weight'] = extract_c.detach().cpu().contiguous().half()
+            # residual of the delta, like every other layer's sparse bias. The module-walk extraction subtracted the
+            # rebuild from the fine-tuned weight itself, so its bias values for CP-decomposed 3x3 convs differ
+            diff = delta.cpu() - torch.einsum(
+                'i j k l, j r, p i -> p r k l',
+                extract_c, extract_a.flatten(1, -1), extract_b.flatten(1, -1)
+            ).detach().cpu().contiguous()
+            del extract_c
+    else:
+        return loras
+    if decompose_mode == 'low rank':
+        loras[f'{lora_name}.lora_down.weight'] = extract_a.detach().cpu().contiguous().half()
+        loras[f'{lora_name}.lora_up.weight'] = extract_b.detach().cpu().contiguous().half()
+        loras[f'{lora_name}.alpha'] = torch.Tensor([extract_a.shape[0]]).half()
+        if use_bias:
+            diff = diff.detach().cpu().reshape(extract_b.size(0), -1)
+            indices, values = sparse_residual(diff, sparsity, sparse_method)
+            indices = indices.to(torch.int16)
+            values = values.half()
+            loras[f'{lora_name}.bias_indices'] = indices
+            loras[f'{lora_name}.bias_values'] = values
+            loras[f'{lora_name}.bias_size'] = torch.tensor(diff.shape).to(torch.int16)
+        del extract_a, extract_b, diff
+    elif decompose_mode == 'full':
+        loras[f'{lora_name}.diff'] = weight.detach().cpu().contiguous().half()
+    else:
+        raise NotImplementedError
+    return loras
+
+
+def _layer_pairs(base_model, db_model):
+    # [(lora name, base weight, fine-tuned weight)]; weights of mapped checkpoints are lazy zero-copy views
+    if isinstance(base_model, (MappedSafetensors, dict)):
+        base_shapes = checkpoint_shapes(base_model)
+        db_shapes = checkpoint_shapes(db_model)
+        pairs = []
+        for lora_name, ref in lora_layer_map(base_shapes).items():
+            if db_shapes.get(ref.key) != base_shapes[ref.key]:
+                print(f'Skipping {lora_name}: {ref.key} is missing or has another shape in the fine-tuned model')
+                continue
+            pairs.append((lora_name, load_layer(base_model, ref), load_layer(db_model, ref)))
+        return pairs
+
+    base_layers = module_layers(
+        LORA_PREFIX_TEXT_ENCODER, base_model[0], TEXT_ENCODER_TARGET_REPLACE_MODULE
+    ) | module_layers(
+        LORA_PREFIX_UNET, base_model[2], UNET_TARGET_REPLACE_MODULE, UNET_TARGET_REPLACE_NAME
+    )
+    db_layers = module_layers(
+        LORA_PREFIX_TEXT_ENCODER, db_model[0], TEXT_ENCODER_TARGET_REPLACE_MODULE
+    ) | module_layers(
+        LORA_PREFIX_UNET, db_model[2], UNET_TARGET_REPLACE_MODULE, UNET_TARGET_REPLACE_NAME
+    )
+    return [
+        (lora_name, weight, db_layers[lora_name])
+        for lora_name, weight in base_layers.items() if lora_name in db_layers
+    ]
+
+
 def extract_diff(
     base_model,
     db_model,
@@ -117,196 +379,64 @@ def extract_diff(
     extract_device = 'cpu',
     use_bias = False,
     sparsity = 0.98,
-    small_conv = True
+    small_conv = True,
+    svd_cache = None,
+    sparse_method = 'exact',
+    workers = 1,
 ):
-    UNET_TARGET_REPLACE_MODULE = [
-        "Transformer2DModel", 
-        "Attention", 
-        "ResnetBlock2D", 
-        "Downsample2D", 
-        "Upsample2D"
-    ]
-    UNET_TARGET_REPLACE_NAME = [
-        "conv_in",
-        "conv_out",
-        "time_embedding.linear_1",
-        "time_embedding.linear_2",
-    ]
-    TEXT_ENCODER_TARGET_REPLACE_MODULE = ["CLIPAttention", "CLIPMLP"]
-    LORA_PREFIX_UNET = 'lora_unet'
-    LORA_PREFIX_TEXT_ENCODER = 'lora_te'
-    def make_state_dict(
-        prefix, 
-        root_module: torch.nn.Module,
-        target_module: torch.nn.Module,
-        target_replace_modules,
-        target_replace_names = []
-    ):
+    # base_model / db_model are either .safetensors paths (memory-mapped, the layers are located through
+    # checkpoint_index.lora_layer_map and only read when needed), state dicts of single-file checkpoints, or
+    # the (text encoder, vae, unet) module tuples of the kohya SD1/SD2 loaders.
+    # Unchanged layers are skipped via weights_identical; the others are decomposed by `workers` threads.
+    opened = []
+    if isinstance(base_model, str):
+        base_model = MappedSafetensors(base_model)
+        opened.append(base_model)
+    if isinstance(db_model, str):
+        db_model = MappedSafetensors(db_model)
+        opened.append(db_model)
+    pairs = []
+    try:
+        pairs = _layer_pairs(base_model, db_model)
+
+        def extract(pair):
+            lora_name, base_weight, db_weight = pair
+            if weights_identical(base_weight, db_weight):
+                return {}
+            with torch.no_grad():
+                delta = db_weight.to(extract_device, torch.float32) - base_weight.to(extract_device, torch.float32)
+                return extract_layer(
+                    lora_name, delta, mode, linear_mode_param, conv_mode_param,
+                    extract_device, use_bias, sparsity, small_conv, svd_cache, sparse_method,
+                )
+
         loras = {}
-        temp = {}
-        temp_name = {}
-        
-        for name, module in root_module.named_modules():
-            if module.__class__.__name__ in target_replace_modules:
-                temp[name] = {}
-                for child_name, child_module in module.named_modules():
-                    if child_module.__class__.__name__ not in {'Linear', 'Conv2d'}:
-                        continue
-                    temp[name][child_name] = child_module.weight
-            elif name in target_replace_names:
-                temp_name[name] = module.weight
-        
-        for name, module in tqdm(list(target_module.named_modules())):
-            if name in temp:
-                weights = temp[name]
-                for child_name, child_module in module.named_modules():
-                    lora_name = prefix + '.' + name + '.' + child_name
-                    lora_name = lora_name.replace('.', '_')
-                    layer = child_module.__class__.__name__
-                    if layer in {'Linear', 'Conv2d'}:
-                        root_weight = child_module.weight
-                        if torch.allclose(root_weight, weights[child_name]):
-                            continue
-                    
-                    if layer == 'Linear':
-                        weight, decompose_mode = extract_linear(
-                            (child_module.weight - weights[child_name]),
-                            mode,
-                            linear_mode_param,
-                            device = extract_device,
-                        )
-                        if decompose_mode == 'low rank':
-                            extract_a, extract_b, diff = weight
-                    elif layer == 'Conv2d':
-                        is_linear = (child_module.weight.shape[2] == 1
-                                     and child_module.weight.shape[3] == 1)
-                        weight, decompose_mode = extract_conv(
-                            (child_module.weight - weights[child_name]), 
-                            mode,
-                            linear_mode_param if is_linear else conv_mode_param,
-                            device = extract_device,
-                        )
-                        if decompose_mode == 'low rank':
-                            extract_a, extract_b, diff = weight
-                        if small_conv and not is_linear and decompose_mode == 'low rank':
-                            dim = extract_a.size(0)
-                            (extract_c, extract_a, _), _ = extract_conv(
-                                extract_a.transpose(0, 1), 
-                                'fixed', dim, 
-                                extract_device, True
-                            )
-                            extract_a = extract_a.transpose(0, 1)
-                            extract_c = extract_c.transpose(0, 1)
-                            loras[f'{lora_name}.lora_mid.weight'] = extract_c.detach().cpu().contiguous().half()
-                            diff = child_module.weight - torch.einsum(
-                                'i j k l, j r, p i -> p r k l', 
-                                extract_c, extract_a.flatten(1, -1), extract_b.flatten(1, -1)
-                            ).detach().cpu().contiguous()
-                            del extract_c
-                    else:
-                        continue
-                    if decompose_mode == 'low rank':
-                        loras[f'{lora_name}.lora_down.weight'] = extract_a.detach().cpu().contiguous().half()
-                        loras[f'{lora_name}.lora_up.weight'] = extract_b.detach().cpu().contiguous().half()
-                        loras[f'{lora_name}.alpha'] = torch.Tensor([extract_a.shape[0]]).half()
-                        if use_bias:
-                            diff = diff.detach().cpu().reshape(extract_b.size(0), -1)
-                            sparse_diff = make_sparse(diff, sparsity).to_sparse().coalesce()
-                            
-                            indices = sparse_diff.indices().to(torch.int16)
-                            values = sparse_diff.values().half()
-                            loras[f'{lora_name}.bias_indices'] = indices
-                            loras[f'{lora_name}.bias_values'] = values
-                            loras[f'{lora_name}.bias_size'] = torch.tensor(diff.shape).to(torch.int16)
-                        del extract_a, extract_b, diff
-                    elif decompose_mode == 'full':
-                        loras[f'{lora_name}.diff'] = weight.detach().cpu().contiguous().half()
-                    else:
-                        raise NotImplementedError
-            elif name in temp_name:
-                weights = temp_name[name]
-                lora_name = prefix + '.' + name
-                lora_name = lora_name.replace('.', '_')
-                layer = module.__class__.__name__
-                
-                if layer in {'Linear', 'Conv2d'}:
-                    root_weight = module.weight
-                    if torch.allclose(root_weight, weights):
-                        continue
-                
-                if layer == 'Linear':
-                    weight, decompose_mode = extract_linear(
-                        (root_weight - weights),
-                        mode,
-                        linear_mode_param,
-                        device = extract_device,
-                    )
-                    if decompose_mode == 'low rank':
-                        extract_a, extract_b, diff = weight
-                elif layer == 'Conv2d':
-                    is_linear = (
-                        root_weight.shape[2] == 1
-                        and root_weight.shape[3] == 1
-                    )
-                    weight, decompose_mode = extract_conv(
-                        (root_weight - weights), 
-                        mode,
-                        linear_mode_param if is_linear else conv_mode_param,
-                        device = extract_device,
-                    )
-                    if decompose_mode == 'low rank':
-                        extract_a, extract_b, diff = weight
-                    if small_conv and not is_linear and decompose_mode == 'low rank':
-                        dim = extract_a.size(0)
-                        (extract_c, extract_a, _), _ = extract_conv(
-                            extract_a.transpose(0, 1), 
-                            'fixed', dim, 
-                            extract_device, True
-                        )
-                        extract_a = extract_a.transpose(0, 1)
-                        extract_c = extract_c.transpose(0, 1)
-                        loras[f'{lora_name}.lora_mid.weight'] = extract_c.detach().cpu().contiguous().half()
-                        diff = root_weight - torch.einsum(
-                            'i j k l, j r, p i -> p r k l', 
-                            extract_c, extract_a.flatten(1, -1), extract_b.flatten(1, -1)
-                        ).detach().cpu().contiguous()
-                        del extract_c
-                else:
-                    continue
-                if decompose_mode == 'low rank':
-                    loras[f'{lora_name}.lora_down.weight'] = extract_a.detach().cpu().contiguous().half()
-                    loras[f'{lora_name}.lora_up.weight'] = extract_b.detach().cpu().contiguous().half()
-                    loras[f'{lora_name}.alpha'] = torch.Tensor([extract_a.shape[0]]).half()
-                    if use_bias:
-                        diff = diff.detach().cpu().reshape(extract_b.size(0), -1)
-                        sparse_diff = make_sparse(diff, sparsity).to_sparse().coalesce()
-                        
-                        indices = sparse_diff.indices().to(torch.int16)
-                        values = sparse_diff.values().half()
-                        loras[f'{lora_name}.bias_indices'] = indices
-                        loras[f'{lora_name}.bias_values'] = values
-                        loras[f'{lora_name}.bias_size'] = torch.tensor(diff.shape).to(torch.int16)
-                    del extract_a, extract_b, diff
-                elif decompose_mode == 'full':
-                    loras[f'{lora_name}.diff'] = weight.detach().cpu().contiguous().half()
-                else:
-                    raise NotImplementedError
-        return loras
-    
-    text_encoder_loras = make_state_dict(
-        LORA_PREFIX_TEXT_ENCODER, 
-        base_model[0], db_model[0], 
-        TEXT_ENCODER_TARGET_REPLACE_MODULE
-    )
-    
-    unet_loras = make_state_dict(
-        LORA_PREFIX_UNET,
-        base_model[2], db_model[2], 
-        UNET_TARGET_REPLACE_MODULE,
-        UNET_TARGET_REPLACE_NAME
-    )
-    print(len(text_encoder_loras), len(unet_loras))
-    return text_encoder_loras|unet_loras
+        progress = tqdm(total=len(pairs), desc='Extracting')
+        if workers <= 1:
+            for pair in pairs:
+                loras.update(extract(pair))
+                progress.update(1)
+        else:
+            # bounded window so at most a few decompositions (and their deltas) are alive at once
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                pending = deque()
+                for pair in pairs:
+                    pending.append(pool.submit(extract, pair))
+                    if len(pending) >= 2 * workers:
+                        loras.update(pending.popleft().result())
+                        progress.update(1)
+                while pending:
+                    loras.update(pending.popleft().result())
+                    progress.update(1)
+        progress.close()
+    finally:
+        del pairs
+        for checkpoint in opened:
+            checkpoint.close()
+
+    text_encoder_loras = sum(1 for key in loras if key.startswith(LORA_PREFIX_TEXT_ENCODER))
+    print(text_encoder_loras, len(loras) - text_encoder_loras)
+    return loras
 
 
 def get_module(
@@ -403,14 +533,14 @@ def rebuild_weight(module_type, params, orig_weight, scale=1):
     elif module_type == 'kron':
         w1, w1a, w1b, w2, w2a, w2b, t1, t2, alpha = params
         if alpha is not None and (w1b is not None or w2b is not None):
-            scale *= alpha / (w1b.size(0) if w1b else w2b.size(0))
+            scale *= alpha / (w1b.size(0) if w1b is not None else w2b.size(0))
         if w1a is not None and w1b is not None:
-            if t1:
+            if t1 is not None:
                 w1 = cp_weight(w1a, w1b, t1)
             else:
                 w1 = w1a @ w1b
         if w2a is not None and w2b is not None:
-            if t2:
+            if t2 is not None:
                 w2 = cp_weight(w2a, w2b, t2)
             else:
                 w2 = w2a @ w2b
@@ -425,80 +555,258 @@ def rebuild_weight(module_type, params, orig_weight, scale=1):
     return merged
 
 
+# parameter names of each algorithm, in the order get_module returns them
+LYCORIS_PARAMS = {
+    'locon': ('lora_up.weight', 'lora_down.weight', 'lora_mid.weight', 'alpha'),
+    'hada': ('hada_w1_a', 'hada_w1_b', 'hada_w2_a', 'hada_w2_b', 'hada_t1', 'hada_t2', 'alpha'),
+    'ia3': ('weight', 'on_input'),
+    'kron': ('lokr_w1', 'lokr_w1_a', 'lokr_w1_b', 'lokr_w2', 'lokr_w2_a', 'lokr_w2_b', 'lokr_t1', 'lokr_t2', 'alpha'),
+    'full': ('diff',),
+}
+
+
+def index_lycoris(lyco_state_dict) -> Dict[str, Tuple[str, tuple]]:
+    # LoRA name -> (module type, params) for every module of a LyCORIS state dict or MappedSafetensors, in one
+    # pass over its keys; same result as get_module. Tensors are not copied or cast (mapped files stay lazy).
+    grouped = {}
+    for key in lyco_state_dict.keys():
+        lora_name, _, param = key.partition('.')
+        grouped.setdefault(lora_name, {})[param] = key
+    index = {}
+    for lora_name, params in grouped.items():
+        if 'lora_up.weight' in params:
+            module_type = 'locon'
+        elif 'hada_w1_a' in params:
+            module_type = 'hada'
+        elif 'weight' in params:
+            module_type = 'ia3'
+        elif 'lokr_w1' in params or 'lokr_w1_a' in params:
+            module_type = 'kron'
+        elif 'diff' in params:
+            module_type = 'full'
+        else:
+            continue
+        values = tuple(
+            lyco_state_dict[params[param]] if param in params else (False if param == 'on_input' else None)
+            for param in LYCORIS_PARAMS[module_type]
+        )
+        index[lora_name] = (module_type, values if module_type != 'full' else values[0])
+    return index
+
+
+def _cast_params(params, device):
+    if isinstance(params, torch.Tensor):
+        return params.to(device, torch.float32)
+    return tuple(p.to(device, torch.float32) if isinstance(p, torch.Tensor) and p.is_floating_point() else p for p in params)
+
+
+def _kron_factors(params):
+    w1, w1a, w1b, w2, w2a, w2b, t1, t2, alpha = params
+    if w1 is None:
+        w1 = w1a @ w1b
+    if w2 is None:
+        w2 = w2a @ w2b
+    return w1, w2
+
+
+def _batch_key(module_type, params, weight):
+    # modules with equal keys have their deltas rebuilt together; None keeps rebuild_weight for the module
+    shape = tuple(weight.shape)
+    if module_type == 'locon':
+        up, down, mid, alpha = params
+        if mid is None:
+            return module_type, shape, tuple(up.shape), tuple(down.shape)
+    elif module_type == 'hada':
+        w1a, w1b, w2a, w2b, t1, t2, alpha = params
+        if t1 is None and t2 is None:
+            return module_type, shape, tuple(w1a.shape), tuple(w1b.shape), tuple(w2a.shape), tuple(w2b.shape)
+    elif module_type == 'kron':
+        w1, w1a, w1b, w2, w2a, w2b, t1, t2, alpha = params
+        if t1 is None and t2 is None and (w2 is None or w2.dim() == 2):
+            w1_shape = tuple(w1.shape) if w1 is not None else (w1a.size(0), w1b.size(1))
+            w2_shape = tuple(w2.shape) if w2 is not None else (w2a.size(0), w2b.size(1))
+            return module_type, shape, w1_shape, w2_shape, w1 is None, w2 is None
+    return None
+
+
+def _alpha_scale(alpha, rank):
+    return float(alpha) / rank if alpha is not None else 1.0
+
+
+def rebuild_batch(module_type, batch_params, device = 'cpu') -> torch.Tensor:
+    # [n, ...] deltas of same-shape modules (see _batch_key), alpha scaling included, in fp32 on device
+    batch_params = [_cast_params(params, device) for params in batch_params]
+    if module_type == 'locon':
+        ups = torch.stack([up.reshape(up.size(0), -1) for up, _, _, _ in batch_params])
+        downs = torch.stack([down.reshape(down.size(0), -1) for _, down, _, _ in batch_params])
+        scales = [_alpha_scale(alpha, up.size(1)) for up, _, _, alpha in batch_params]
+        deltas = torch.bmm(ups, downs)
+    elif module_type == 'hada':
+        w1 = torch.bmm(torch.stack([p[0] for p in batch_params]), torch.stack([p[1] for p in batch_params]))
+        w2 = torch.bmm(torch.stack([p[2] for p in batch_params]), torch.stack([p[3] for p in batch_params]))
+        scales = [_alpha_scale(p[6], p[1].size(0)) for p in batch_params]
+        deltas = w1.mul_(w2)
+        del w2
+    elif module_type == 'kron':
+        factors = [_kron_factors(params) for params in batch_params]
+        w1 = torch.stack([w1 for w1, _ in factors])
+        w2 = torch.stack([w2 for _, w2 in factors])
+        scales = []
+        for params in batch_params:
+            w1b, w2b, alpha = params[2], params[5], params[8]
+            factorized = w1b if w1b is not None else w2b
+            scales.append(_alpha_scale(alpha, factorized.size(0)) if factorized is not None else 1.0)
+        n, a, b = w1.shape
+        _, c, d = w2.shape
+        # batched torch.kron: kron(w1, w2)[i * c + k, j * d + l] = w1[i, j] * w2[k, l]
+        deltas = torch.einsum('nij,nkl->nikjl', w1, w2).reshape(n, a * c, b * d)
+    else:
+        raise NotImplementedError(module_type)
+    return deltas.mul_(torch.tensor(scales, device=deltas.device, dtype=deltas.dtype).view(-1, *([1] * (deltas.dim() - 1))))
+
+
+@torch.no_grad()
+def merge_weights(
+    weights: Dict[str, torch.Tensor],
+    lyco_index: Dict[str, Tuple[str, tuple]],
+    scale: float = 1.0,
+    device = 'cpu',
+    batch_elements = 1 << 26,
+) -> int:
+    # Adds the LyCORIS deltas of lyco_index (see index_lycoris) to the matching tensors of weights (LoRA name ->
+    # weight, updated in place) and returns the number of merged modules. Parameters are cast to fp32 one module
+    # or batch at a time; same-shape locon/hada/kron modules are rebuilt together in chunks of at most
+    # batch_elements delta elements.
+    groups = {}
+    merged = 0
+    for lora_name, (module_type, params) in lyco_index.items():
+        weight = weights.get(lora_name)
+        if weight is None:
+            continue
+        key = _batch_key(module_type, params, weight)
+        if key is None:
+            result = rebuild_weight(module_type, _cast_params(params, device), weight.to(device, torch.float32), scale)
+            weight.copy_(result)
+            merged += 1
+        else:
+            groups.setdefault(key, []).append((params, weight))
+
+    for key, members in groups.items():
+        chunk = max(1, batch_elements // max(1, math.prod(key[1])))
+        for start in range(0, len(members), chunk):
+            batch = members[start:start + chunk]
+            deltas = rebuild_batch(key[0], [params for params, _ in batch], device)
+            for (_, weight), delta in zip(batch, deltas):
+                weight.add_(delta.reshape(weight.shape).to(weight.device), alpha=scale)
+            merged += len(batch)
+            del deltas
+    return merged
+
+
 def merge(
     base_model,
     lyco_state_dict,
     scale: float = 1.0,
     device = 'cpu'
 ):
-    UNET_TARGET_REPLACE_MODULE = [
-        "Transformer2DModel", 
-        "Attention", 
-        "ResnetBlock2D", 
-        "Downsample2D", 
-        "Upsample2D"
-    ]
-    UNET_TARGET_REPLACE_NAME = [
-        "conv_in",
-        "conv_out",
-        "time_embedding.linear_1",
-        "time_embedding.linear_2",
-    ]
-    TEXT_ENCODER_TARGET_REPLACE_MODULE = ["CLIPAttention", "CLIPMLP"]
-    LORA_PREFIX_UNET = 'lora_unet'
-    LORA_PREFIX_TEXT_ENCODER = 'lora_te'
-    merged = 0
-    def merge_state_dict(
-        prefix, 
-        root_module: torch.nn.Module,
-        lyco_state_dict: Dict[str,torch.Tensor],
-        target_replace_modules,
-        target_replace_names = []
-    ):
-        nonlocal merged
-        for name, module in tqdm(list(root_module.named_modules()), desc=f'Merging {prefix}'):
-            if module.__class__.__name__ in target_replace_modules:
-                for child_name, child_module in module.named_modules():
-                    if child_module.__class__.__name__ not in {'Linear', 'Conv2d'}:
-                        continue
-                    lora_name = prefix + '.' + name + '.' + child_name
-                    lora_name = lora_name.replace('.', '_')
-                    
-                    result = rebuild_weight(*get_module(
-                        lyco_state_dict, lora_name
-                    ), getattr(child_module, 'weight'), scale)
-                    if result is not None:
-                        merged += 1
-                        child_module.requires_grad_(False)
-                        child_module.weight.copy_(result)
-            elif name in target_replace_names:
-                lora_name = prefix + '.' + name
-                lora_name = lora_name.replace('.', '_')
-                    
-                result = rebuild_weight(*get_module(
-                    lyco_state_dict, lora_name
-                ), getattr(module, 'weight'), scale)
-                if result is not None:
-                    merged += 1
-                    module.requires_grad_(False)
-                    module.weight.copy_(result)
-    
-    if device == 'cpu':
-        for k, v in tqdm(list(lyco_state_dict.items()), desc='Converting Dtype'):
-            lyco_state_dict[k] = v.float()
-    
-    merge_state_dict(
-        LORA_PREFIX_TEXT_ENCODER,
-        base_model[0],
-        lyco_state_dict,
-        TEXT_ENCODER_TARGET_REPLACE_MODULE,
-        UNET_TARGET_REPLACE_NAME
-    )
-    merge_state_dict(
-        LORA_PREFIX_UNET,
-        base_model[2],
-        lyco_state_dict,
-        UNET_TARGET_REPLACE_MODULE,
-        UNET_TARGET_REPLACE_NAME
-    )
-    print(f'{merged} Modules been merged')
\ No newline at end of file
+    # base_model is the (text encoder, vae, unet) module tuple of the kohya SD1/SD2 loaders; lyco_state_dict a
+    # LyCORIS state dict or the path of a .safetensors file (memory-mapped).
+    opened = None
+    if isinstance(lyco_state_dict, str):
+        lyco_state_dict = opened = MappedSafetensors(lyco_state_dict)
+    try:
+        weights = module_layers(
+            LORA_PREFIX_TEXT_ENCODER, base_model[0], TEXT_ENCODER_TARGET_REPLACE_MODULE
+        ) | module_layers(
+            LORA_PREFIX_UNET, base_model[2], UNET_TARGET_REPLACE_MODULE, UNET_TARGET_REPLACE_NAME
+        )
+        for weight in weights.values():
+            weight.requires_grad_(False)
+        merged = merge_weights(weights, index_lycoris(lyco_state_dict), scale, device)
+    finally:
+        if opened is not None:
+            opened.close()
+    print(f'{merged} Modules been merged')
+
+
+@torch.no_grad()
+def merge_checkpoint(
+    base_path,
+    lyco_state_dict,
+    output_path,
+    scale: float = 1.0,
+    device = 'cpu',
+    dtype = None,
+    model_type = None,
+    window_bytes = 256 * 1024 ** 2,
+):
+    # Module-free merge of a single-file SD1/SD2/SDXL .safetensors checkpoint: the LoRA names are resolved through
+    # checkpoint_index.lora_layer_map, the base is memory-mapped and read in data order, and the output is written
+    # tensor by tensor to a precomputed header. Only the tensors with LyCORIS modules are copied (to fp32), at
+    # most window_bytes of them at a time so their deltas are still rebuilt in batches by merge_weights.
+    # Floating point tensors are saved as dtype (default: as stored). Returns (merged modules, unmatched names).
+    base = MappedSafetensors(base_path)
+    opened = None
+    if isinstance(lyco_state_dict, str):
+        lyco_state_dict = opened = MappedSafetensors(lyco_state_dict)
+    temp_path = output_path + '.part'
+    try:
+        lyco_index = index_lycoris(lyco_state_dict)
+        layers = lora_layer_map(checkpoint_shapes(base), model_type)
+        targets = {}  # checkpoint key -> LoRA names merged into it
+        unmatched = []
+        for lora_name in lyco_index:
+            ref = layers.get(lora_name)
+            if ref is None:
+                unmatched.append(lora_name)
+            else:
+                targets.setdefault(ref.key, []).append(lora_name)
+
+        keys = base.keys_by_offset()
+        out_dtypes = {
+            key: dtype if dtype is not None and base.dtype(key).is_floating_point else base.dtype(key)
+            for key in keys
+        }
+        header, data_size = safetensors_header([(key, out_dtypes[key], base.shape(key)) for key in keys], base.metadata)
+
+        merged = 0
+        with open(temp_path, 'wb') as f:
+            f.write(header)
+            window = []  # [(key, tensor)] in output order
+            window_size = 0
+
+            def flush():
+                nonlocal merged
+                tensors = {key: tensor for key, tensor in window if key in targets}
+                weights = {
+                    lora_name: load_layer(tensors, layers[lora_name])
+                    for key in tensors for lora_name in targets[key]
+                }
+                merged += merge_weights(weights, {lora_name: lyco_index[lora_name] for lora_name in weights}, scale, device)
+                for key, tensor in window:
+                    tensor = tensor.to(out_dtypes[key]).contiguous()
+                    f.write(tensor.reshape(-1).view(torch.uint8).numpy())
+                    del tensor
+                    base.release(key)
+                window.clear()
+
+            for key in tqdm(keys, desc='Merging'):
+                tensor = base.get_tensor(key)
+                if key in targets:
+                    tensor = tensor.to(torch.float32, copy=True)
+                    window_size += tensor.numel() * tensor.element_size()
+                window.append((key, tensor))
+                if window_size >= window_bytes:
+                    flush()
+                    window_size = 0
+            flush()
+            if f.tell() != len(header) + data_size:
+                raise RuntimeError(f'Wrote {f.tell()} bytes, expected {len(header) + data_size}')
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        base.close()
+        if opened is not None:
+            opened.close()
+    return merged, unmatched
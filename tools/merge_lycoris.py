@@ -40,28 +40,90 @@ def get_args():
     parser.add_argument(
         "--weight", help="weight for the lyco model to merge", default="1.0", type=float
     )
+    parser.add_argument(
+        "--load_models",
+        help=(
+            "always build the text encoder/UNet modules to merge into. By default a .safetensors base model "
+            "is merged tensor by tensor straight into a .safetensors output"
+        ),
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--window_mb",
+        help="direct merge: size of the fp32 copies of merged tensors kept in memory at once",
+        default=256,
+        type=int,
+    )
     return parser.parse_args()
 
 
 args = ARGS = get_args()
 
 
-from lycoris.utils import merge
-from lycoris.kohya.model_utils import (
-    load_models_from_stable_diffusion_checkpoint,
-    save_stable_diffusion_checkpoint,
-    load_file,
-)
-from lycoris.kohya.sdxl_model_util import (
-    load_models_from_sdxl_checkpoint,
-    save_stable_diffusion_checkpoint as save_sdxl_checkpoint,
-)
-
 import torch
 
 
+def is_safetensors(path):
+    return os.path.splitext(path)[1].lower() == ".safetensors"
+
+
+def get_dtype():
+    dtype_str = ARGS.dtype.replace("fp", "float").replace("bf", "bfloat")
+    dtype = {
+        "float": torch.float,
+        "float16": torch.float16,
+        "float32": torch.float32,
+        "float64": torch.float64,
+        "bfloat": torch.bfloat16,
+        "bfloat16": torch.bfloat16,
+    }.get(dtype_str, None)
+    if dtype is None:
+        raise ValueError(f'Cannot Find the dtype "{dtype}"')
+    return dtype
+
+
+def merge_direct():
+    # no model construction: the base checkpoint is memory-mapped and streamed to the output layer by layer
+    from lycoris_utils import merge_checkpoint
+
+    if ARGS.lycoris_model.rsplit(".", 1)[-1] == "safetensors":
+        lyco = ARGS.lycoris_model
+    else:
+        lyco = torch.load(ARGS.lycoris_model, map_location="cpu")
+    model_type = "sdxl" if ARGS.is_sdxl else "v2" if ARGS.is_v2 else None
+    merged, unmatched = merge_checkpoint(
+        ARGS.base_model,
+        lyco,
+        ARGS.output_name,
+        ARGS.weight,
+        ARGS.device,
+        get_dtype(),
+        model_type,
+        ARGS.window_mb * 1024**2,
+    )
+    print(f"{merged} Modules been merged")
+    if unmatched:
+        print(f"{len(unmatched)} LyCORIS modules have no matching layer in the base model, e.g. {unmatched[0]}")
+
+
 @torch.no_grad()
 def main():
+    if not args.load_models and is_safetensors(args.base_model) and is_safetensors(args.output_name):
+        merge_direct()
+        return
+
+    from lycoris.utils import merge
+    from lycoris.kohya.model_utils import (
+        load_models_from_stable_diffusion_checkpoint,
+        save_stable_diffusion_checkpoint,
+        load_file,
+    )
+    from lycoris.kohya.sdxl_model_util import (
+        load_models_from_sdxl_checkpoint,
+        save_stable_diffusion_checkpoint as save_sdxl_checkpoint,
+    )
+
     if args.is_sdxl:
         base = load_models_from_sdxl_checkpoint(
             None, args.base_model, map_location=args.device
@@ -73,17 +135,7 @@ def main():
     else:
         lyco = torch.load(ARGS.lycoris_model)
 
-    dtype_str = ARGS.dtype.replace("fp", "float").replace("bf", "bfloat")
-    dtype = {
-        "float": torch.float,
-        "float16": torch.float16,
-        "float32": torch.float32,
-        "float64": torch.float64,
-        "bfloat": torch.bfloat16,
-        "bfloat16": torch.bfloat16,
-    }.get(dtype_str, None)
-    if dtype is None:
-        raise ValueError(f'Cannot Find the dtype "{dtype}"')
+    dtype = get_dtype()
 
     if args.is_sdxl:
         base_tes = [base[0], base[1]]
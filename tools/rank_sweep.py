@@ -0,0 +1,143 @@
+import json
+import math
+
+import torch
+
+# Rank sweeps shared by resize_lora.py and extract_lora_from_models-new.py: parsing the --sweep settings, picking
+# the rank of every layer for all settings at once from the spectra the tool already computed, and the summary
+# table. Both tools go through sweep_ranks so a sweep row always matches what a plain run with that setting saves.
+
+SWEEP_METHODS = ["fixed", "sv_ratio", "sv_fro", "sv_cumulative", "sv_rel_decrease", "sv_knee", "sv_cumulative_knee"]
+PARAMLESS_METHODS = ("sv_knee", "sv_cumulative_knee")
+SAFETENSORS_DTYPE_NAMES = {torch.float32: "F32", torch.float16: "F16", torch.bfloat16: "BF16"}
+
+
+def index_sv_knee(S, MIN_SV_KNEE=1e-8):
+    n = len(S)
+    if n < 3: return 1
+    s_max, s_min = S[0], S[-1]
+    if s_max - s_min < MIN_SV_KNEE: return 1
+    s_normalized = (S - s_min) / (s_max - s_min)
+    x_normalized = torch.linspace(0, 1, n, device=S.device, dtype=S.dtype)
+    distances = (x_normalized + s_normalized - 1).abs()
+    knee_index_0based = torch.argmax(distances).item()
+    rank = knee_index_0based + 1
+    rank = max(1, min(rank, n - 1))
+    return rank
+
+
+def index_sv_cumulative_knee(S, min_sv_threshold=1e-8):
+    n = len(S)
+    if n < 3: return 1
+    s_sum = torch.sum(S)
+    if s_sum < min_sv_threshold: return 1
+    y_values = torch.cumsum(S, dim=0) / s_sum
+    y_min, y_max = y_values[0], y_values[n-1]
+    if y_max - y_min < min_sv_threshold: return 1
+    y_norm = (y_values - y_min) / (y_max - y_min)
+    x_norm = torch.linspace(0, 1, n, device=S.device, dtype=S.dtype)
+    distances = (y_norm - x_norm).abs()
+    knee_index_0based = torch.argmax(distances).item()
+    rank = knee_index_0based + 1
+    rank = max(1, min(rank, n - 1))
+    return rank
+
+
+def parse_sweep_settings(specs, methods=SWEEP_METHODS):
+    # "sv_fro:0.8,0.9" -> [("sv_fro", 0.8), ("sv_fro", 0.9)], "fixed:8,16" sweeps plain ranks, knee methods take no params
+    settings = []
+    for spec in specs:
+        method, _, params = spec.partition(":")
+        if method not in methods:
+            raise ValueError(f"Invalid sweep setting '{spec}', method must be one of {methods}")
+        if method in PARAMLESS_METHODS:
+            settings.append((method, None))
+            continue
+        if not params:
+            raise ValueError(f"Sweep setting '{spec}' needs parameters, e.g. {method}:0.5,0.9")
+        for param in params.split(","):
+            settings.append((method, int(param) if method == "fixed" else float(param)))
+    return settings
+
+
+def sweep_ranks(S_padded, lengths, method, params, max_rank, min_sv=1e-6, ratio_below_length=True):
+    """
+    Ranks of many params of one method at once. S_padded is (layers, n): every descending spectrum zero-padded to
+    the longest one, lengths holds each len(S). Returns ranks of shape (layers, len(params)).
+
+    The thresholded methods keep at most len(S) - 1 values like the index_sv_* helpers; resize_lora's sv_ratio
+    (rank_resize) may keep all of them, which ratio_below_length=False selects. max_rank caps every method but
+    "fixed", whose params are their own cap. A zero spectrum gets rank 1.
+    """
+    num_layers = S_padded.size(0)
+    values = torch.tensor([param or 0.0 for param in params], dtype=S_padded.dtype, device=S_padded.device)
+    values = values.expand(num_layers, -1).contiguous()
+    lengths = lengths.to(S_padded.device).unsqueeze(1)
+    upper = (lengths - 1).clamp(min=1)
+    if method == "sv_ratio":
+        # S is descending, so counting S > S[0] / param is a searchsorted on -S
+        ranks = torch.searchsorted(-S_padded.contiguous(), (-S_padded[:, :1] / values).contiguous()).clamp(min=1)
+        if ratio_below_length:
+            ranks = torch.minimum(ranks, upper)
+    elif method == "sv_cumulative":
+        cumulative = torch.cumsum(S_padded, dim=1) / torch.sum(S_padded, dim=1, keepdim=True)
+        ranks = torch.minimum((torch.searchsorted(cumulative.contiguous(), values) + 1).clamp(min=1), upper)
+    elif method == "sv_fro":
+        cumulative = torch.cumsum(S_padded.pow(2), dim=1) / torch.sum(S_padded.pow(2), dim=1, keepdim=True)
+        ranks = torch.minimum((torch.searchsorted(cumulative.contiguous(), values.pow(2)) + 1).clamp(min=1), upper)
+    elif method == "sv_rel_decrease":
+        # first k with S[k+1]/S[k] < tau == number of leading ratios whose running minimum stays >= tau; the zero
+        # padding (and 0/0 past the numerical rank) ends every scan at len(S)
+        ratios = torch.nan_to_num(S_padded[:, 1:] / S_padded[:, :-1], nan=0.0)
+        running_min = torch.cummin(ratios, dim=1).values
+        ranks = torch.searchsorted(-running_min.contiguous(), -values, right=True) + 1
+        ranks = torch.where(lengths < 2, torch.ones_like(ranks), ranks)
+    elif method in PARAMLESS_METHODS:
+        index_sv = index_sv_knee if method == "sv_knee" else index_sv_cumulative_knee
+        layer_ranks = [index_sv(S_padded[i, :int(lengths[i])], min_sv) for i in range(num_layers)]
+        ranks = torch.tensor(layer_ranks, dtype=torch.long, device=S_padded.device).unsqueeze(1).expand(-1, len(params))
+    else:
+        # fixed ranks are their own cap, like a plain run with that rank
+        ranks = values.to(torch.long)
+        max_rank = None
+    if max_rank is not None:
+        ranks = ranks.clamp(max=max_rank)
+    # zero matrix, set dim to 1
+    return torch.where(S_padded[:, :1] <= min_sv, torch.ones_like(ranks), ranks)
+
+
+def sweep_setting_ranks(S_padded, lengths, settings, max_rank, min_sv=1e-6, ratio_below_length=True):
+    # sweep_ranks for a list of (method, param) settings, one call per method; returns (layers, len(settings))
+    by_method = {}
+    for index, (method, param) in enumerate(settings):
+        by_method.setdefault(method, []).append((index, param))
+    ranks = torch.zeros(S_padded.size(0), len(settings), dtype=torch.long, device=S_padded.device)
+    for method, entries in by_method.items():
+        ranks[:, [index for index, _ in entries]] = sweep_ranks(
+            S_padded, lengths, method, [param for _, param in entries], max_rank, min_sv, ratio_below_length
+        )
+    return ranks
+
+
+def estimate_safetensors_size(tensor_shapes, dtype):
+    # Data plus the JSON header as safetensors writes it (user metadata not included)
+    itemsize = torch.tensor([], dtype=dtype).element_size()
+    header = {}
+    offset = 0
+    for name, shape in tensor_shapes.items():
+        nbytes = math.prod(shape) * itemsize
+        header[name] = {"dtype": SAFETENSORS_DTYPE_NAMES.get(dtype, "F32"), "shape": list(shape), "data_offsets": [offset, offset + nbytes]}
+        offset += nbytes
+    header_len = len(json.dumps(header, separators=(",", ":")))
+    return 8 + header_len + (-header_len % 8) + offset
+
+
+def sweep_table_lines(rows):
+    # One line per row dict (method, param, total_params, file_size, fro_retained, mean_fro_retained, mean_rank,
+    # max_rank) under a header line
+    lines = [f"{'setting':24} | {'params':>12} | {'size (MB)':>10} | {'fro retained':>12} | {'mean fro':>9} | {'mean rank':>9} | {'max rank':>8}"]
+    for row in rows:
+        setting = row["method"] if row["param"] is None else f"{row['method']}:{row['param']}"
+        lines.append(f"{setting:24} | {row['total_params']:>12,} | {row['file_size'] / 1024 ** 2:>10.2f} | {row['fro_retained']:>12.2%} | "
+                     f"{row['mean_fro_retained']:>9.2%} | {row['mean_rank']:>9.1f} | {row['max_rank']:>8}")
+    return lines
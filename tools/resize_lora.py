@@ -7,10 +7,13 @@
 # Thanks to cloneofsimo and kohya
 
 import argparse
+import os
 import torch
 from safetensors.torch import load_file, save_file, safe_open
 from tqdm import tqdm
 from library import train_util, model_util
+from svd_cache import add_svd_cache_arguments, svd_cache_from_args
+from rank_sweep import estimate_safetensors_size, parse_sweep_settings, sweep_setting_ranks, sweep_table_lines
 import numpy as np
 
 MIN_SV = 1e-6
@@ -127,6 +130,167 @@ def merge_linear(lora_down, lora_up, device):
     weight = lora_up @ lora_down
     del lora_up, lora_down
     return weight
+
+
+def _flatten_lora_pair(lora_down, lora_up):
+    # 2D views of the factors: up is (out, rank), down is (rank, in * k * k)
+    return lora_up.reshape(lora_up.size(0), -1), lora_down.reshape(lora_down.size(0), -1)
+
+
+def svd_factored(lora_up, lora_down):
+    # Exact SVD of lora_up @ lora_down straight from the factors, batched over dim 0.
+    # up = Qu Ru, down^T = Qd Rd  =>  up @ down = Qu (Ru Rd^T) Qd^T, so only a rank x rank SVD is needed.
+    Qu, Ru = torch.linalg.qr(lora_up)
+    Qd, Rd = torch.linalg.qr(lora_down.transpose(1, 2))
+    Um, S, Vmh = torch.linalg.svd(Ru @ Rd.transpose(1, 2), full_matrices=False)
+    U = Qu @ Um
+    Vh = Vmh @ Qd.transpose(1, 2)
+    return U, S, Vh
+
+
+def svd_randomized(lora_up, lora_down, q, power_iters=2, seed=0):
+    # Randomized truncated SVD (Halko et al.) of lora_up @ lora_down, batched over dim 0.
+    # The dense product is never built, every step is a matmul against the small factors.
+    batch, _, _ = lora_up.shape
+    in_size = lora_down.size(2)
+    generator = torch.Generator(device=lora_up.device).manual_seed(seed)
+    omega = torch.randn(batch, in_size, q, generator=generator, device=lora_up.device, dtype=lora_up.dtype)
+
+    Q, _ = torch.linalg.qr(lora_up @ (lora_down @ omega))
+    for _ in range(power_iters):
+        Z, _ = torch.linalg.qr(lora_down.transpose(1, 2) @ (lora_up.transpose(1, 2) @ Q))
+        Q, _ = torch.linalg.qr(lora_up @ (lora_down @ Z))
+
+    B = (Q.transpose(1, 2) @ lora_up) @ lora_down
+    Ub, S, Vh = torch.linalg.svd(B, full_matrices=False)
+    U = Q @ Ub
+    return U, S, Vh
+
+
+def lowrank_relative_error(up_a, down_a, up_b, down_b):
+    # ||up_a @ down_a - up_b @ down_b||_F / ||up_a @ down_a||_F without forming either product,
+    # using <u1 d1, u2 d2>_F = sum((u1^T u2) * (d1 d2^T)).
+    up_a, down_a = up_a.double(), down_a.double()
+    up_b, down_b = up_b.double(), down_b.double()
+
+    def inner(u1, d1, u2, d2):
+        return torch.sum((u1.T @ u2) * (d1 @ d2.T))
+
+    norm_a = inner(up_a, down_a, up_a, down_a)
+    err_sq = norm_a + inner(up_b, down_b, up_b, down_b) - 2 * inner(up_a, down_a, up_b, down_b)
+    if norm_a <= MIN_SV ** 2:
+        return 0.0
+    return float(torch.sqrt(torch.clamp(err_sq, min=0) / norm_a))
+
+
+def _param_dict_from_svd(U, S, Vh, full_len, down_shape, new_rank, dynamic_method, dynamic_param, scale=1, total_fro_sq=None):
+    # Builds the resized lora_up/lora_down of one module from a (possibly truncated) SVD of up @ down.
+    # S is padded to the length a full SVD would return so rank_resize behaves identically.
+    S_full = torch.zeros(full_len, device=S.device, dtype=S.dtype)
+    S_full[:S.size(0)] = S
+    param_dict = rank_resize(S_full, new_rank, dynamic_method, dynamic_param, scale)
+    lora_rank = param_dict["new_rank"]
+    if total_fro_sq is not None and total_fro_sq > MIN_SV ** 2:
+        # partial spectrum (randomized backend): measure retention against the exact total energy
+        retained_sq = torch.sum(S[:lora_rank].pow(2))
+        param_dict["fro_retained"] = float(torch.sqrt(torch.clamp(retained_sq / total_fro_sq, max=1.0)))
+
+    out_size = U.size(0)
+    kept = min(lora_rank, U.size(1), S.size(0))
+    up = torch.zeros(out_size, lora_rank, device=U.device, dtype=U.dtype)
+    down = torch.zeros(lora_rank, Vh.size(1), device=Vh.device, dtype=Vh.dtype)
+    up[:, :kept] = U[:, :kept] * S[:kept].unsqueeze(0)
+    down[:kept] = Vh[:kept]
+
+    if len(down_shape) == 4:
+        in_size, kernel_size = down_shape[1], down_shape[2]
+        param_dict["lora_down"] = down.reshape(lora_rank, in_size, kernel_size, kernel_size).cpu()
+        param_dict["lora_up"] = up.reshape(out_size, lora_rank, 1, 1).cpu()
+    else:
+        param_dict["lora_down"] = down.cpu()
+        param_dict["lora_up"] = up.cpu()
+    return param_dict
+
+
+def decompose_lora_pairs(pairs, device, batch_size=32, svd_cache=None, keep_rank=0):
+    # Exact SVD of every module's up @ down (factored backend, batched by shape), returns {block_name: (U, S, Vh)}.
+    # With an SVD cache, modules whose factors are unchanged since an earlier run are loaded instead.
+    decomposed = {}
+    misses = {}
+    for block_name, lora_down, lora_up in pairs:
+        key = None
+        if svd_cache is not None:
+            key = svd_cache.make_key(block_name, lora_down, lora_up, kind="lora_resize")
+            cached = svd_cache.load(key, keep_rank)
+            if cached is not None:
+                decomposed[block_name] = tuple(t.to(device) for t in cached)
+                continue
+        misses.setdefault((tuple(lora_down.shape), tuple(lora_up.shape)), []).append((block_name, key, lora_down, lora_up))
+
+    for members in misses.values():
+        for start in range(0, len(members), batch_size):
+            chunk = members[start:start + batch_size]
+            flat = [_flatten_lora_pair(lora_down, lora_up) for _, _, lora_down, lora_up in chunk]
+            ups = torch.stack([up for up, _ in flat]).to(device)
+            downs = torch.stack([down for _, down in flat]).to(device)
+            U, S, Vh = svd_factored(ups, downs)
+            for i, (block_name, key, _, _) in enumerate(chunk):
+                if svd_cache is not None:
+                    svd_cache.store(key, U[i], S[i], Vh[i], block_name, keep_rank=keep_rank)
+                decomposed[block_name] = (U[i], S[i], Vh[i])
+            del ups, downs
+    return decomposed
+
+
+def _full_svd_len(lora_down, lora_up):
+    return min(lora_up.size(0), lora_down.reshape(lora_down.size(0), -1).size(1))
+
+
+def resize_lora_cached(pairs, svd_cache, new_rank, dynamic_method, dynamic_param, device, scale=1, batch_size=32):
+    # Same output as resize_lora_batched, but each module's spectrum comes from the on-disk SVD cache when the
+    # factors are unchanged since an earlier run. Misses are decomposed exactly (factored backend) and stored,
+    # so later runs with other rank rules only redo the cheap rank selection.
+    decomposed = decompose_lora_pairs(pairs, device, batch_size, svd_cache, new_rank)
+    results = {}
+    for block_name, lora_down, lora_up in pairs:
+        U, S, Vh = decomposed.pop(block_name)
+        results[block_name] = _param_dict_from_svd(U, S, Vh, _full_svd_len(lora_down, lora_up), tuple(lora_down.shape), new_rank, dynamic_method, dynamic_param, scale)
+    return results
+
+
+def resize_lora_batched(pairs, new_rank, dynamic_method, dynamic_param, device, scale=1,
+                        backend="factored", batch_size=32, oversample=8, power_iters=2):
+    # pairs: list of (block_name, lora_down, lora_up). Modules sharing factor shapes are stacked and
+    # decomposed together; returns {block_name: param_dict} in the same format as extract_linear/extract_conv.
+    groups = {}
+    for block_name, lora_down, lora_up in pairs:
+        groups.setdefault((tuple(lora_down.shape), tuple(lora_up.shape)), []).append((block_name, lora_down, lora_up))
+
+    results = {}
+    for (down_shape, up_shape), members in groups.items():
+        for start in range(0, len(members), batch_size):
+            chunk = members[start:start + batch_size]
+            flat = [_flatten_lora_pair(lora_down, lora_up) for _, lora_down, lora_up in chunk]
+            ups = torch.stack([up for up, _ in flat]).to(device)
+            downs = torch.stack([down for _, down in flat]).to(device)
+            out_size, network_rank = ups.shape[1], ups.shape[2]
+            full_len = min(out_size, downs.shape[2])
+
+            if backend == "randomized":
+                # dynamic methods need the whole spectrum, which has at most network_rank non-zero values
+                wanted = network_rank if dynamic_method else min(new_rank, network_rank)
+                q = min(wanted + oversample, full_len)
+                U, S, Vh = svd_randomized(ups, downs, q, power_iters)
+                # the captured spectrum may be partial, take the total energy exactly from the factors
+                total_fro_sq = torch.sum((ups.transpose(1, 2) @ ups) * (downs @ downs.transpose(1, 2)), dim=(1, 2))
+            else:
+                U, S, Vh = svd_factored(ups, downs)
+
+            for i, (block_name, lora_down, lora_up) in enumerate(chunk):
+                results[block_name] = _param_dict_from_svd(U[i], S[i], Vh[i], full_len, down_shape, new_rank, dynamic_method, dynamic_param, scale,
+                                                           total_fro_sq[i] if backend == "randomized" else None)
+            del ups, downs, U, S, Vh
+    return results
   
 
 def rank_resize(S, rank, dynamic_method, dynamic_param, scale=1):
@@ -181,11 +345,9 @@ def rank_resize(S, rank, dynamic_method, dynamic_param, scale=1):
     return param_dict
 
 
-def resize_lora_model(lora_sd, new_rank, save_dtype, device, dynamic_method, dynamic_param, verbose):
+def get_network_dim_and_alpha(lora_sd):
   network_alpha = None
   network_dim = None
-  verbose_str = "\n"
-  fro_list = []
 
   # Extract loaded lora dim and alpha
   for key, value in lora_sd.items():
@@ -197,76 +359,240 @@ def resize_lora_model(lora_sd, new_rank, save_dtype, device, dynamic_method, dyn
       break
     if network_alpha is None:
       network_alpha = network_dim
+  return network_dim, network_alpha
+
+
+def pair_lora_weights(lora_sd):
+  lora_down_weight = None
+  lora_up_weight = None
+  block_down_name = None
+  block_up_name = None
 
+  # Pair up lora_down/lora_up weights per block first, so modules can be decomposed in batches
+  pairs = []
+  for key, value in lora_sd.items():
+    if 'lora_down' in key:
+      block_down_name = key.split(".")[0]
+      lora_down_weight = value
+    if 'lora_up' in key:
+      block_up_name = key.split(".")[0]
+      lora_up_weight = value
+
+    weights_loaded = (lora_down_weight is not None and lora_up_weight is not None)
+
+    if (block_down_name == block_up_name) and weights_loaded:
+      pairs.append((block_down_name, lora_down_weight, lora_up_weight))
+      block_down_name = None
+      block_up_name = None
+      lora_down_weight = None
+      lora_up_weight = None
+  return pairs
+
+
+def resize_lora_model(lora_sd, new_rank, save_dtype, device, dynamic_method, dynamic_param, verbose,
+                      svd_backend="full", svd_batch_size=32, svd_oversample=8, svd_power_iters=2, svd_error_report=False,
+                      svd_cache=None):
+  verbose_str = "\n"
+  fro_list = []
+  error_rows = []
+
+  network_dim, network_alpha = get_network_dim_and_alpha(lora_sd)
   scale = network_alpha/network_dim
 
   if dynamic_method:
     print(f"Dynamically determining new alphas and dims based off {dynamic_method}: {dynamic_param}, max rank is {new_rank}")
 
-  lora_down_weight = None
-  lora_up_weight = None
-
   o_lora_sd = lora_sd.copy()
-  block_down_name = None
-  block_up_name = None
+  pairs = pair_lora_weights(lora_sd)
 
   with torch.no_grad():
-    for key, value in tqdm(lora_sd.items()):
-      if 'lora_down' in key:
-        block_down_name = key.split(".")[0]
-        lora_down_weight = value
-      if 'lora_up' in key:
-        block_up_name = key.split(".")[0]
-        lora_up_weight = value
-
-      weights_loaded = (lora_down_weight is not None and lora_up_weight is not None)
-
-      if (block_down_name == block_up_name) and weights_loaded:
-
-        conv2d = (len(lora_down_weight.size()) == 4)
-
-        if conv2d:
-          full_weight_matrix = merge_conv(lora_down_weight, lora_up_weight, device)
-          param_dict = extract_conv(full_weight_matrix, new_rank, dynamic_method, dynamic_param, device, scale)
-        else:
-          full_weight_matrix = merge_linear(lora_down_weight, lora_up_weight, device)
-          param_dict = extract_linear(full_weight_matrix, new_rank, dynamic_method, dynamic_param, device, scale)
-
-        if verbose:
-          max_ratio = param_dict['max_ratio']
-          sum_retained = param_dict['sum_retained']
-          fro_retained = param_dict['fro_retained']
-          if not np.isnan(fro_retained):
-            fro_list.append(float(fro_retained))
-
-          verbose_str+=f"{block_down_name:75} | "
-          verbose_str+=f"sum(S) retained: {sum_retained:.1%}, fro retained: {fro_retained:.1%}, max(S) ratio: {max_ratio:0.1f}"
-
-        if verbose and dynamic_method:
-          verbose_str+=f", dynamic | dim: {param_dict['new_rank']}, alpha: {param_dict['new_alpha']}\n"
-        else:
-          verbose_str+=f"\n"
-
-        new_alpha = param_dict['new_alpha']
-        o_lora_sd[block_down_name + "." + "lora_down.weight"] = param_dict["lora_down"].to(save_dtype).contiguous()
-        o_lora_sd[block_up_name + "." + "lora_up.weight"] = param_dict["lora_up"].to(save_dtype).contiguous()
-        o_lora_sd[block_up_name + "." "alpha"] = torch.tensor(param_dict['new_alpha']).to(save_dtype)
-
-        block_down_name = None
-        block_up_name = None
-        lora_down_weight = None
-        lora_up_weight = None
-        weights_loaded = False
-        del param_dict
+    if svd_cache is not None:
+      print(f"Decomposing {len(pairs)} modules through the SVD cache...")
+      batched_results = resize_lora_cached(pairs, svd_cache, new_rank, dynamic_method, dynamic_param, device, scale, svd_batch_size)
+      print(svd_cache.summary())
+    elif svd_backend != "full":
+      print(f"Decomposing {len(pairs)} modules with the {svd_backend} SVD backend...")
+      batched_results = resize_lora_batched(pairs, new_rank, dynamic_method, dynamic_param, device, scale,
+                                            svd_backend, svd_batch_size, svd_oversample, svd_power_iters)
+
+    for block_name, lora_down_weight, lora_up_weight in tqdm(pairs):
+      conv2d = (len(lora_down_weight.size()) == 4)
+
+      if svd_cache is not None or svd_backend != "full":
+        param_dict = batched_results.pop(block_name)
+      elif conv2d:
+        full_weight_matrix = merge_conv(lora_down_weight, lora_up_weight, device)
+        param_dict = extract_conv(full_weight_matrix, new_rank, dynamic_method, dynamic_param, device, scale)
+      else:
+        full_weight_matrix = merge_linear(lora_down_weight, lora_up_weight, device)
+        param_dict = extract_linear(full_weight_matrix, new_rank, dynamic_method, dynamic_param, device, scale)
+
+      if svd_error_report:
+        orig_up, orig_down = _flatten_lora_pair(lora_down_weight, lora_up_weight)
+        new_up, new_down = _flatten_lora_pair(param_dict["lora_down"], param_dict["lora_up"])
+        rel_error = lowrank_relative_error(orig_up, orig_down, new_up, new_down)
+        # Eckart-Young: the best rank-k approximation leaves exactly the discarded part of the spectrum
+        optimal_error = float(np.sqrt(max(0.0, 1.0 - float(param_dict['fro_retained']) ** 2)))
+        error_rows.append((block_name, param_dict['new_rank'], rel_error, optimal_error))
+
+      if verbose:
+        max_ratio = param_dict['max_ratio']
+        sum_retained = param_dict['sum_retained']
+        fro_retained = param_dict['fro_retained']
+        if not np.isnan(fro_retained):
+          fro_list.append(float(fro_retained))
+
+        verbose_str+=f"{block_name:75} | "
+        verbose_str+=f"sum(S) retained: {sum_retained:.1%}, fro retained: {fro_retained:.1%}, max(S) ratio: {max_ratio:0.1f}"
+
+      if verbose and dynamic_method:
+        verbose_str+=f", dynamic | dim: {param_dict['new_rank']}, alpha: {param_dict['new_alpha']}\n"
+      else:
+        verbose_str+=f"\n"
+
+      new_alpha = param_dict['new_alpha']
+      o_lora_sd[block_name + "." + "lora_down.weight"] = param_dict["lora_down"].to(save_dtype).contiguous()
+      o_lora_sd[block_name + "." + "lora_up.weight"] = param_dict["lora_up"].to(save_dtype).contiguous()
+      o_lora_sd[block_name + "." "alpha"] = torch.tensor(param_dict['new_alpha']).to(save_dtype)
+
+      del param_dict
 
   if verbose:
     print(verbose_str)
 
     print(f"Average Frobenius norm retention: {np.mean(fro_list):.2%} | std: {np.std(fro_list):0.3f}")
+  if svd_error_report:
+    print_error_report(error_rows, svd_backend)
   print("resizing complete")
   return o_lora_sd, network_dim, new_alpha
 
 
+def print_error_report(error_rows, svd_backend):
+  # rel err is measured against the input LoRA; optimal is the truncation error of an exact SVD at that rank
+  print(f"\nPer-module reconstruction error ({svd_backend} backend):")
+  print(f"{'module':75} | {'rank':>4} | {'rel err':>10} | {'optimal':>10} | {'excess':>10}")
+  max_excess = 0.0
+  for block_name, rank, rel_error, optimal_error in error_rows:
+    excess = rel_error - optimal_error
+    max_excess = max(max_excess, abs(excess))
+    print(f"{block_name:75} | {rank:>4} | {rel_error:>10.3e} | {optimal_error:>10.3e} | {excess:>10.2e}")
+  if error_rows:
+    print(f"Mean rel err: {np.mean([row[2] for row in error_rows]):.3e} | max |rel err - optimal|: {max_excess:.2e}")
+
+
+# plain runs only support these (rank_resize), so neither does the sweep
+SWEEP_METHODS = ["fixed", "sv_ratio", "sv_fro", "sv_cumulative"]
+
+
+def sweep_lora_ranks(lora_sd, settings, new_rank, save_dtype, device, batch_size=32, svd_cache=None):
+  # Decomposes every module once and evaluates all (method, param) settings on the shared spectra.
+  # Returns the table rows plus what is needed to write any of the settings afterwards.
+  network_dim, network_alpha = get_network_dim_and_alpha(lora_sd)
+  scale = network_alpha/network_dim
+  pairs = pair_lora_weights(lora_sd)
+  keep_rank = max([new_rank] + [param for method, param in settings if method == "fixed"])
+  with torch.no_grad():
+    decomposed = decompose_lora_pairs(pairs, device, batch_size, svd_cache, keep_rank)
+
+  lengths = torch.tensor([_full_svd_len(lora_down, lora_up) for _, lora_down, lora_up in pairs])
+  S_padded = torch.zeros(len(pairs), int(lengths.max()))
+  for i, (block_name, _, _) in enumerate(pairs):
+    S = decomposed[block_name][1].float().cpu()
+    S_padded[i, :S.numel()] = S
+  energy = torch.cumsum(S_padded.pow(2), dim=1)
+  total_energy = energy[:, -1]
+
+  resized_blocks = {block_name for block_name, _, _ in pairs}
+  other_shapes = {key: tuple(value.shape) for key, value in lora_sd.items()
+                  if key.split(".")[0] not in resized_blocks and type(value) == torch.Tensor}
+
+  # rank_resize lets sv_ratio keep the whole spectrum
+  ranks = sweep_setting_ranks(S_padded, lengths, settings, new_rank, MIN_SV, ratio_below_length=False)
+
+  rows = []
+  for index, (method, param) in enumerate(settings):
+    layer_ranks = ranks[:, index]
+    retained = energy.gather(1, (layer_ranks.clamp(max=S_padded.size(1)) - 1).unsqueeze(1)).squeeze(1)
+    valid = total_energy > MIN_SV ** 2
+    fro_retained = float(torch.sqrt(retained.sum() / total_energy.sum()))
+    mean_fro = float(torch.sqrt(retained[valid] / total_energy[valid]).mean()) if valid.any() else 1.0
+    shapes = dict(other_shapes)
+    total_params = 0
+    for (block_name, lora_down, lora_up), rank in zip(pairs, layer_ranks.tolist()):
+      down_shape = (rank,) + tuple(lora_down.shape[1:])
+      up_shape = (lora_up.size(0), rank) + tuple(lora_up.shape[2:])
+      shapes[block_name + ".lora_down.weight"] = down_shape
+      shapes[block_name + ".lora_up.weight"] = up_shape
+      shapes[block_name + ".alpha"] = ()
+      total_params += int(np.prod(down_shape)) + int(np.prod(up_shape)) + 1
+    total_params += sum(int(np.prod(shape)) for shape in other_shapes.values())
+    rows.append({
+      "method": method, "param": param, "total_params": total_params,
+      "file_size": estimate_safetensors_size(shapes, save_dtype),
+      "fro_retained": fro_retained, "mean_fro_retained": mean_fro,
+      "mean_rank": float(layer_ranks.float().mean()), "max_rank": int(layer_ranks.max()),
+    })
+  return rows, pairs, decomposed, scale
+
+
+def build_swept_state_dict(lora_sd, pairs, decomposed, method, param, new_rank, save_dtype, scale):
+  # Same tensors a plain run with this setting would produce, built from the shared decompositions
+  dynamic_method, dynamic_param, rank_cap = (None, None, param) if method == "fixed" else (method, param, new_rank)
+  o_lora_sd = lora_sd.copy()
+  for block_name, lora_down, lora_up in pairs:
+    U, S, Vh = decomposed[block_name]
+    param_dict = _param_dict_from_svd(U, S, Vh, _full_svd_len(lora_down, lora_up), tuple(lora_down.shape), rank_cap, dynamic_method, dynamic_param, scale)
+    o_lora_sd[block_name + "." + "lora_down.weight"] = param_dict["lora_down"].to(save_dtype).contiguous()
+    o_lora_sd[block_name + "." + "lora_up.weight"] = param_dict["lora_up"].to(save_dtype).contiguous()
+    o_lora_sd[block_name + "." "alpha"] = torch.tensor(param_dict['new_alpha']).to(save_dtype)
+    new_alpha = param_dict['new_alpha']
+  return o_lora_sd, new_alpha
+
+
+def update_resize_metadata(metadata, dynamic_method, dynamic_param, new_rank, old_dim, new_alpha):
+  if metadata is None:
+    metadata = {}
+  else:
+    metadata = dict(metadata)
+
+  comment = metadata.get("ss_training_comment", "")
+
+  if not dynamic_method:
+    metadata["ss_training_comment"] = f"dimension is resized from {old_dim} to {new_rank}; {comment}"
+    metadata["ss_network_dim"] = str(new_rank)
+    metadata["ss_network_alpha"] = str(new_alpha)
+  else:
+    metadata["ss_training_comment"] = f"Dynamic resize with {dynamic_method}: {dynamic_param} from {old_dim}; {comment}"
+    metadata["ss_network_dim"] = 'Dynamic'
+    metadata["ss_network_alpha"] = 'Dynamic'
+  return metadata
+
+
+def sweep(args, lora_sd, metadata, save_dtype):
+  settings = parse_sweep_settings(args.sweep, SWEEP_METHODS)
+  print(f"Sweeping {len(settings)} rank settings, max rank is {args.new_rank}...")
+  rows, pairs, decomposed, scale = sweep_lora_ranks(lora_sd, settings, args.new_rank, save_dtype, args.device,
+                                                    args.svd_batch_size, svd_cache_from_args(args))
+  print("\n" + "\n".join(sweep_table_lines(rows)))
+  if not args.sweep_save:
+    return
+
+  old_dim, _ = get_network_dim_and_alpha(lora_sd)
+  root, ext = os.path.splitext(args.save_to)
+  for method, param in settings:
+    state_dict, new_alpha = build_swept_state_dict(lora_sd, pairs, decomposed, method, param, args.new_rank, save_dtype, scale)
+    if method == "fixed":
+      setting_metadata = update_resize_metadata(metadata, None, None, param, old_dim, new_alpha)
+    else:
+      setting_metadata = update_resize_metadata(metadata, method, param, args.new_rank, old_dim, new_alpha)
+    model_hash, legacy_hash = train_util.precalculate_safetensors_hashes(state_dict, setting_metadata)
+    setting_metadata["sshs_model_hash"] = model_hash
+    setting_metadata["sshs_legacy_hash"] = legacy_hash
+    save_path = f"{root}_{method}-{param}{ext}"
+    print(f"saving model to: {save_path}")
+    save_to_file(save_path, state_dict, state_dict, save_dtype, setting_metadata)
+
+
 def resize(args):
 
   def str_to_dtype(p):
@@ -281,6 +607,11 @@ def resize(args):
   if args.dynamic_method and not args.dynamic_param:
     raise Exception("If using dynamic_method, then dynamic_param is required")
 
+  if args.svd_backend == "randomized" and (args.svd_cache_dir or args.sweep):
+    # cached and swept spectra must be exact for every rank rule, randomized ones are truncated
+    print(f"Warning: {'--svd_cache_dir' if args.svd_cache_dir else '--sweep'} decomposes with the exact factored backend, "
+          "--svd_backend randomized, --svd_oversample and --svd_power_iters are ignored")
+
   merge_dtype = str_to_dtype('float')  # matmul method above only seems to work in float32
   save_dtype = str_to_dtype(args.save_precision)
   if save_dtype is None:
@@ -289,23 +620,17 @@ def resize(args):
   print("loading Model...")
   lora_sd, metadata = load_state_dict(args.model, merge_dtype)
 
+  if args.sweep:
+    sweep(args, lora_sd, metadata, save_dtype)
+    return
+
   print("Resizing Lora...")
-  state_dict, old_dim, new_alpha = resize_lora_model(lora_sd, args.new_rank, save_dtype, args.device, args.dynamic_method, args.dynamic_param, args.verbose)
+  state_dict, old_dim, new_alpha = resize_lora_model(lora_sd, args.new_rank, save_dtype, args.device, args.dynamic_method, args.dynamic_param, args.verbose,
+                                                     args.svd_backend, args.svd_batch_size, args.svd_oversample, args.svd_power_iters, args.svd_error_report,
+                                                     svd_cache_from_args(args))
 
   # update metadata
-  if metadata is None:
-    metadata = {}
-
-  comment = metadata.get("ss_training_comment", "")
-
-  if not args.dynamic_method:
-    metadata["ss_training_comment"] = f"dimension is resized from {old_dim} to {args.new_rank}; {comment}"
-    metadata["ss_network_dim"] = str(args.new_rank)
-    metadata["ss_network_alpha"] = str(new_alpha)
-  else:
-    metadata["ss_training_comment"] = f"Dynamic resize with {args.dynamic_method}: {args.dynamic_param} from {old_dim}; {comment}"
-    metadata["ss_network_dim"] = 'Dynamic'
-    metadata["ss_network_alpha"] = 'Dynamic'
+  metadata = update_resize_metadata(metadata, args.dynamic_method, args.dynamic_param, args.new_rank, old_dim, new_alpha)
 
   model_hash, legacy_hash = train_util.precalculate_safetensors_hashes(state_dict, metadata)
   metadata["sshs_model_hash"] = model_hash
@@ -333,6 +658,24 @@ if __name__ == '__main__':
                       help="Specify dynamic resizing method, --new_rank is used as a hard limit for max rank")
   parser.add_argument("--dynamic_param", type=float, default=None,
                       help="Specify target for dynamic reduction")
+  parser.add_argument("--svd_backend", type=str, default="full", choices=["full", "factored", "randomized"],
+                      help="SVD engine: full = dense SVD per module, factored = exact SVD through QR of lora_up/lora_down, "
+                           "randomized = truncated randomized SVD with power iterations. factored/randomized batch same-shaped modules. "
+                           "--svd_cache_dir and --sweep always use factored")
+  parser.add_argument("--svd_batch_size", type=int, default=32,
+                      help="Max number of same-shaped modules decomposed together by the factored/randomized backends")
+  parser.add_argument("--svd_oversample", type=int, default=8,
+                      help="Extra sample vectors for the randomized backend")
+  parser.add_argument("--svd_power_iters", type=int, default=2,
+                      help="Power iterations for the randomized backend")
+  parser.add_argument("--svd_error_report", action="store_true",
+                      help="Print the per-module relative reconstruction error against the input LoRA")
+  add_svd_cache_arguments(parser)
+  parser.add_argument("--sweep", type=str, nargs="+", default=None,
+                      help="Evaluate many rank settings from one decomposition and print params / size / retained Frobenius norm per setting, "
+                           "e.g. --sweep sv_fro:0.8,0.9,0.95 sv_ratio:4,8 fixed:8,16. --new_rank caps the dynamic methods")
+  parser.add_argument("--sweep_save", action="store_true",
+                      help="With --sweep, also save every setting next to --save_to as <name>_<method>-<param>.safetensors")
                                            
 
   args = parser.parse_args()
@@ -0,0 +1,60 @@
+import json
+import struct
+from typing import BinaryIO, Tuple
+
+# The one .safetensors header parser, shared by the tools (checkpoint_index.MappedSafetensors,
+# extract_model_difference) and the GUI's header-only index (kohya_gui/safetensors_index.py). Kept free of torch
+# so the GUI can read headers without importing it.
+
+MAX_HEADER_SIZE = 100 * 1024 * 1024  # same limit safetensors itself enforces
+
+# bytes per element of every safetensors dtype, for sizing tensors from a header alone
+SAFETENSORS_ITEMSIZES = {
+    "F64": 8, "F32": 4, "F16": 2, "BF16": 2, "F8_E4M3": 1, "F8_E5M2": 1,
+    "I64": 8, "I32": 4, "I16": 2, "I8": 1, "U64": 8, "U32": 4, "U16": 2, "U8": 1, "BOOL": 1,
+}
+
+
+def read_header(f: BinaryIO, name: str = "") -> Tuple[dict, int]:
+    """
+    Parses the header of a .safetensors file opened in binary mode at its start.
+
+    Returns:
+        tuple: (header, data_start). header maps tensor names to {"dtype", "shape", "data_offsets"} and keeps the
+               "__metadata__" entry if the file has one; data_offsets are relative to data_start.
+    """
+    size_bytes = f.read(8)
+    if len(size_bytes) != 8:
+        raise ValueError(f"Invalid safetensors file {name}: too short")
+    header_size = struct.unpack("<Q", size_bytes)[0]
+    if header_size > MAX_HEADER_SIZE:
+        raise ValueError(f"Invalid safetensors header size {header_size} in {name}")
+    return json.loads(f.read(header_size)), 8 + header_size
+
+
+def read_safetensors_header(path: str) -> dict:
+    """
+    Reads only the JSON header of a .safetensors file, "__metadata__" entry included.
+    """
+    with open(path, "rb") as f:
+        return read_header(f, path)[0]
+
+
+def sort_header_metadata(path: str) -> None:
+    """
+    Rewrites the header of a saved .safetensors file in place with its "__metadata__" keys sorted. safetensors writes
+    them in hash order, which changes from process to process, so this makes identical saves byte-identical. The
+    header keeps its size (padded with spaces as safetensors pads it), so the tensor data is left as it is.
+    """
+    with open(path, "r+b") as f:
+        header, data_start = read_header(f, path)
+        metadata = header.pop("__metadata__", None)
+        if not metadata:
+            return
+        header_bytes = json.dumps(
+            {"__metadata__": dict(sorted(metadata.items())), **header}, separators=(",", ":"), ensure_ascii=False
+        ).encode("utf-8")
+        if len(header_bytes) > data_start - 8:
+            return
+        f.seek(8)
+        f.write(header_bytes.ljust(data_start - 8, b" "))
@@ -0,0 +1,151 @@
+import hashlib
+import os
+import threading
+
+import torch
+from safetensors.torch import load_file, save_file
+
+# Content-addressed on-disk cache of per-layer SVD spectra, shared by the extraction/resize tools.
+#
+# Entries are keyed by a hash of the tensor(s) the decomposition was computed from plus the layer name and
+# a "kind" tag, so a cached spectrum is only reused for exactly the same weights. Each entry keeps the full
+# singular values and U/Vh truncated to `max_rank` columns/rows, which is all any of the rank rules
+# (fixed, sv_ratio, sv_fro, sv_cumulative, knee methods, ...) need. Entries are written atomically one file
+# per layer, so an interrupted run resumes from whatever was already decomposed. The total size on disk is
+# bounded; least recently used entries are evicted first.
+
+CACHE_FORMAT_VERSION = "1"
+
+
+def tensor_digest(*tensors: torch.Tensor, salt: str = "") -> str:
+    hasher = hashlib.blake2b(digest_size=20)
+    hasher.update(f"v{CACHE_FORMAT_VERSION}|{salt}".encode("utf-8"))
+    for tensor in tensors:
+        tensor = tensor.detach().contiguous().cpu()
+        hasher.update(f"|{tensor.dtype}|{tuple(tensor.shape)}|".encode("utf-8"))
+        hasher.update(tensor.reshape(-1).view(torch.uint8).numpy().tobytes())
+    return hasher.hexdigest()
+
+
+class SVDCache:
+    def __init__(self, cache_dir: str, max_rank: int = 128, max_size_gb: float = 10.0, verbose: bool = False):
+        self.cache_dir = cache_dir
+        self.max_rank = max_rank
+        self.max_bytes = int(max_size_gb * 1024 ** 3)
+        self.verbose = verbose
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()  # the bookkeeping is shared by the decomposition worker threads
+        os.makedirs(cache_dir, exist_ok=True)
+        self._entries = {}  # path -> (last use, size), kept in sync with the directory for eviction
+        for root, _, files in os.walk(cache_dir):
+            for name in files:
+                if name.endswith(".safetensors"):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    self._entries[path] = (stat.st_mtime, stat.st_size)
+        self._total_bytes = sum(size for _, size in self._entries.values())
+
+    def make_key(self, layer_name: str, *tensors: torch.Tensor, kind: str = "svd") -> str:
+        return tensor_digest(*tensors, salt=f"{kind}|{layer_name}")
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".safetensors")
+
+    def load(self, key: str, min_rank: int = 0):
+        # Returns (U, S, Vh) with S complete and U/Vh holding at least min_rank components (or the whole
+        # spectrum when it is shorter), or None if there is no usable entry. Counted as a hit or miss.
+        cached = self._load(key, min_rank)
+        with self._lock:
+            if cached is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return cached
+
+    def _load(self, key: str, min_rank: int):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            entry = load_file(path)
+        except Exception as e:
+            print(f"SVD cache: dropping unreadable entry {path}: {e}")
+            self._remove(path)
+            return None
+        U, S, Vh = entry["U"], entry["S"], entry["Vh"]
+        if U.shape[1] < min(min_rank, S.numel()):
+            return None
+        try:
+            os.utime(path)  # mtime doubles as the LRU timestamp
+            with self._lock:
+                self._entries[path] = (os.path.getmtime(path), os.path.getsize(path))
+        except OSError:
+            pass
+        return U, S, Vh
+
+    def store(self, key: str, U: torch.Tensor, S: torch.Tensor, Vh: torch.Tensor, layer_name: str = "", keep_rank: int = 0):
+        keep = min(max(self.max_rank, keep_rank), S.numel())
+        tensors = {
+            "U": U[:, :keep].detach().float().cpu().contiguous(),
+            "S": S.detach().float().cpu().contiguous(),
+            "Vh": Vh[:keep, :].detach().float().cpu().contiguous(),
+        }
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.part"
+        save_file(tensors, tmp_path, metadata={"layer_name": layer_name, "format": CACHE_FORMAT_VERSION, "rank": str(keep)})
+        os.replace(tmp_path, path)
+        stat = os.stat(path)
+        with self._lock:
+            self._total_bytes += stat.st_size - self._entries.get(path, (0, 0))[1]
+            self._entries[path] = (stat.st_mtime, stat.st_size)
+            self._evict(keep_path=path)
+
+    def svd(self, layer_name: str, matrix: torch.Tensor, key_tensors=None, kind: str = "svd", min_rank: int = 0):
+        # Cached torch.linalg.svd(matrix, full_matrices=False). key_tensors defaults to the matrix itself;
+        # callers that derive the matrix from other tensors may key on those instead to skip the derivation.
+        key = self.make_key(layer_name, *(key_tensors if key_tensors is not None else (matrix,)), kind=kind)
+        cached = self.load(key, min_rank)
+        if cached is not None:
+            return tuple(t.to(matrix.device) for t in cached)
+        U, S, Vh = torch.linalg.svd(matrix.float(), full_matrices=False)
+        self.store(key, U, S, Vh, layer_name, keep_rank=min_rank)
+        return U, S, Vh
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        with self._lock:
+            _, size = self._entries.pop(path, (0, 0))
+            self._total_bytes -= size
+
+    def _evict(self, keep_path: str = None):
+        if self._total_bytes <= self.max_bytes:
+            return
+        for path, _ in sorted(self._entries.items(), key=lambda item: item[1][0]):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if path == keep_path:
+                continue
+            self._remove(path)
+            if self.verbose:
+                print(f"SVD cache: evicted {os.path.basename(path)}")
+
+    def summary(self) -> str:
+        return (f"SVD cache: {self.hits} hits, {self.misses} misses, {len(self._entries)} entries, "
+                f"{self._total_bytes / 1024 ** 2:.1f} MiB in {self.cache_dir}")
+
+
+def add_svd_cache_arguments(parser):
+    parser.add_argument("--svd_cache_dir", type=str, default=None, help="Directory for the on-disk SVD cache. Reruns on the same weights reuse cached spectra instead of recomputing the SVD.")
+    parser.add_argument("--svd_cache_max_rank", type=int, default=128, help="Number of singular vectors kept per cached layer (all singular values are always kept).")
+    parser.add_argument("--svd_cache_max_gb", type=float, default=10.0, help="Size limit of the SVD cache; least recently used entries are evicted beyond it.")
+
+
+def svd_cache_from_args(args) -> "SVDCache | None":
+    if not getattr(args, "svd_cache_dir", None):
+        return None
+    return SVDCache(args.svd_cache_dir, args.svd_cache_max_rank, args.svd_cache_max_gb, getattr(args, "verbose", False))
@@ -0,0 +1,339 @@
+import argparse
+import gc
+import hmac
+import io
+import json
+import os
+import runpy
+import secrets
+import signal
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+import safetensors.torch
+import torch
+
+from checkpoint_index import MappedSafetensors
+
+# Long-running process that runs the GUI utilities (LyCORIS extract/merge, model conversion, LoRA merge/verify
+# scripts) in-process, so back to back jobs do not each pay for a fresh interpreter, the torch import and cold
+# reads of the same multi-GB checkpoints.
+#
+# Clients connect to 127.0.0.1 on the port written to the state file, send one JSON line
+# {"token": ..., "argv": [script, *args], "env": {...}, "cwd": ...} and read JSON lines back: {"error": ...} if the
+# job is refused, else {"started": true}, then {"stdout": text} / {"stderr": text} while it runs and
+# {"returncode": n} at the end. {"heartbeat": true} is sent every HEARTBEAT_INTERVAL seconds while a job waits or
+# runs, so clients can tell a slow job from a daemon that stopped responding. Jobs run one at a time; only scripts
+# inside this repository are accepted.
+# kohya_gui/tool_daemon_client.py submits the GUI jobs here and falls back to a subprocess without a daemon.
+#
+# Modules imported by a job stay imported, so edits to the scripts' helper modules need a daemon restart.
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_STATE_FILE = os.environ.get("KOHYA_TOOL_DAEMON_STATE") or os.path.join(
+    os.path.expanduser("~"), ".cache", "kohya_ss", "tool_daemon.json"
+)
+HEARTBEAT_INTERVAL = 5.0
+
+_load_file = safetensors.torch.load_file
+
+
+class CheckpointCache:
+    """
+    LRU of memory-mapped .safetensors checkpoints, bounded by their total file size.
+
+    `load_file` replaces safetensors.torch.load_file for the jobs: it returns zero-copy views of a copy-on-write map
+    private to the call, so a job that modifies the loaded tensors in place only pays for the pages it touches and
+    never changes what later jobs read. The cache keeps a map of each recently used file open and has the kernel
+    read it ahead, so the next job on the same base model finds it in memory instead of reading it from disk.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._maps = OrderedDict()  # real path -> ((size, mtime), MappedSafetensors)
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def touch(self, path: str) -> None:
+        """
+        Marks path as most recently used, mapping it if it is not cached yet (or changed since).
+        """
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        key = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            entry = self._maps.pop(path, None)
+            if entry is not None and entry[0] != key:
+                self._evict(entry)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                if stat.st_size > self.max_bytes:
+                    return
+                entry = (key, MappedSafetensors(path))
+                self._nbytes += stat.st_size
+            else:
+                self.hits += 1
+            self._maps[path] = entry
+            entry[1].prefetch()
+            while self._nbytes > self.max_bytes:
+                self._evict(self._maps.popitem(last=False)[1])
+
+    def _evict(self, entry):
+        self._nbytes -= entry[0][0]
+        entry[1].close()
+
+    def load_file(self, filename, device="cpu"):
+        if str(device) != "cpu":
+            return _load_file(filename, device=device)
+        path = os.fspath(filename)
+        self.touch(path)
+        # not closed here: the map is released with the last tensor that views it
+        mapped = MappedSafetensors(path)
+        return {key: mapped.get_tensor(key) for key in mapped.keys()}
+
+    def clear(self):
+        with self._lock:
+            while self._maps:
+                self._evict(self._maps.popitem()[1])
+
+    def __len__(self):
+        return len(self._maps)
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+
+class JobOutput(io.TextIOBase):
+    """
+    sys.stdout / sys.stderr of the daemon: forwards to the client of the running job, otherwise to the console.
+    Installed once, so loggers and progress bars a job creates keep writing to whichever job runs next.
+    """
+
+    def __init__(self, name: str, console):
+        self.name = name
+        self.console = console
+        self.sink = None
+
+    @property
+    def encoding(self):
+        return "utf-8"
+
+    def writable(self):
+        return True
+
+    def isatty(self):
+        return False
+
+    def fileno(self):
+        return self.console.fileno()
+
+    def write(self, text):
+        sink = self.sink
+        if sink is None:
+            return self.console.write(text)
+        sink(self.name, text)
+        return len(text)
+
+    def flush(self):
+        if self.sink is None:
+            self.console.flush()
+
+
+def _returncode(exit_code):
+    if exit_code is None:
+        return 0
+    if isinstance(exit_code, int):
+        return exit_code
+    print(exit_code, file=sys.stderr)
+    return 1
+
+
+class ToolDaemon(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port: int, token: str, cache: CheckpointCache):
+        super().__init__(("127.0.0.1", port), JobHandler)
+        self.token = token
+        self.cache = cache
+        self.job_lock = threading.Lock()
+        self.stdout = JobOutput("stdout", sys.__stdout__)
+        self.stderr = JobOutput("stderr", sys.__stderr__)
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+
+    def log(self, message):
+        print(f"[tool daemon] {message}", file=sys.__stdout__, flush=True)
+
+    def check_script(self, argv):
+        if not isinstance(argv, list) or not argv or not all(isinstance(arg, str) for arg in argv):
+            return "argv must be a non-empty list of strings"
+        script = os.path.realpath(argv[0])
+        if not script.endswith(".py") or not os.path.isfile(script):
+            return f"{argv[0]} is not a Python script"
+        if os.path.commonpath([script, REPO_DIR]) != REPO_DIR:
+            return f"{argv[0]} is outside of {REPO_DIR}"
+        return None
+
+    def run_job(self, argv, env, cwd, send):
+        """
+        Runs script argv[0] as __main__ with sys.argv = argv, the environment env and working directory cwd, like
+        `python *argv` would, with its output sent through send(stream name, text). Returns the exit code.
+        """
+        saved_argv, saved_path, saved_cwd, saved_env = sys.argv, sys.path[:], os.getcwd(), dict(os.environ)
+        self.stdout.sink = self.stderr.sink = send
+        try:
+            if env:
+                os.environ.clear()
+                os.environ.update(env)
+            python_path = [path for path in os.environ.get("PYTHONPATH", "").split(os.pathsep) if path]
+            sys.path[:] = [os.path.dirname(os.path.abspath(argv[0]))] + python_path + saved_path
+            sys.argv = list(argv)
+            if cwd:
+                os.chdir(cwd)
+            try:
+                runpy.run_path(argv[0], run_name="__main__")
+                return 0
+            except SystemExit as e:
+                return _returncode(e.code)
+            except Exception:
+                traceback.print_exc()
+                return 1
+        finally:
+            self.stdout.sink = self.stderr.sink = None
+            sys.argv = saved_argv
+            sys.path[:] = saved_path
+            os.chdir(saved_cwd)
+            os.environ.clear()
+            os.environ.update(saved_env)
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.connected = True
+        self.send_lock = threading.Lock()
+
+    def send(self, **message):
+        if not self.connected:
+            return
+        with self.send_lock:
+            try:
+                self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+                self.wfile.flush()
+            except OSError:
+                # the client went away; the job still runs to completion
+                self.connected = False
+
+    def handle(self):
+        server = self.server
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        if not hmac.compare_digest(str(request.get("token", "")), server.token):
+            self.send(error="invalid token")
+            return
+        argv = request.get("argv")
+        error = server.check_script(argv)
+        if error is not None:
+            self.send(error=error)
+            return
+
+        stop_heartbeat = threading.Event()
+        threading.Thread(target=self.heartbeat, args=(stop_heartbeat,), daemon=True).start()
+        try:
+            with server.job_lock:
+                self.send(started=True)
+                server.log(f"running {' '.join(argv)}")
+                start = time.perf_counter()
+                returncode = server.run_job(
+                    argv, request.get("env"), request.get("cwd"), lambda name, text: self.send(**{name: text})
+                )
+                cache = server.cache
+                server.log(
+                    f"exit code {returncode} after {time.perf_counter() - start:.1f}s, "
+                    f"{len(cache)} checkpoints ({cache.nbytes / 1024 ** 3:.1f} GiB) cached, "
+                    f"{cache.hits} hits / {cache.misses} misses"
+                )
+        finally:
+            stop_heartbeat.set()
+        self.send(returncode=returncode)
+
+    def heartbeat(self, stop):
+        while not stop.wait(HEARTBEAT_INTERVAL) and self.connected:
+            self.send(heartbeat=True)
+
+
+def write_state_file(path, port, token):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)
+    # readable by this user only: the token lets its holder run the repository's scripts
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump({"host": "127.0.0.1", "port": port, "token": token, "pid": os.getpid()}, f)
+
+
+def remove_state_file(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            if json.load(f).get("pid") != os.getpid():
+                return
+        os.remove(path)
+    except (OSError, ValueError):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the GUI utilities in one long-running process that keeps recently used checkpoints mapped"
+    )
+    parser.add_argument("--port", type=int, default=0, help="Port to listen on at 127.0.0.1 (0: any free port)")
+    parser.add_argument(
+        "--cache_gb", type=float, default=32, help="Total size of the checkpoints kept memory-mapped, in GiB"
+    )
+    parser.add_argument(
+        "--state_file",
+        type=str,
+        default=DEFAULT_STATE_FILE,
+        help="Where to write the port and access token the GUI reads (also set by KOHYA_TOOL_DAEMON_STATE)",
+    )
+    parser.add_argument(
+        "--preload", type=str, nargs="*", default=[], help=".safetensors checkpoints to map and read ahead at start"
+    )
+    args = parser.parse_args()
+
+    cache = CheckpointCache(int(args.cache_gb * 1024 ** 3))
+    safetensors.torch.load_file = cache.load_file
+    for path in args.preload:
+        cache.touch(path)
+
+    server = ToolDaemon(args.port, secrets.token_hex(32), cache)
+    port = server.server_address[1]
+    write_state_file(args.state_file, port, server.token)
+    server.log(f"listening on 127.0.0.1:{port}, state file {args.state_file}")
+    # exit through the cleanup below when terminated, not only on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        remove_state_file(args.state_file)
+        cache.clear()
+
+
+if __name__ == "__main__":
+    main()